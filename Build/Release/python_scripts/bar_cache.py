@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar cache of the bar and minute data csv files so the dates are only
+parsed once. The first read of a csv saves the index and each column as a
+.npy file, later reads memory map these instead of parsing the csv again.
+
+Entries are keyed by the path, modified time and size of the csv so an
+edited file is read again. The cache directory is kept under a size limit by
+removing the least recently used entries.
+
+The cache directory defaults to bar_cache next to this script and can be
+changed with the NITRADE_BAR_CACHE environment variable.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+CACHE_DIR = os.environ.get("NITRADE_BAR_CACHE",
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), "bar_cache"))
+
+#total size the cache directory is trimmed to after a new entry is added
+MAX_CACHE_BYTES = 20 * 1024 ** 3
+
+META_FILE = "meta.json"
+INDEX_FILE = "index.npy"
+
+
+def _source_info(filename):
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    return path, stat.st_mtime_ns, stat.st_size
+
+
+def _entry_dir(cache_dir, path, mtime, size):
+    key = hashlib.sha1("{0}|{1}|{2}".format(path, mtime, size).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, key)
+
+
+def _entry_size(entry):
+    return sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+
+
+def read_csv(filename, cache_dir=None, max_bytes=None):
+    """ Same as pd.read_csv(filename, index_col=0, parse_dates=True) but
+    served from the cache when the file hasn't changed
+
+    Args:
+        filename (str): path of the csv
+        cache_dir (str): the cache directory, CACHE_DIR if None
+        max_bytes (int): size limit of the cache directory, MAX_CACHE_BYTES
+            if None
+
+    Returns:
+        pd.DataFrame: the csv data indexed by the first column
+
+    """
+
+    import pandas as pd
+
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    path, mtime, size = _source_info(filename)
+    entry = _entry_dir(cache_dir, path, mtime, size)
+
+    if os.path.isfile(os.path.join(entry, META_FILE)):
+        return _load(entry)
+
+    dataset = pd.read_csv(path, index_col=0, parse_dates=True)
+    if _save(dataset, entry, path, mtime, size):
+        #the csv for this path has changed so the old entries are no use
+        invalidate(filename, cache_dir, keep=entry)
+        evict(max_bytes, cache_dir)
+    return dataset
+
+
+def _save(dataset, entry, path, mtime, size):
+    #only date indexes are cached as these are what are slow to parse
+    if dataset.index.dtype.kind != 'M':
+        return False
+
+    columns = []
+    for i, name in enumerate(dataset.columns):
+        series = dataset.iloc[:, i]
+        kind = series.dtype.kind
+        column = {"name": name, "file": "c{0}.npy".format(i), "dtype": str(series.dtype)}
+        if kind in 'biufM':
+            column["values"] = series.to_numpy()
+        elif kind in 'OU' or str(series.dtype) == 'str':
+            #text columns are saved as fixed width unicode with a mask of the missing values
+            missing = series.isna().to_numpy()
+            column["values"] = np.where(missing, "", series.astype(object).to_numpy()).astype(str)
+            column["missing"] = missing
+            column["missing_file"] = "m{0}.npy".format(i)
+        else:
+            return False
+        columns.append(column)
+
+    #write into a temporary directory then rename so a part written entry is never read
+    temp = entry + ".tmp{0}".format(os.getpid())
+    os.makedirs(temp, exist_ok=True)
+    try:
+        np.save(os.path.join(temp, INDEX_FILE), dataset.index.to_numpy())
+        for column in columns:
+            np.save(os.path.join(temp, column["file"]), column.pop("values"))
+            if "missing" in column:
+                np.save(os.path.join(temp, column["missing_file"]), column.pop("missing"))
+
+        meta = {"source": path, "mtime": mtime, "size": size,
+                "index_name": dataset.index.name, "columns": columns}
+        with open(os.path.join(temp, META_FILE), "w") as f:
+            json.dump(meta, f)
+
+        os.replace(temp, entry)
+    except OSError:
+        shutil.rmtree(temp, ignore_errors=True)
+        return False
+    return True
+
+
+def _load(entry):
+
+    import pandas as pd
+
+    with open(os.path.join(entry, META_FILE)) as f:
+        meta = json.load(f)
+
+    #mark the entry as used for the eviction order
+    os.utime(os.path.join(entry, META_FILE))
+
+    index = pd.DatetimeIndex(np.load(os.path.join(entry, INDEX_FILE), mmap_mode='r'), name=meta["index_name"])
+    data = {}
+    for column in meta["columns"]:
+        values = np.load(os.path.join(entry, column["file"]), mmap_mode='r')
+        if "missing_file" in column:
+            values = values.astype(object)
+            values[np.load(os.path.join(entry, column["missing_file"]))] = np.nan
+            data[column["name"]] = pd.Series(values, index=index).astype(column["dtype"])
+        else:
+            data[column["name"]] = pd.Series(values, index=index, copy=False)
+
+    return pd.DataFrame(data, index=index, columns=[c["name"] for c in meta["columns"]])
+
+
+def invalidate(filename=None, cache_dir=None, keep=None):
+    """ Removes the cached copies of a csv or the whole cache
+
+    Args:
+        filename (str): the csv to remove from the cache, every entry if None
+        cache_dir (str): the cache directory, CACHE_DIR if None
+        keep (str): an entry directory that isn't removed
+
+    Returns:
+        int: the number of entries removed
+
+    """
+
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    if not os.path.isdir(cache_dir):
+        return 0
+
+    path = os.path.abspath(filename) if filename is not None else None
+    removed = 0
+    for name in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, name)
+        if entry == keep or not os.path.isdir(entry):
+            continue
+        if path is not None:
+            try:
+                with open(os.path.join(entry, META_FILE)) as f:
+                    if json.load(f)["source"] != path:
+                        continue
+            except (OSError, ValueError, KeyError):
+                continue
+        shutil.rmtree(entry, ignore_errors=True)
+        removed += 1
+    return removed
+
+
+def evict(max_bytes=None, cache_dir=None):
+    """ Removes the least recently used entries until the cache is no bigger
+    than max_bytes
+
+    Args:
+        max_bytes (int): size limit of the cache directory, MAX_CACHE_BYTES
+            if None
+        cache_dir (str): the cache directory, CACHE_DIR if None
+
+    Returns:
+        int: the size of the cache after evicting
+
+    """
+
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    max_bytes = MAX_CACHE_BYTES if max_bytes is None else max_bytes
+    if not os.path.isdir(cache_dir):
+        return 0
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, name)
+        meta = os.path.join(entry, META_FILE)
+        if os.path.isfile(meta):
+            entries.append((os.path.getmtime(meta), _entry_size(entry), entry))
+        elif os.path.isdir(entry) and time.time() - os.path.getmtime(entry) > 3600:
+            #temporary directory left behind by a failed save
+            shutil.rmtree(entry, ignore_errors=True)
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+    return total
+
+
+if __name__ == "__main__":
+
+    import sys
+
+    #python bar_cache.py clear [file] or python bar_cache.py evict [max_bytes]
+    if len(sys.argv) > 1 and sys.argv[1] == "clear":
+        print("{0} entries removed".format(invalidate(sys.argv[2] if len(sys.argv) > 2 else None)))
+    elif len(sys.argv) > 1 and sys.argv[1] == "evict":
+        print("{0} bytes cached".format(evict(int(sys.argv[2]) if len(sys.argv) > 2 else None)))
+    else:
+        print(__doc__)
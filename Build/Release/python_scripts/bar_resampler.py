@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+"""
+Streams minute data into higher timeframe bars a chunk at a time so the
+memory used doesn't depend on the length of the history.
+
+The bars are the same as data_builder.compile_from_minute_data ie. the
+CONVERSION aggregation with the empty bars dropped plus next_bar_open,
+next_askopen and next_bidopen. The partly built bar at the end of each chunk
+is carried into the next chunk and the last complete bar is held back until
+the open of the bar after it is known.
+"""
+
+import os
+
+import numpy as np
+
+#the same aggregation as compile_from_minute_data
+CONVERSION = {'bidopen': 'first', 'bidclose': 'last', 'bidhigh': 'max', 'bidlow': 'min',
+              'open': 'first', 'close': 'last', 'high': 'max', 'low': 'min',
+              'volume': 'sum'}
+
+#minute data column for each bar column, the OHLC are based on the ask price
+MINUTE_COLUMNS = {'bidopen': 'bidopen', 'bidclose': 'bidclose', 'bidhigh': 'bidhigh', 'bidlow': 'bidlow',
+                  'open': 'askopen', 'close': 'askclose', 'high': 'askhigh', 'low': 'asklow',
+                  'volume': 'tickqty'}
+
+DEFAULT_CHUNK_SIZE = 500000
+
+
+def _is_tick(timeframe):
+    import pandas as pd
+    return isinstance(pd.tseries.frequencies.to_offset(timeframe), pd.offsets.Tick)
+
+
+def date_format(timeframe):
+    """ The csv date format pandas would use for the bars of a timeframe when
+    writing them all at once """
+
+    import pandas as pd
+
+    if _is_tick(timeframe) and pd.Timedelta(timeframe) % pd.Timedelta(days=1) != pd.Timedelta(0):
+        return '%Y-%m-%d %H:%M:%S'
+    return '%Y-%m-%d'
+
+
+def minute_bars(minutes):
+    """ Selects and renames the minute data columns used to build the bars """
+
+    bars = minutes[list(MINUTE_COLUMNS.values())]
+    bars.columns = list(MINUTE_COLUMNS.keys())
+    return bars
+
+
+def add_next_bar(bars):
+    """ Adds the open time and prices of the next bar, a trade is opened on
+    the next bar after the bar it was signalled on """
+
+    bars["next_bar_open"] = bars.index.to_series().shift(-1)
+    bars["next_askopen"] = bars["open"].shift(-1)
+    bars["next_bidopen"] = bars["bidopen"].shift(-1)
+    return bars
+
+
+def _nested_source(timeframe, built):
+    """ The largest built time frame whose bars fit exactly inside the bars
+    of timeframe, None if there isn't one """
+
+    import pandas as pd
+
+    day = pd.Timedelta(days=1)
+    best = None
+    for lower in built:
+        if _is_tick(lower):
+            duration = pd.Timedelta(lower)
+            if _is_tick(timeframe):
+                nests = duration < pd.Timedelta(timeframe) and pd.Timedelta(timeframe) % duration == pd.Timedelta(0)
+            else:
+                #intraday bars that divide a day fit inside daily, weekly and monthly bars
+                nests = day % duration == pd.Timedelta(0)
+        else:
+            duration = day
+            nests = not _is_tick(timeframe) and lower != timeframe and \
+                pd.tseries.frequencies.to_offset(lower) == pd.offsets.Day(1)
+        if nests and (best is None or duration > best[1]):
+            best = (lower, duration)
+    return best[0] if best is not None else None
+
+
+def resample_timeframes(minutes, timeframes):
+    """ Builds the bars of several time frames from minute data in memory.
+    Each time frame is aggregated from the bars of the next lowest time
+    frame that nests inside it rather than from the minutes again
+
+    Args:
+        minutes (pd.DataFrame): minute data with the bar column names
+        timeframes (str[]): the time frames eg. ['5min', '15min', '1h']
+
+    Returns:
+        dict: time frame to pd.DataFrame of bars with the empty bars dropped
+
+    """
+
+    import pandas as pd
+
+    #lowest time frames first so the higher ones can be built from them
+    order = sorted(timeframes, key=lambda tf: (0, pd.Timedelta(tf)) if _is_tick(tf) else (1, pd.Timedelta(0)))
+
+    #the aggregates keep the empty bars so they give the same result as the minutes
+    aggregates = {}
+    for timeframe in order:
+        source = _nested_source(timeframe, aggregates)
+        source = minutes if source is None else aggregates[source]
+        aggregates[timeframe] = source.resample(timeframe).agg(CONVERSION)
+
+    return {timeframe: add_next_bar(aggregates[timeframe].dropna()) for timeframe in timeframes}
+
+
+class BarResampler:
+    """ Resamples minute data passed in date order chunks into bars
+
+    Args:
+        timeframe (str): the time frame of the bar eg. 1H is 1 hour bars
+        origin (pd.Timestamp): midnight of the first day of the minute data,
+            taken from the first chunk if None. Only used by timeframes that
+            don't divide a day
+        start (pd.Timestamp): label of the first bar wanted, the minutes of
+            any earlier bars are ignored
+
+    """
+
+    def __init__(self, timeframe, origin=None, start=None):
+        self.timeframe = timeframe
+        self.origin = origin
+        self.start = start
+        #the last bar of the previous chunk which may still be incomplete
+        self.carry = None
+        #the last complete bar which is waiting for the open of the next bar
+        self.pending = None
+        self.last_minute = None
+
+    def _resample(self, minutes):
+
+        if self.origin is None:
+            self.origin = minutes.index[0].normalize()
+        if _is_tick(self.timeframe):
+            return minutes.resample(self.timeframe, origin=self.origin).agg(CONVERSION)
+        return minutes.resample(self.timeframe).agg(CONVERSION)
+
+    def _merge_carry(self, bars):
+        """ Adds the carried bar to the front of the bars or combines them if
+        the chunk starts part way through the same bar """
+
+        import pandas as pd
+
+        if bars.index[0] != self.carry.index[0]:
+            return pd.concat([self.carry, bars])
+
+        carried = self.carry.iloc[0]
+        bar = bars.iloc[0]
+        for column, how in CONVERSION.items():
+            if how == 'first':
+                value = carried[column] if pd.notna(carried[column]) else bar[column]
+            elif how == 'last':
+                value = bar[column] if pd.notna(bar[column]) else carried[column]
+            elif how == 'max':
+                value = np.fmax(carried[column], bar[column])
+            elif how == 'min':
+                value = np.fmin(carried[column], bar[column])
+            else:
+                value = carried[column] + bar[column]
+            bars.loc[bars.index[0], column] = value
+        return bars
+
+    def _emit(self, complete, final):
+
+        import pandas as pd
+
+        if self.pending is not None:
+            complete = pd.concat([self.pending, complete])
+            self.pending = None
+
+        bars = add_next_bar(complete.copy())
+
+        if not final and len(complete) > 0:
+            self.pending = complete.iloc[-1:]
+            bars = bars.iloc[:-1]
+        return bars
+
+    def add(self, minutes):
+        """ Adds a chunk of minute data
+
+        Args:
+            minutes (pd.DataFrame): minute data with the bar column names as
+                returned by minute_bars, later than any previous chunk
+
+        Returns:
+            pd.DataFrame: the bars that are complete and whose next bar is
+                known
+
+        """
+
+        if len(minutes) == 0:
+            return self._emit(minutes.iloc[:0][list(CONVERSION.keys())], final=False)
+
+        if not minutes.index.is_monotonic_increasing or \
+                (self.last_minute is not None and minutes.index[0] < self.last_minute):
+            raise ValueError("minute data must be in date order")
+        self.last_minute = minutes.index[-1]
+
+        bars = self._resample(minutes)
+        if self.start is not None:
+            bars = bars.loc[bars.index >= self.start]
+            if len(bars) == 0:
+                return self._emit(bars, final=False)
+        if self.carry is not None:
+            bars = self._merge_carry(bars)
+
+        self.carry = bars.iloc[-1:]
+        return self._emit(bars.iloc[:-1].dropna(), final=False)
+
+    def finish(self):
+        """ Completes the last bar once all the minute data has been added
+
+        Returns:
+            pd.DataFrame: the remaining bars, the last has no next bar
+
+        """
+
+        import pandas as pd
+
+        if self.carry is not None:
+            complete = self.carry.dropna()
+        elif self.pending is not None:
+            complete = self.pending.iloc[:0]
+        else:
+            complete = pd.DataFrame(columns=list(CONVERSION.keys()))
+        self.carry = None
+        return self._emit(complete, final=True)
+
+
+def _read_tail(save_location):
+    """ The header, last bar and byte offset of the last bar in a bar csv """
+
+    import io
+    import pandas as pd
+
+    with open(save_location, 'rb') as f:
+        header = f.readline()
+        first = f.readline()
+
+        #read back from the end until the start of the last line is found
+        size = f.seek(0, os.SEEK_END)
+        block = 4096
+        while True:
+            start = max(size - block, 0)
+            f.seek(start)
+            tail = f.read(size - start)
+            end = tail.rstrip(b'\r\n')
+            line_start = end.rfind(b'\n')
+            if line_start >= 0 or start == 0:
+                break
+            block *= 2
+
+    offset = start + line_start + 1
+    first_bar = pd.read_csv(io.BytesIO(header + first), index_col=0, parse_dates=True)
+    last_bar = pd.read_csv(io.BytesIO(header + end[line_start + 1:]), index_col=0, parse_dates=True)
+    return header, first_bar, last_bar, offset
+
+
+class _BarFile:
+    """ Writes the bars of one timeframe to csv as they are completed """
+
+    def __init__(self, timeframe, save_location, append, return_data, first_minute=None):
+        self.resampler = BarResampler(timeframe)
+        self.save_location = save_location
+        self.keep = return_data or save_location is None
+        self.kept = []
+        self.date_format = date_format(timeframe)
+        self.write_header = True
+        self.truncate_at = None
+
+        if append:
+            if save_location is None:
+                raise ValueError("save_location is required to append bars")
+            if os.path.isfile(save_location) and os.path.getsize(save_location) > 0:
+                header, first_bar, last_bar, offset = _read_tail(save_location)
+                if len(last_bar) > 0:
+                    #the last bar is built again from the new minutes so they
+                    #have to start by its open or the bar would lose minutes
+                    if first_minute is None or first_minute > last_bar.index[0]:
+                        raise ValueError("The minute data must start no later than the open of the last bar {0} "
+                                         "in {1} to append to it, it starts at {2}".format(
+                                             last_bar.index[0], save_location, first_minute))
+                    self.resampler.origin = first_bar.index[0].normalize()
+                    self.resampler.start = last_bar.index[0]
+                    self.write_header = False
+                    self.truncate_at = offset
+
+    def start(self):
+        """ Removes the last bar of a file being appended to as it may have
+        been incomplete, or empties the file. Only called once every file
+        has been checked so a failed check leaves all of them as they were """
+
+        if self.truncate_at is not None:
+            with open(self.save_location, 'r+b') as f:
+                f.truncate(self.truncate_at)
+        elif self.save_location is not None and self.write_header:
+            open(self.save_location, 'w').close()
+
+    def output(self, bars):
+        if len(bars) == 0:
+            return
+        if self.save_location is not None:
+            bars.to_csv(self.save_location, mode='a', header=self.write_header, date_format=self.date_format)
+            self.write_header = False
+        if self.keep:
+            self.kept.append(bars)
+
+    def bars(self):
+        import pandas as pd
+        return pd.concat(self.kept) if self.kept else None
+
+
+def resample_file(file_location, timeframe, save_location=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                  append=False, return_data=True):
+    """ Compiles bars from a minute data csv reading chunk_size rows at a time.
+    Several timeframes can be built from the one read of the minute data
+
+    Args:
+        file_location (str): path of the minute data
+        timeframe (str or str[]): the time frame of the bar eg. 1H is 1 hour
+            bars or a list of time frames
+        save_location (str or dict): path to write the bars to or a dict of
+            time frame to path for a list of time frames, the bars are only
+            kept in memory if this is None or return_data is True
+        chunk_size (int): number of minute rows read at a time
+        append (bool): True to add the minute data onto an existing bar file.
+            The last bar in the file is built again from the minute data at or
+            after its open so the minute data must start no later than the
+            open of that bar or a ValueError is raised before the file is
+            changed. Earlier minutes are skipped
+        return_data (bool): False to not keep the bars in memory
+
+    Returns:
+        pd.DataFrame: the bars written by this call or None if return_data
+            is False, a dict of time frame to bars for a list of time frames
+
+    """
+
+    import pandas as pd
+
+    timeframes = timeframe if type(timeframe) == list else [timeframe]
+    if type(save_location) != dict:
+        save_location = {tf: save_location for tf in timeframes}
+
+    #only parse the date and the columns the bars are built from
+    with open(file_location) as f:
+        index_name = f.readline().split(',')[0].strip()
+    columns = [index_name] + list(MINUTE_COLUMNS.values())
+
+    #appending checks the minute data reaches back to the last bar written
+    first_minute = None
+    if append:
+        first = pd.read_csv(file_location, index_col=0, parse_dates=True, nrows=1, usecols=columns)
+        first_minute = first.index[0] if len(first) > 0 else None
+    files = [_BarFile(tf, save_location.get(tf), append, return_data, first_minute) for tf in timeframes]
+    for bar_file in files:
+        bar_file.start()
+    reader = pd.read_csv(file_location, index_col=0, parse_dates=True, chunksize=chunk_size, usecols=columns)
+    for chunk in reader:
+        minutes = minute_bars(chunk)
+        for bar_file in files:
+            bar_file.output(bar_file.resampler.add(minutes))
+    for bar_file in files:
+        bar_file.output(bar_file.resampler.finish())
+
+    if type(timeframe) == list:
+        return {tf: bar_file.bars() for tf, bar_file in zip(timeframes, files)}
+    return files[0].bars()
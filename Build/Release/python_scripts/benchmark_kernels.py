@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark of the feature_kernels functions against the original pandas
+and pyti calc_feature_pandas path.
+
+Usage:
+    python benchmark_kernels.py [sizes]
+    python benchmark_kernels.py precision [sizes]
+    python benchmark_kernels.py threads [sizes] [thread counts]
+
+eg. python benchmark_kernels.py 10000,100000,1000000
+
+precision reports the max deviation of the float32 features from the float64
+features instead of the timings. It exits with 1 if the warm up nans differ
+or an SMA, ATR or BBANDS feature is further than MAX_RELATIVE_DEVIATION from
+float64.
+
+threads times calc_features on a large request at each thread count, 1,2,4,8
+by default, and checks the results are the same as on one thread.
+"""
+
+import sys
+import time
+
+import numpy as np
+
+import feature_kernels as fk
+
+#the live feature string from ActiveTrading.cs plus an SMA
+FEATURES = "SMA(20,close);ATR(3,close,high,low);ATR(4,close,high,low);ATR(5,close,high,low);ATR(100,close,high,low);VOLATILITY_LOG_MA(12,high,low);VOLUME_LOG_MA(12,volume);BBANDS(20,1.8,1,close);BBANDS(20,1.8,2,close)"
+
+#a large offline request, the live features plus a spread of periods
+LARGE_FEATURES = FEATURES + "".join(
+    ";SMA({0},close);ATR({0},close,high,low);BBANDS({0},2,1,close);BBANDS({0},2,2,close)".format(period)
+    for period in (10, 25, 50, 75, 150, 250, 400, 600))
+
+#features whose float32 values are checked against MAX_RELATIVE_DEVIATION.
+#The log ratio features are close to 0 so only their nans are checked
+PRECISION_FEATURES = ("SMA", "ATR", "BBANDS")
+#a few float32 epsilons for the rounding of the inputs, the sums and the output
+MAX_RELATIVE_DEVIATION = 1e-6
+
+
+def synthetic_records(bar_count, seed=0):
+    """ Random walk bars in the same record layout the C# side writes """
+
+    dt = np.dtype((np.record, [('date', '<M8[ns]'),
+                               ('open', '<f4'),
+                               ('close', '<f4'),
+                               ('high', '<f4'),
+                               ('low', '<f4'),
+                               ('volume', '<i4')]))
+
+    rng = np.random.default_rng(seed)
+    records = np.zeros(bar_count, dtype=dt)
+    records['date'] = np.datetime64('2000-01-01') + np.arange(bar_count) * np.timedelta64(1, 'h')
+    price = 1.1 + np.cumsum(rng.normal(0, 0.001, bar_count))
+    records['open'] = price
+    records['close'] = price + rng.normal(0, 0.0005, bar_count)
+    records['high'] = np.maximum(records['open'], records['close']) + np.abs(rng.normal(0, 0.0005, bar_count))
+    records['low'] = np.minimum(records['open'], records['close']) - np.abs(rng.normal(0, 0.0005, bar_count))
+    records['volume'] = rng.integers(1, 1000, bar_count)
+    return records
+
+
+def time_call(func, repeat=3):
+    """ Best of repeat wall times in seconds """
+
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(sizes, features=FEATURES):
+
+    import pandas as pd
+    import data_builder as db
+    from build_features import parse_features
+
+    specs = parse_features(features)
+
+    print("{0:>9} {1:<32} {2:>12} {3:>12} {4:>9}".format("bars", "feature", "pandas ms", "kernel ms", "speedup"))
+
+    for bar_count in sizes:
+        records = synthetic_records(bar_count)
+
+        columns = {name: np.ascontiguousarray(records[name]) for name in records.dtype.names if name != 'date'}
+        columns['close'] = columns['open']
+
+        data = pd.DataFrame(records)
+        data.index = data['date']
+        data = data.drop('date', axis=1)
+        data['close'] = data['open']
+
+        total_pandas = 0.0
+        total_kernel = 0.0
+        for column_name, feature_name, feature_args in specs:
+            #pyti loops in python so only run it once on the big sizes
+            repeat = 1 if bar_count > 100000 else 3
+            pandas_time = time_call(lambda: db.calc_feature_pandas(data, feature_name, feature_args), repeat)
+            kernel_time = time_call(lambda: fk.calc_feature(columns, feature_name, feature_args))
+            total_pandas += pandas_time
+            total_kernel += kernel_time
+
+            print("{0:>9} {1:<32} {2:>12.2f} {3:>12.2f} {4:>8.1f}x".format(
+                bar_count, column_name[:32], pandas_time * 1000, kernel_time * 1000, pandas_time / kernel_time))
+
+        print("{0:>9} {1:<32} {2:>12.2f} {3:>12.2f} {4:>8.1f}x".format(
+            bar_count, "TOTAL", total_pandas * 1000, total_kernel * 1000, total_pandas / total_kernel))
+
+
+def precision(sizes, features=FEATURES):
+    """ Prints the max absolute and relative deviation of each float32
+    feature from the float64 feature and checks the warm up bars match
+
+    Returns:
+        bool: True if every feature has the same nans and the PRECISION_FEATURES
+            are within MAX_RELATIVE_DEVIATION
+    """
+
+    from build_features import parse_features
+    from feature_planner import FeaturePlan
+
+    plan = FeaturePlan(parse_features(features))
+
+    print("{0:>9} {1:<32} {2:>14} {3:>14} {4:>6} {5:>6}".format("bars", "feature", "max abs dev", "max rel dev",
+                                                                 "nans", "check"))
+
+    features = {column_name: feature_name for column_name, feature_name, _ in parse_features(features)}
+    passed = True
+    for bar_count in sizes:
+        records = synthetic_records(bar_count)
+        columns = {name: np.ascontiguousarray(records[name]) for name in records.dtype.names if name != 'date'}
+        columns['close'] = columns['open']
+
+        exact = plan.evaluate(columns)
+        single = plan.evaluate(columns, float32=True)
+        for column_name, _ in plan.outputs:
+            expected = exact[column_name]
+            actual = single[column_name].astype(np.float64)
+            same_nans = np.array_equal(np.isnan(expected), np.isnan(actual))
+
+            finite = np.isfinite(expected) & np.isfinite(actual)
+            deviation = np.abs(actual[finite] - expected[finite])
+            absolute = deviation.max() if len(deviation) > 0 else 0.0
+            scale = np.abs(expected[finite])
+            relative = (deviation / np.where(scale > 0, scale, 1.0)).max() if len(deviation) > 0 else 0.0
+
+            ok = same_nans
+            if features[column_name] in PRECISION_FEATURES:
+                ok = ok and relative <= MAX_RELATIVE_DEVIATION
+            passed = passed and ok
+
+            print("{0:>9} {1:<32} {2:>14.3e} {3:>14.3e} {4:>6} {5:>6}".format(
+                bar_count, column_name[:32], absolute, relative, "ok" if same_nans else "DIFF", "ok" if ok else "FAIL"))
+
+    return passed
+
+
+def threads(sizes, thread_counts=(1, 2, 4, 8), features=LARGE_FEATURES):
+    """ Prints the time of calc_features at each thread count and the speed
+    up over one thread
+
+    Returns:
+        bool: True if every thread count gave the same results as one thread
+    """
+
+    from build_features import calc_features, parse_features
+    from feature_planner import FeaturePlan
+
+    plan = FeaturePlan(parse_features(features))
+    print("{0} features, {1} calculations".format(len(plan.outputs),
+                                                  len([n for n in plan.nodes if n.operation != "column"])))
+    print("{0:>9} {1:>8} {2:>12} {3:>9} {4:>6}".format("bars", "threads", "ms", "speedup", "same"))
+
+    same = True
+    for bar_count in sizes:
+        records = synthetic_records(bar_count)
+        columns = {name: np.ascontiguousarray(records[name]) for name in records.dtype.names if name != 'date'}
+        columns['close'] = columns['open']
+
+        expected = calc_features(records['date'], columns, plan)
+        base = None
+        for count in thread_counts:
+            elapsed = time_call(lambda: calc_features(records['date'], columns, plan, threads=count))
+            base = elapsed if base is None else base
+            matches = calc_features(records['date'], columns, plan, threads=count).tobytes() == expected.tobytes()
+            same = same and matches
+
+            print("{0:>9} {1:>8} {2:>12.2f} {3:>8.2f}x {4:>6}".format(
+                bar_count, count, elapsed * 1000, base / elapsed, "ok" if matches else "DIFF"))
+
+    return same
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1 and sys.argv[1] == "threads":
+        sizes = [100000, 1000000]
+        if len(sys.argv) > 2:
+            sizes = [int(x) for x in sys.argv[2].split(',')]
+        thread_counts = [1, 2, 4, 8]
+        if len(sys.argv) > 3:
+            thread_counts = [int(x) for x in sys.argv[3].split(',')]
+        sys.exit(0 if threads(sizes, thread_counts) else 1)
+
+    if len(sys.argv) > 1 and sys.argv[1] == "precision":
+        sizes = [10000, 100000, 1000000]
+        if len(sys.argv) > 2:
+            sizes = [int(x) for x in sys.argv[2].split(',')]
+        sys.exit(0 if precision(sizes) else 1)
+
+    sizes = [10000, 100000, 1000000]
+    if len(sys.argv) > 1:
+        sizes = [int(x) for x in sys.argv[1].split(',')]
+
+    run(sizes)
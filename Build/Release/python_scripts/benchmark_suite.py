@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite for the feature and bar building paths. Synthetic data is
+written in the same layouts the C# side uses and each stage is timed in a
+fresh process so the peak RSS belongs to that stage alone.
+
+Stages:
+    build_features     build_features.py batch path to a binary file
+    incremental        the live path ie. 1000 single new bars through the incremental engine
+    calc_feature       the pandas/pyti data_builder.calc_feature_pandas reference
+    compile            compile_from_minute_data from a minute csv to 1h bars
+    compile_chunked    the same through the streaming resampler
+    add_features       data_builder.add_features
+    merge_trades       data_builder.merge_trades
+
+Usage:
+    python benchmark_suite.py [--sizes 10000,100000] [--stages build_features,compile]
+                              [--output results.json] [--compare baseline.json]
+
+eg. store a baseline then check a change against it
+    python benchmark_suite.py --output baseline.json
+    python benchmark_suite.py --compare baseline.json --threshold 0.2
+
+The compare mode exits with 1 if any stage is slower than the baseline by more
+than the threshold.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmark_kernels import synthetic_records, time_call
+
+#feature string shapes, live is the ATR heavy string from ActiveTrading.cs
+SHAPES = {
+    "live": "ATR(3,close,high,low);ATR(4,close,high,low);ATR(5,close,high,low);ATR(100,close,high,low);VOLATILITY_LOG_MA(12,high,low);VOLUME_LOG_MA(12,volume);BBANDS(20,1.8,1,close);BBANDS(20,1.8,2,close)",
+    "sma": "SMA(20,close);SMA(50,close);SMA(200,close)",
+    "bbands": "BBANDS(20,2,1,close);BBANDS(20,2,2,close);BBANDS(20,2,3,close);BBANDS(20,2,4,close)",
+}
+
+#add_features minus atr which pyti no longer supports with a single series
+ADD_FEATURES = ['lower_bb', 'upper_bb', 'volatility_12', 'volatility_200', 'volatility', 'volume_change',
+                'bb_dist_upper', 'bb_dist_lower', 'bb_range', 'change_4bar', 'log_return']
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+
+#the pandas/pyti stages loop in python so are skipped above this size
+SLOW_STAGE_MAX_SIZE = 100000
+
+#bars per trade in the synthetic trade files
+BARS_PER_TRADE = 10
+
+
+def peak_rss_mb():
+    """ Peak resident memory of this process in MB, None if it can't be measured """
+
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        #linux reports KB, mac reports bytes
+        return peak / 1024.0 if sys.platform != "darwin" else peak / 1024.0 ** 2
+    except ImportError:
+        pass
+
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / 1024.0 ** 2
+    except ImportError:
+        return None
+
+
+def write_minute_csv(filename, size, seed=0):
+    """ Minute bid/ask data in the csv layout compile_from_minute_data reads """
+
+    import pandas as pd
+
+    records = synthetic_records(size, seed)
+    dates = np.datetime64('2000-01-03') + np.arange(size) * np.timedelta64(1, 'm')
+    spread = np.float32(0.0001)
+    data = pd.DataFrame({'bidopen': records['open'], 'bidclose': records['close'],
+                         'bidhigh': records['high'], 'bidlow': records['low'],
+                         'askopen': records['open'] + spread, 'askclose': records['close'] + spread,
+                         'askhigh': records['high'] + spread, 'asklow': records['low'] + spread,
+                         'tickqty': records['volume']}, index=pd.DatetimeIndex(dates, name='date'))
+    data.to_csv(filename)
+
+
+def write_trades_csv(filename, size, asset, seed=0):
+    """ Zorro style trades entered on the open of the synthetic hourly bars """
+
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    count = max(size // BARS_PER_TRADE, 1)
+    entry = np.datetime64('2000-01-01') + rng.integers(1, size, count) * np.timedelta64(1, 'h')
+    trades = pd.DataFrame({'Asset': asset,
+                           'Type': np.where(rng.random(count) > 0.5, 'Long', 'Short'),
+                           'open': pd.DatetimeIndex(entry).astype(str),
+                           'close': pd.DatetimeIndex(entry + np.timedelta64(4, 'h')).astype(str),
+                           'Profit': rng.normal(0, 10, count)})
+    trades.to_csv(filename, index=False)
+
+
+def prepare(data_dir, size):
+    """ Writes the synthetic input files for a size """
+
+    paths = {"bars": os.path.join(data_dir, "bars_{0}.bin".format(size)),
+             "minutes": os.path.join(data_dir, "minutes_{0}.csv".format(size)),
+             "trades": os.path.join(data_dir, "trades_{0}.csv".format(size)),
+             "output": os.path.join(data_dir, "features_{0}.bin".format(size))}
+
+    if not os.path.isfile(paths["bars"]):
+        synthetic_records(size).tofile(paths["bars"])
+    if not os.path.isfile(paths["minutes"]):
+        write_minute_csv(paths["minutes"], size)
+    if not os.path.isfile(paths["trades"]):
+        write_trades_csv(paths["trades"], size, "EURUSD")
+    return paths
+
+
+def _bar_frame(paths):
+    #the bars as a DataFrame the same as build_features.load_data
+    import build_features as bf
+    return bf.load_data("whole", paths["bars"])
+
+
+def _merge_frame(paths):
+    import pandas as pd
+
+    data = _bar_frame(paths)
+    data["next_bar_open"] = pd.Series(data.index, index=data.index).shift(-1)
+    for column in ["bb_dist_upper", "bb_dist_lower", "log_return", "log_return_ma_12",
+                   "log_return_ma_24", "log_return_ma_48"]:
+        data[column] = data["close"]
+    return data
+
+
+def stage_build_features(paths, size, shape, repeat):
+    import build_features as bf
+    return time_call(lambda: bf.build_features("whole", paths["bars"], paths["output"], SHAPES[shape], cache=False), repeat), size
+
+
+def stage_incremental(paths, size, shape, repeat):
+    import incremental_features as inc
+    import build_features as bf
+
+    records = bf.sort_records(bf.load_records("whole", paths["bars"]))
+    engine = inc.IncrementalFeatures(bf.parse_features(SHAPES[shape]), max_rows=1000)
+    #warm the engine up on all but the last 1000 bars then time those one at a time
+    live = min(1000, len(records) // 2)
+    engine.update_records(records[:-live], history=len(records) - live)
+
+    start = time.perf_counter()
+    for i in range(len(records) - live, len(records)):
+        engine.update_records(records[i:i + 1], history=i + 1)
+    return time.perf_counter() - start, live
+
+
+def stage_calc_feature(paths, size, shape, repeat):
+    import data_builder as db
+    import build_features as bf
+
+    data = _bar_frame(paths)
+    specs = bf.parse_features(SHAPES[shape])
+
+    def run():
+        for column_name, feature_name, feature_args in specs:
+            db.calc_feature_pandas(data, feature_name, feature_args)
+    return time_call(run, repeat), size
+
+
+def stage_compile(paths, size, shape, repeat, chunk_size=None):
+    import data_builder as db
+
+    folder, name = os.path.split(paths["minutes"])
+    asset_file = os.path.join(folder, "{ASSET}.csv")
+    asset = os.path.splitext(name)[0]
+    return time_call(lambda: db.compile_from_minute_data(asset, asset_file, "1h", verbose=False,
+                                                         use_cache=False, chunk_size=chunk_size), repeat), size
+
+
+def stage_compile_chunked(paths, size, shape, repeat):
+    return stage_compile(paths, size, shape, repeat, chunk_size=100000)
+
+
+def stage_add_features(paths, size, shape, repeat):
+    import data_builder as db
+    data = _bar_frame(paths)
+    return time_call(lambda: db.add_features(("BENCH", data.copy()), ADD_FEATURES, verbose=False), repeat), size
+
+
+def stage_merge_trades(paths, size, shape, repeat):
+    import data_builder as db
+    data = _merge_frame(paths)
+    return time_call(lambda: db.merge_trades(("EURUSD", data), paths["trades"]), repeat), size
+
+
+#stage name to (function, uses the feature shapes, is a slow pandas/pyti stage)
+STAGES = {
+    "build_features": (stage_build_features, True, False),
+    "incremental": (stage_incremental, True, False),
+    "calc_feature": (stage_calc_feature, True, True),
+    "compile": (stage_compile, False, False),
+    "compile_chunked": (stage_compile_chunked, False, False),
+    "add_features": (stage_add_features, False, True),
+    "merge_trades": (stage_merge_trades, False, False),
+}
+
+
+def run_case(stage, paths, size, shape, repeat):
+    """ Runs one stage in this process, called in a fresh worker process.
+    Each stage function returns the wall time and the number of bars it
+    processed """
+
+    import contextlib
+
+    #keep stdout for the json results
+    function = STAGES[stage][0]
+    with contextlib.redirect_stdout(sys.stderr):
+        wall, bars = function(paths, size, shape, repeat)
+    return {"stage": stage, "size": size, "shape": shape,
+            "wall_s": wall, "peak_rss_mb": peak_rss_mb(),
+            "bars_per_sec": bars / wall if wall > 0 else None}
+
+
+def run(sizes, stages, shapes, repeat=3, data_dir=None):
+    """ Runs every stage for every size and shape each in a new process
+
+    Returns:
+        dict: the meta data and a list of results
+
+    """
+
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    import pandas as pd
+
+    data_dir = data_dir or tempfile.mkdtemp(prefix="nitrade_bench_")
+    os.makedirs(data_dir, exist_ok=True)
+    context = multiprocessing.get_context("spawn")
+
+    results = []
+    for size in sizes:
+        paths = prepare(data_dir, size)
+        for stage in stages:
+            _, uses_shapes, slow = STAGES[stage]
+            if slow and size > SLOW_STAGE_MAX_SIZE:
+                continue
+            for shape in (shapes if uses_shapes else [None]):
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    result = executor.submit(run_case, stage, paths, size, shape, repeat).result()
+                results.append(result)
+                print("{0:<16} {1:>9} {2:<7} {3:>10.2f} ms {4:>12.0f} bars/s {5:>8} MB".format(
+                    stage, size, shape or "", result["wall_s"] * 1000, result["bars_per_sec"] or 0,
+                    "{0:.0f}".format(result["peak_rss_mb"]) if result["peak_rss_mb"] is not None else "-"),
+                    file=sys.stderr)
+
+    meta = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "numpy": np.__version__, "pandas": pd.__version__, "platform": platform.platform(),
+            "repeat": repeat}
+    return {"meta": meta, "results": results}
+
+
+def compare(results, baseline, threshold=0.2):
+    """ Compares the wall times against a baseline
+
+    Args:
+        results (dict): the results of run
+        baseline (dict): results of an earlier run
+        threshold (float): the fraction slower than the baseline that is a
+            regression
+
+    Returns:
+        (dict[], int): a row per matched case and the number of regressions
+
+    """
+
+    def key(result):
+        return (result["stage"], result["size"], result["shape"])
+
+    base = {key(result): result for result in baseline["results"]}
+    rows = []
+    regressions = 0
+    for result in results["results"]:
+        if key(result) not in base:
+            continue
+        ratio = result["wall_s"] / base[key(result)]["wall_s"]
+        regressed = ratio > 1 + threshold
+        regressions += regressed
+        rows.append({"stage": result["stage"], "size": result["size"], "shape": result["shape"],
+                     "baseline_s": base[key(result)]["wall_s"], "wall_s": result["wall_s"],
+                     "ratio": ratio, "regression": regressed})
+    return rows, regressions
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmarks the python feature and bar building paths")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES))
+    parser.add_argument("--stages", default=",".join(STAGES))
+    parser.add_argument("--shapes", default=",".join(SHAPES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--data-dir", default=None, help="where to write the synthetic data")
+    parser.add_argument("--output", default=None, help="file to write the json results to")
+    parser.add_argument("--compare", default=None, help="baseline json to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = run([int(s) for s in args.sizes.split(',')], args.stages.split(','),
+                  args.shapes.split(','), args.repeat, args.data_dir)
+
+    regressions = 0
+    if args.compare is not None:
+        with open(args.compare) as f:
+            rows, regressions = compare(results, json.load(f), args.threshold)
+        results["comparison"] = {"baseline": args.compare, "threshold": args.threshold,
+                                 "regressions": regressions, "rows": rows}
+        for row in rows:
+            print("{0:<16} {1:>9} {2:<7} {3:>6.2f}x{4}".format(
+                row["stage"], row["size"], row["shape"] or "", row["ratio"],
+                "  REGRESSION" if row["regression"] else ""), file=sys.stderr)
+
+    text = json.dumps(results, indent=2)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    sys.exit(1 if regressions > 0 else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,22 +3,113 @@
 Created on Sat Mar 30 17:26:10 2019
 
 @author: matth
+
+Builds features from a binary bar file written by the C# DataBuilder.
+
+One-shot protocol (4 lines on stdin):
+    datafeed type ie. whole or single
+    filename of the binary data
+    output filename, or the number of bars to return as csv through stdout
+    the requested features as function(arg1, arg2);
+
+Server protocol: send "server" as the first line and the process will stay
+alive answering request frames of the same 4 lines. Each response is
+terminated with a line containing only END. Errors are returned as a single
+line starting with ERROR. Send "stop" (or close stdin) to end the process.
+
+Options can follow the datafeed type on the first line eg. "whole incremental".
+    incremental  keeps the rolling state of each feature between server
+                 requests for the same file so only the new bars are calculated
+    mmap         the output is a share file (see share_file.py) that the
+                 results are appended to instead of csv or a plain binary file
+    ring         the output is a feature ring share file holding only the
+                 newest results so it never grows in a long live session.
+                 ring=n sets the number of results kept, RING_CAPACITY by
+                 default. Implies incremental
+    nocache      always calculate the features. Otherwise binary file outputs
+                 are fetched from the result cache (see result_cache.py) when
+                 the input data and features haven't changed and a line of
+                 cache stats follows Success
+    metrics      writes the timings of each stage and feature of the request
+                 to stderr as a line starting with METRICS, see metrics.py.
+                 Also turned on for every request by NITRADE_METRICS
+    profile      writes a cProfile dump of the request to the working
+                 directory or the NITRADE_PROFILE directory
+    lookback     adds a line LOOKBACK n to the response with the number of
+                 bars the features need to calculate their newest value. For
+                 a number of bars output from a share file only the newest
+                 bars needed for them are read
+    float32      calculates and outputs the features in float32 where it is
+                 numerically safe, halving the memory and output size. A
+                 binary file output is then written as a share file so its
+                 header gives the value width
+    threads=n    evaluates the independent features of the request on n
+                 threads over the shared input columns, for large requests
+                 over a full history. NITRADE_FEATURE_THREADS sets the
+                 default, 1 evaluates them in order
+
+The input file can be a plain binary file or a share file, this is detected
+from the file itself.
+
+Batch protocol: send "batch" as the first line of a request (one-shot or
+server) followed by a line with the number of jobs and optionally the number
+of worker processes, then the 4 lines of each job. The response is one frame
+per job in the same order, each terminated with END, so the results of many
+symbols come back from the one request. With workers the jobs are spread over
+that many worker processes running in server mode. Every job for the same
+input file goes to the same worker so the incremental state is kept.
+Once the job count is read there is always one frame per job, a job that
+fails has an ERROR frame. If the job count line can't be read the server
+can't tell where the next request starts, so it answers with a single frame
+starting with ERROR FATAL and exits.
 """
 
+import os
+import sys
+import subprocess
+import threading
 import numpy as np
 from numpy import dtype
-import data_builder as db
-import pandas as pd
+import feature_planner as fp
+import incremental_features as inc
+import share_file as sf
+import result_cache as rc
+import metrics
+from date_format import format_dates
+
+#line that terminates each response frame when running as a server
+END_OF_FRAME = "END"
+#first line of a frame that tells the server to exit
+STOP_COMMAND = "stop"
+#first line of a request made up of many jobs
+BATCH_COMMAND = "batch"
+#start of the frame sent before the server exits on a request it can't read
+FATAL_PREFIX = "ERROR FATAL "
 
-#get the datafeed type ie. all or single
-df_type = input()
-#get the filename for the binary data
-filename = input()
-#get the filename for the binary data output - if passed as a number then this is 
-#returned as a string through stdout instead of writing to file
-output = input()
-#get the requested features as function(arg1, arg2);
-line = input()
+#parsed feature strings keyed on the raw string so a server only parses
+#each distinct feature string once
+_parsed_features = {}
+
+#feature plans keyed on the raw feature string
+_plans = {}
+
+#incremental feature state keyed on (filename, feature string) for the
+#incremental server option
+_incremental_engines = {}
+
+#worker processes for batch requests, kept between the requests of a server
+_worker_pool = None
+
+#out of order tails up to this fraction of the records are merged into the
+#sorted part rather than sorting all the records
+MERGE_FRACTION = 0.25
+
+#results kept by the ring option when it doesn't give a number
+RING_CAPACITY = 1000
+
+#threads the features of a request are evaluated on when the threads option
+#isn't given
+FEATURE_THREADS = int(os.environ.get("NITRADE_FEATURE_THREADS", "1"))
 
 
 #uncomment for easier testing in python
@@ -28,62 +119,843 @@ line = input()
 #line = "SMA(20,close);ATR(3,close,high,low);ATR(4,close,high,low);ATR(5,close,high,low);ATR(100,close,high,low);VOLATILITY_LOG_MA(12,high,low);VOLUME_LOG_MA(12,volume);BBANDS(20,1.8,1,close);BBANDS(20,1.8,2,close)"
 
 
+def parse_features(line):
+    """ Parses a feature command string into its individual feature calls
+
+    Args:
+        line (str): semicolon separated feature calls
+            eg. SMA(20,close);ATR(3,close,high,low)
+
+    Returns:
+        (str, str, str[])[]: a list of (column name, feature name, feature args)
+
+    """
+
+    if line in _parsed_features:
+        return _parsed_features[line]
+
+    features = line.split(';')
+    #strip out any excess blanks
+    features = [x for x in features if len(x.strip()) > 0]
+
+    specs = []
+    for feature_call in features:
+
+        #extract the required parts from the feature call ie. name and args
+        feature_name = feature_call[:feature_call.index("(")].strip()
+        feature_arg_string = feature_call[feature_call.index("(")+1:feature_call.index(")")]
+        feature_arg_string = feature_arg_string.replace(" ", "")
+        feature_args = feature_arg_string.split(',')
+
+        column_name = feature_call.replace(',', '_').replace('(','_').replace(')','').replace(' ', '')
+        specs.append((column_name, feature_name, feature_args))
+
+    _parsed_features[line] = specs
+    return specs
+
+
+def plan_features(line):
+    """ Plans the calculations for a feature command string so that shared
+    intermediate values are only calculated once
+
+    Args:
+        line (str): semicolon separated feature calls
+
+    Returns:
+        feature_planner.FeaturePlan: the plan for the features
+
+    """
+
+    if line not in _plans:
+        _plans[line] = fp.FeaturePlan(parse_features(line))
+    return _plans[line]
+
+
+def load_records(df_type, filename, tail=None):
+    """ Loads the raw records from the binary data written by the C# DataBuilder
+
+    Args:
+        df_type (str): single if the file is just the date and one value,
+            otherwise the whole OHLC and volume layout
+        filename (str): path of the binary data
+        tail (int): the number of newest records wanted from a share file,
+            None for all of them. Share files are written in date order so
+            only the pages of the tail are read. Plain files aren't
+            guaranteed to be in order so are always read in full
+
+    Returns:
+        np.recarray: the records in the order they were written
+
+    """
+
+    with metrics.stage("load"):
+        return _read_records(df_type, filename, tail)
+
+
+def _read_records(df_type, filename, tail=None):
+
+    #share files are mapped and copied so the mapping isn't held open
+    if sf.is_share_file(filename):
+        start = 0
+        if tail is not None:
+            start = max(int(sf.read_header(filename)['count']) - tail, 0)
+        _, mapped = sf.map_records(filename, start=start)
+        if mapped is None:
+            return np.empty(0, sf.SINGLE_DTYPE if df_type == "single" else sf.WHOLE_DTYPE)
+        records = np.array(mapped)
+        del mapped
+        return records
+
+    #load the binary data which will just be the date and the value used to calculate
+    #the features - dont need all OHLC data
+    if(df_type == "single"):
+        dt =  dtype((np.record, [('date', '<M8[ns]'), ('value', '<f4')]))
+    else:
+        dt =  dtype((np.record, [('date', '<M8[ns]'),
+                                 ('open', '<f4'),
+                                 ('close', '<f4'),
+                                 ('high', '<f4'),
+                                 ('low', '<f4'),
+                                 ('volume', '<i4')]))
+
+    return np.fromfile(filename, dt)
+
+
+def load_data(df_type, filename):
+    """ Loads the binary data written by the C# DataBuilder
+
+    Args:
+        df_type (str): single if the file is just the date and one value,
+            otherwise the whole OHLC and volume layout
+        filename (str): path of the binary data
+
+    Returns:
+        pd.DataFrame: the bar data indexed by date, oldest first
+
+    """
+
+    import pandas as pd
+
+    #need to sort because the binary file might not be in order due to the use of a dictionary
+    records = sort_records(load_records(df_type, filename))
+    data = pd.DataFrame(records)
+    data.index = data["date"]
+    data = data.drop('date', axis=1)
+
+    if df_type != "single":
+        data["close"] = data["open"]
+
+    return data
+
+
+def sort_records(records):
+    """ Sorts the records by date because the binary file might not be in
+    order due to the use of a dictionary on the C# side. Records with the
+    same date are removed keeping the last one written
+
+    Records that are already in order are only checked and records where
+    just the newest are out of place have those merged into the sorted part
+    instead of sorting everything
+
+    Args:
+        records (np.recarray): the records in the order they were written
+
+    Returns:
+        np.recarray: the records in date order with unique dates
+
+    """
+
+    with metrics.stage("sort"):
+        dates = records['date']
+        if len(dates) < 2:
+            return records
+
+        steps = dates[1:] >= dates[:-1]
+        if steps.all():
+            return _drop_duplicates(records)
+
+        #length of the part at the start that is already in order
+        prefix = int(np.argmin(steps)) + 1
+        if len(records) - prefix > len(records) * MERGE_FRACTION:
+            #stable so the last written of any duplicates is still last
+            order = np.argsort(dates, kind='mergesort')
+            return _drop_duplicates(_raw(records)[order].view(records.dtype).view(type(records)))
+
+        head = records[:prefix]
+        tail = records[prefix:]
+        tail = tail[np.argsort(tail['date'], kind='mergesort')]
+
+        #the tail goes after any head records with the same date as it was written later
+        positions = np.searchsorted(head['date'], tail['date'], side='right')
+        merged = np.insert(_raw(head), positions, _raw(tail))
+        return _drop_duplicates(merged.view(records.dtype).view(type(records)))
+
+
+def _raw(records):
+    """ The records as opaque bytes, numpy copies these much faster than the
+    packed record fields """
+
+    return records.view(np.dtype((np.void, records.dtype.itemsize)))
+
+
+def _drop_duplicates(records):
+    """ Removes the records with the same date as the next record so the
+    last of each date is kept. The records must be in date order """
+
+    dates = records['date']
+    keep = np.empty(len(dates), dtype=bool)
+    keep[:-1] = dates[1:] != dates[:-1]
+    keep[-1:] = True
+    if keep.all():
+        return records
+    return _raw(records)[keep].view(records.dtype).view(type(records))
+
+
+def load_columns(df_type, filename, tail=None):
+    """ Loads the binary data into contiguous arrays without building a DataFrame
+
+    Args:
+        df_type (str): the datafeed type ie. whole or single
+        filename (str): path of the binary data
+        tail (int): the number of newest records wanted from a share file,
+            see load_records
+
+    Returns:
+        (np.ndarray, dict): the sorted dates and a dict of column name to values
+
+    """
+
+    records = sort_records(load_records(df_type, filename, tail))
+
+    columns = {}
+    for name in records.dtype.names:
+        if name != 'date':
+            columns[name] = np.ascontiguousarray(records[name])
+
+    #features are calculated on the open
+    if df_type != "single":
+        columns["close"] = columns["open"]
+
+    return np.ascontiguousarray(records['date']), columns
+
+
+def calc_features(dates, columns, plan, float32=False, threads=1):
+    """ Calculates each of the features into a record array with the same
+    layout pandas to_records gives ie. the date followed by a float64 per feature
+
+    Args:
+        dates (np.ndarray): the bar dates
+        columns (dict): column name to np.ndarray of bar data
+        plan (feature_planner.FeaturePlan): the planned features
+        float32 (bool): True for float32 feature values
+        threads (int): the number of threads to evaluate the features on
+
+    Returns:
+        np.recarray: the feature values
+
+    """
+
+    dt = results_dtype([column_name for column_name, _ in plan.outputs], float32)
+    results = np.empty(len(dates), dtype=dt)
+    results['date'] = dates
+
+    #every shared intermediate is calculated once for all the features and
+    #each feature is written straight into its field of the results
+    with metrics.stage("calc"):
+        timings = {} if metrics.enabled() else None
+        plan.evaluate(columns, timings, float32, threads=threads, out=results)
+    if timings is not None:
+        metrics.record_plan(plan, timings)
+
+    return results
+
+
+def results_dtype(column_names, float32=False):
+    """ The record layout of the results, the date then a value per feature """
+
+    value_type = '<f4' if float32 else '<f8'
+    return dtype((np.record, [('date', '<M8[ns]')] +
+                             [(column_name, value_type) for column_name in column_names]))
+
+
+def results_to_csv(results, count):
+    """ Formats the newest rows of the results as csv, newest first with no
+    header the same as pandas to_csv
+
+    Args:
+        results (np.recarray): the feature values
+        count (int): the number of bars to return
+
+    Returns:
+        str: csv lines
+
+    """
+
+    #clip to just the required number of bars and reverse the order so it
+    #is as a series ie. newest data first
+    clipped = results[::-1][:count]
+    names = [name for name in clipped.dtype.names if name != 'date']
+    values = [clipped[name].tolist() for name in names]
+
+    lines = []
+    for i, date in enumerate(format_dates(clipped['date'])):
+        row = [str(date)]
+        for column in values:
+            value = column[i]
+            row.append("" if value != value else repr(value))
+        lines.append(",".join(row))
+
+    return "\n".join(lines) + "\n"
+
+
+def build_features(df_type, filename, output, line, mmap=False, cache=True, float32=False, lookback=False,
+                   threads=None):
+    """ Calculates the requested features and either writes them to the
+    output binary file or returns them as csv
+
+    Args:
+        df_type (str): the datafeed type ie. whole or single
+        filename (str): path of the binary data
+        output (str): path of the output binary file or the number of bars
+            to return as csv
+        line (str): the requested features as function(arg1, arg2);
+        mmap (bool): True if output is a share file to write the results to
+        cache (bool): True to use the result cache for a binary file output
+        float32 (bool): True to calculate and write float32 values. A binary
+            file output is written as a share file which has the value width
+            in its header
+        lookback (bool): True to only read the bars needed to calculate a
+            number of bars output from a share file
+        threads (int): the number of threads to evaluate the features on,
+            FEATURE_THREADS by default
+
+    Returns:
+        str: the csv of the newest bars first if output is a number,
+            otherwise Success followed by the cache stats if cached
+
+    """
+
+    if cache and not mmap and not output.isdigit():
+        return _build_features_cached(df_type, filename, output, line, float32, threads)
+
+    plan = plan_features(line)
+    tail = int(output) + plan.warmup if lookback and output.isdigit() and not mmap else None
+    dates, columns = load_columns(df_type, filename, tail)
+    results = calc_features(dates, columns, plan, float32, FEATURE_THREADS if threads is None else threads)
+
+    with metrics.stage("output"):
+        if mmap:
+            sf.write_records(output, results, append=False)
+            return "Success"
+
+        #the header says the values are float32, no room is left for appending
+        elif float32 and not output.isdigit():
+            sf.write_records(output, results, append=False, capacity=len(results))
+            return "Success"
+
+        #return in the std ouput if output is specified as the number of bars
+        elif output.isdigit():
+            return results_to_csv(results, int(output))
+
+        else:
+            #write all the results back to the binary file with overwrite
+            results.tofile(output)
+            return "Success"
+
+
+def _build_features_cached(df_type, filename, output, line, float32=False, threads=None):
+    """ Copies the results from the cache if the same data and features have
+    been calculated before, otherwise calculates and caches them """
+
+    with metrics.stage("cache"):
+        key = rc.cache_key(df_type, filename, [column_name for column_name, _, _ in parse_features(line)],
+                           options=["float32"] if float32 else [])
+        size = rc.fetch(key, output)
+    hit = size is not None
+    metrics.set_value("cache_hit", hit)
+    if not hit:
+        build_features(df_type, filename, output, line, cache=False, float32=float32, threads=threads)
+        with metrics.stage("cache_store"):
+            rc.store(key, output)
+        size = 0
+
+    return "Success\n" + rc.stats_line(hit, rc.record(hit, size))
+
+
+def build_features_pandas(df_type, filename, output, line):
+    """ The original DataFrame version of build_features using
+    data_builder.calc_feature_pandas. Kept as the reference the kernels are checked
+    and benchmarked against """
+
+    import time
+
+    #data_builder pulls in pyti so its import is timed on its own
+    with metrics.stage("import"):
+        import pandas as pd
+        import data_builder as db
+
+    features = parse_features(line)
+    data = load_data(df_type, filename)
+
+    #create a dataframe to hold the values of each feature
+    results_data = pd.DataFrame()
+
+    #loop through all the requested features and do the calculations
+    with metrics.stage("calc"):
+        for column_name, feature_name, feature_args in features:
+
+            #calculate the indicator and add it to the returning dataframe
+            start = time.perf_counter()
+            results_data[column_name] = db.calc_feature_pandas(data, feature_name, feature_args)
+            results_data.index = data.index
+            metrics.record_feature(column_name, time.perf_counter() - start)
+
+    with metrics.stage("output"):
+        #return in the std ouput if output is specified as the number of bars
+        if output.isdigit():
+            #clip to just the required number of bars and reverse the order so it
+            #is as a series ie. newest data first
+            reversed_data = results_data.reindex(index=results_data.index[::-1])
+            clipped_data = reversed_data.iloc[:int(output)]
+            return clipped_data.to_csv(header=False)
+
+        else:
+            #write all the dataframe back to the binary file with overwrite
+            new_recarray = results_data.to_records()
+            new_recarray.tofile(output)
+            return "Success"
+
+
+def _new_records(engine, df_type, filename):
+    """ Gets the records added to the file since the engine was last updated
+
+    Returns:
+        (np.recarray, int): the new records and the number of bars in the
+            file or None if the engine can't be continued from this file
+
+    """
+
+    if sf.is_share_file(filename):
+        #only map from the last record the engine saw so the older pages aren't read
+        header, mapped = sf.map_records(filename, start=max(engine.input_count - 1, 0))
+        if mapped is None or engine.input_count == 0 or mapped[0]['date'] != engine.last_date:
+            return None
+        records = np.array(mapped[1:])
+        del mapped
+        history = int(header['count'])
+        if len(records) > 0 and (records['date'][0] <= engine.last_date or
+                                 (np.diff(records['date']) <= np.timedelta64(0)).any()):
+            return None
+        return records, history
+
+    records = sort_records(load_records(df_type, filename))
+    if engine.last_date not in records['date']:
+        return None
+    return records[records['date'] > engine.last_date], len(records)
+
+
+def build_features_incremental(df_type, filename, output, line, mmap=False, float32=False, ring=None):
+    """ Same as build_features for a number of bars but only calculates the
+    bars that are newer than the last request for this file and feature string
+
+    Args:
+        df_type (str): the datafeed type ie. whole or single
+        filename (str): path of the binary data
+        output (str): the number of bars to return as csv or the share file
+            to append the new results to
+        line (str): the requested features as function(arg1, arg2);
+        mmap (bool): True if output is a share file
+        float32 (bool): True to write float32 values to the share file, the
+            rolling state is always kept in float64
+        ring (int): the number of results kept if output is a feature ring
+
+    Returns:
+        str: the csv of the newest bars first or Success
+
+    """
+
+    shared = mmap or ring is not None
+
+    #writing the whole history to a plain file needs the batch calculation anyway
+    if not shared and not output.isdigit():
+        return build_features(df_type, filename, output, line, float32=float32)
+
+    count = int(output) if not shared else 0
+    features = parse_features(line)
+
+    key = (filename, line)
+    engine = _incremental_engines.get(key)
+
+    new_records = None
+    if engine is not None and count <= engine.rows.maxlen:
+        new_records = _new_records(engine, df_type, filename)
+
+    #start again if the previous state can't be continued from this data
+    #ie. first request, more rows needed than are kept or a gap in the data
+    restarted = new_records is None
+    if restarted:
+        records = sort_records(load_records(df_type, filename))
+        engine = inc.IncrementalFeatures(features, max_rows=max(count, len(records)))
+        _incremental_engines[key] = engine
+        new_records = (records, len(records))
+
+    records, history = new_records
+    metrics.set_value("restarted", restarted)
+    metrics.set_value("new_bars", len(records))
+    with metrics.stage("calc"):
+        engine.update_records(records, history=history)
+    engine.input_count = history
+
+    with metrics.stage("output"):
+        if shared:
+            rows = len(engine.rows) if restarted else len(records)
+            if ring is not None:
+                rows = min(rows, ring)
+            records = engine.to_records(rows)
+            if float32:
+                records = records.astype(results_dtype(records.dtype.names[1:], float32=True))
+            if ring is not None:
+                sf.write_ring(output, records, ring, append=not restarted)
+            else:
+                sf.write_records(output, records, append=not restarted)
+            return "Success"
+
+        return engine.to_csv(count)
+
+
+def ring_capacity(options):
+    """ The number of results kept by the ring option, None if not given """
+
+    for option in options:
+        if option == "ring":
+            return RING_CAPACITY
+        if option.startswith("ring="):
+            capacity = int(option[len("ring="):])
+            if capacity < 1:
+                raise ValueError("ring must keep at least 1 result")
+            return capacity
+    return None
+
+
+def feature_threads(options):
+    """ The number of threads given by the threads option, None if not given """
+
+    for option in options:
+        if option.startswith("threads="):
+            threads = int(option[len("threads="):])
+            if threads < 1:
+                raise ValueError("threads must be at least 1")
+            return threads
+    return None
+
+
+def run_request(type_line, filename, output, line):
+    """ Runs a single request with any options given after the datafeed type
+
+    Args:
+        type_line (str): the datafeed type followed by any options
+        filename (str): path of the binary data
+        output (str): the output file or number of bars
+        line (str): the requested features as function(arg1, arg2);
+
+    Returns:
+        str: the response to the request
+
+    """
+
+    options = type_line.split()
+    df_type = options[0]
+    options = options[1:]
+
+    ring = ring_capacity(options)
+
+    with metrics.request(type_line):
+        if "incremental" in options or ring is not None:
+            result = build_features_incremental(df_type, filename, output, line, mmap="mmap" in options,
+                                                float32="float32" in options, ring=ring)
+        else:
+            result = build_features(df_type, filename, output, line, mmap="mmap" in options,
+                                    cache="nocache" not in options, float32="float32" in options,
+                                    lookback="lookback" in options, threads=feature_threads(options))
+
+    #tell the host how much history to keep for these features
+    if "lookback" in options:
+        result = result.rstrip("\n") + "\nLOOKBACK {0}\n".format(plan_features(line).lookback)
+    return result
+
+
+def respond(type_line, filename, output, line):
+    """ Runs a request and returns the response without the END line.
+    Errors are returned as a line starting with ERROR """
+
+    try:
+        return run_request(type_line, filename, output, line).rstrip("\n")
+    except Exception as e:
+        #keep the server alive and let the host decide what to do
+        return "ERROR " + repr(e).replace("\n", " ")
+
+
+def read_batch_counts(instream):
+    """ Reads the line of a batch request with the number of jobs and workers
+
+    Returns:
+        (int, int): the number of jobs and the number of workers
+
+    """
+
+    counts = instream.readline().split()
+    if len(counts) == 0:
+        raise ValueError("batch requires the number of jobs")
+    job_count = int(counts[0])
+    workers = int(counts[1]) if len(counts) > 1 else 0
+    if job_count < 0:
+        raise ValueError("batch job count can't be negative")
+    return job_count, workers
+
+
+def read_batch_jobs(instream, job_count):
+    """ Reads exactly the 4 lines of each job so the stream stays in step
+    with the frames. A job cut short by the end of the stream has blank
+    lines, which fail with an ERROR frame of their own """
+
+    jobs = []
+    for _ in range(job_count):
+        jobs.append(tuple(instream.readline().strip() for _ in range(4)))
+    return jobs
+
+
+def read_batch(instream):
+    """ Reads the job count line and the jobs of a batch request
+
+    Returns:
+        ((str, str, str, str)[], int): the jobs and the number of workers
+
+    """
+
+    job_count, workers = read_batch_counts(instream)
+    return read_batch_jobs(instream, job_count), workers
+
+
+def answer_batch(jobs, workers, outstream):
+    """ Runs the jobs and writes a frame for each, every frame is an ERROR
+    if the batch fails as a whole """
+
+    try:
+        responses = run_batch(jobs, workers)
+    except Exception as e:
+        responses = ["ERROR " + repr(e).replace("\n", " ")] * len(jobs)
+    write_batch(responses, outstream)
+
+
+class WorkerPool:
+    """ build_features.py processes running in server mode that the jobs of
+    a batch are shared between. A job is sent to the worker that had its
+    input file before so that worker has the incremental state for it
+
+    Args:
+        size (int): the number of worker processes
+
+    """
+
+    def __init__(self, size):
+        self.workers = []
+        self._assigned = {}
+        for _ in range(size):
+            worker = subprocess.Popen([sys.executable, os.path.abspath(__file__)], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                      universal_newlines=True, bufsize=1)
+            worker.stdin.write("server\n")
+            self.workers.append(worker)
+
+    def _worker_for(self, filename):
+        if filename not in self._assigned:
+            self._assigned[filename] = len(self._assigned) % len(self.workers)
+        return self._assigned[filename]
+
+    def _run_jobs(self, worker, indexes, jobs, responses):
+        try:
+            for i in indexes:
+                worker.stdin.write("\n".join(jobs[i]) + "\n")
+            worker.stdin.flush()
+            for i in indexes:
+                lines = []
+                for line in worker.stdout:
+                    line = line.rstrip("\n")
+                    if line == END_OF_FRAME:
+                        break
+                    lines.append(line)
+                else:
+                    raise RuntimeError("worker exited unexpectedly")
+                responses[i] = "\n".join(lines)
+        except Exception as e:
+            for i in indexes:
+                if responses[i] is None:
+                    responses[i] = "ERROR " + repr(e).replace("\n", " ")
+
+    def run(self, jobs):
+        """ Runs the jobs with each worker working through its jobs in order
+
+        Returns:
+            str[]: the response to each job in the order of the jobs
+
+        """
+
+        queues = [[] for _ in self.workers]
+        for i, job in enumerate(jobs):
+            queues[self._worker_for(job[1])].append(i)
+
+        responses = [None] * len(jobs)
+        threads = []
+        for worker, indexes in zip(self.workers, queues):
+            if len(indexes) > 0:
+                thread = threading.Thread(target=self._run_jobs, args=(worker, indexes, jobs, responses))
+                thread.start()
+                threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return responses
+
+    @property
+    def alive(self):
+        return all(worker.poll() is None for worker in self.workers)
+
+    def stop(self):
+        for worker in self.workers:
+            try:
+                worker.stdin.write(STOP_COMMAND + "\n")
+                worker.stdin.close()
+                worker.wait(5)
+            except (OSError, subprocess.TimeoutExpired):
+                worker.kill()
+        self.workers = []
+
+
+def run_batch(jobs, workers=0):
+    """ Runs the jobs of a batch request
+
+    Args:
+        jobs ((str, str, str, str)[]): the 4 request lines of each job
+        workers (int): the number of worker processes, 0 or 1 runs the jobs
+            one after another in this process. The host should give the
+            same number on every batch, the workers and the incremental
+            state they hold are only kept while it stays the same
+
+    Returns:
+        str[]: the response to each job in the order of the jobs
+
+    """
+
+    global _worker_pool
+
+    #a job whose first line a worker server would read as blank, stop or
+    #batch would put the worker out of step so it is never sent
+    sendable = [i for i, job in enumerate(jobs)
+                if len(job[0].split()) > 0 and job[0].split()[0] not in (STOP_COMMAND, BATCH_COMMAND)]
+    if len(sendable) < len(jobs):
+        responses = ["ERROR " + repr(ValueError("batch job has no datafeed type"))] * len(jobs)
+        for i, response in zip(sendable, run_batch([jobs[i] for i in sendable], workers)):
+            responses[i] = response
+        return responses
+
+    if workers <= 1:
+        return [respond(*job) for job in jobs]
+
+    #the pool is the same size whatever the number of jobs so each file keeps
+    #its worker, it is only started again if the size changes or one has died
+    if _worker_pool is not None and (len(_worker_pool.workers) != workers or not _worker_pool.alive):
+        _worker_pool.stop()
+        _worker_pool = None
+    if _worker_pool is None:
+        _worker_pool = WorkerPool(workers)
+    return _worker_pool.run(jobs)
+
+
+def stop_workers():
+    global _worker_pool
+    if _worker_pool is not None:
+        _worker_pool.stop()
+        _worker_pool = None
+
+
+def write_batch(responses, outstream):
+    for response in responses:
+        outstream.write(response + "\n")
+        outstream.write(END_OF_FRAME + "\n")
+    outstream.flush()
+
+
+def run_server(instream, outstream):
+    """ Answers feature requests until told to stop so that the interpreter
+    and imports are only loaded once
+
+    Args:
+        instream (file): stream to read the request frames from
+        outstream (file): stream to write the response frames to
+
+    """
+
+    while True:
+        df_type = instream.readline()
+
+        #stdin closed by the host
+        if len(df_type) == 0:
+            break
+
+        df_type = df_type.strip()
+        #ignore any blank lines between frames
+        if len(df_type) == 0:
+            continue
+        if df_type == STOP_COMMAND:
+            break
+
+        if df_type == BATCH_COMMAND:
+            try:
+                job_count, workers = read_batch_counts(instream)
+            except ValueError as e:
+                #the number of lines that follow is unknown so nothing after
+                #this can be read as a request
+                write_batch([FATAL_PREFIX + repr(e).replace("\n", " ")], outstream)
+                break
+            answer_batch(read_batch_jobs(instream, job_count), workers, outstream)
+            continue
+
+        filename = instream.readline().strip()
+        output = instream.readline().strip()
+        line = instream.readline().strip()
+
+        outstream.write(respond(df_type, filename, output, line) + "\n")
+        outstream.write(END_OF_FRAME + "\n")
+        outstream.flush()
+
+    stop_workers()
+
+
+def main():
+
+    #get the datafeed type ie. all or single, or server to keep the process running
+    df_type = input()
+
+    if df_type.strip() == "server":
+        run_server(sys.stdin, sys.stdout)
+        return
+
+    if df_type.strip() == BATCH_COMMAND:
+        jobs, workers = read_batch(sys.stdin)
+        try:
+            answer_batch(jobs, workers, sys.stdout)
+        finally:
+            stop_workers()
+        return
+
+    #get the filename for the binary data
+    filename = input()
+    #get the filename for the binary data output - if passed as a number then this is
+    #returned as a string through stdout instead of writing to file
+    output = input()
+    #get the requested features as function(arg1, arg2);
+    line = input()
 
+    print(run_request(df_type, filename, output, line))
 
-features = line.split(';')
-#strip out any excess blanks
-features = [x for x in features if len(x) > 0]
-
-#load the binary data which will just be the date and the value used to calculate
-#the features - dont need all OHLC data
-if(df_type == "single"):
-    dt =  dtype((np.record, [('date', '<M8[ns]'), ('value', '<f4')]))
-else:
-    dt =  dtype((np.record, [('date', '<M8[ns]'), 
-                             ('open', '<f4'), 
-                             ('close', '<f4'), 
-                             ('high', '<f4'), 
-                             ('low', '<f4'), 
-                             ('volume', '<i4')]))
-    
-records = np.fromfile(filename, dt)
-data = pd.DataFrame(records)
-#need to sort because the binary file might not be in order due to the use of a dictionary
-data.index = data["date"]
-data = data.drop('date', axis=1)
-data = data.sort_index() 
-
-
-data["close"] = data["open"]
-
-#create a dataframe to hold the values of each feature
-results_data = pd.DataFrame()
-
-#loop through all the requested features and do the calculations
-for feature_call in features:
-    
-    #extract the required parts from the feature call ie. name and args
-    feature_name = feature_call[:feature_call.index("(")].strip()
-    feature_arg_string = feature_call[feature_call.index("(")+1:feature_call.index(")")]
-    feature_arg_string = feature_arg_string.replace(" ", "")
-    feature_args = feature_arg_string.split(',')   
-    
-    #calculate the indicator and add it to the returning dataframe
-    column_name = feature_call.replace(',', '_').replace('(','_').replace(')','').replace(' ', '')
-    results_data[column_name] = db.calc_feature(data, feature_name, feature_args)
-    results_data.index = data.index
-
-#return in the std ouput if output is specified as the number of bars
-if output.isdigit():
-    #clip to just the required number of bars and reverse the order so it 
-    #is as a series ie. newest data first    
-    reversed_data = results_data.reindex(index=results_data.index[::-1])
-    clipped_data = reversed_data.iloc[:int(output)]
-    print(clipped_data.to_csv(header=False))
-    
-else:    
-    #write all the dataframe back to the binary file with overwrite 
-    new_recarray = results_data.to_records()
-    new_recarray.tofile(output)
-    print("Success")    
 
+if __name__ == "__main__":
+    main()
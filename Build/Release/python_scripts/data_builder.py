@@ -1,6 +1,17 @@
 # -*- coding: utf-8 -*-
 
-def load_bars(assets, verbose=True):
+def _read_csv(filename, use_cache=True):
+    """ Reads a bar or minute data csv indexed by date, from the columnar 
+    bar cache if use_cache is True """
+    
+    if use_cache:
+        import bar_cache
+        return bar_cache.read_csv(filename)
+    
+    import pandas as pd
+    return pd.read_csv(filename, index_col=0, parse_dates=True)
+
+def load_bars(assets, verbose=True, use_cache=True):
     
     import pandas as pd
     
@@ -15,7 +26,7 @@ def load_bars(assets, verbose=True):
         
         if verbose: print("Loading " + asset_file)
         
-        dataset = pd.read_csv(asset_file, index_col=0, parse_dates=True)
+        dataset = _read_csv(asset_file, use_cache)
 
         dataset['open'] = dataset['askopen']
         dataset['close'] = dataset['askclose']
@@ -30,25 +41,186 @@ def load_bars(assets, verbose=True):
         return data[0]
     return data
 
-def compile_from_minute_data(assets, asset_file = None, timeframe = None, save_path=None, verbose=True):
+def _map_assets(function, tasks, workers=None):
+    """ Runs function for each asset either in this process or in a pool of
+    worker processes
+    
+    Args:
+        function (function): module level function that processes one asset
+        tasks (tuple[]): the args for each call of function
+        workers (int): number of worker processes, None or 1 to run in this 
+            process and 0 to use every core
+            
+    Returns:
+        list: the results in the same order as tasks
+    
+    """
+    import os
+    
+    if workers == 0:
+        workers = os.cpu_count()
+        
+    if workers is None or workers <= 1 or len(tasks) <= 1:
+        return [function(*task) for task in tasks]
+    
+    from concurrent.futures import ProcessPoolExecutor
+    
+    #map returns the results in the order of the tasks not the order they finish
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+        return list(executor.map(function, *zip(*tasks)))
+
+def _save_locations(save_path, asset, timeframe):
+    """ The save location of an asset or a dict of time frame to save 
+    location if a list of time frames is given """
+    
+    if save_path is None:
+        return None
+    
+    save_location = save_path.replace("{ASSET}", asset)
+    if type(timeframe) != list:
+        return save_location
+    return {tf: save_location.replace("{TIMEFRAME}", tf) for tf in timeframe}
+
+def _compile_asset(asset, asset_file, timeframe, save_path, verbose, return_data=True, use_cache=True, 
+                   chunk_size=None, append=False):
+    """ Compiles the bars for a single asset, see compile_from_minute_data """
+    
+    if type(asset) == str:
+    
+        if verbose: print("Reading {0}...".format(asset))
+        
+        asset = asset.replace("/", "")
+        
+        file_location = asset_file.replace("{ASSET}", asset)
+        print(file_location)
+        
+        #stream the minute data in chunks rather than loading it all
+        if timeframe is not None and (chunk_size is not None or append):
+            import bar_resampler
+            
+            save_location = _save_locations(save_path, asset, timeframe)
+            bars = bar_resampler.resample_file(file_location, timeframe, save_location, 
+                                               chunk_size or bar_resampler.DEFAULT_CHUNK_SIZE, append,
+                                               return_data or save_location is None)
+            if not return_data and save_location is not None:
+                return (asset, save_location)
+            return (asset, bars)
+        
+        #get the minute data
+        dataset = _read_csv(file_location, use_cache)
+        
+        #Create the OHLC values based on Ask price - this is inline with Zorro 
+        #Trading Platform that also uses Ask price
+        #the Index time value is the time at the start of the bar so all this 
+        #information is known only after the bar has closed
+
+        dataset['open'] = dataset['askopen']
+        dataset['close'] = dataset['askclose']
+        dataset['high'] = dataset['askhigh']
+        dataset['low'] = dataset['asklow']
+        dataset['spread_close'] = dataset['askclose'] - dataset['bidclose']
+        dataset['spread_open'] = dataset['askopen'] - dataset['bidopen']
+        dataset['spread_max'] = dataset['askhigh'] - dataset['bidlow']
+        dataset['volume'] = dataset['tickqty']
+   
+    #tuple of asset name and dataFrame
+    else:            
+        dataset = asset[1]
+        asset = asset[0]        
+    
+    if timeframe is None:
+        return (asset, dataset)
+    
+    #build every time frame from the one minute dataset, the higher time 
+    #frames are aggregated from the lower time frame bars
+    if type(timeframe) == list:
+        import bar_resampler
+        
+        timeframe_bars = bar_resampler.resample_timeframes(dataset, timeframe)
+        save_locations = _save_locations(save_path, asset, timeframe)
+        if save_locations is not None:
+            for tf, bars in timeframe_bars.items():
+                if verbose: print("Saving {0} {1}...".format(asset, tf))
+                bars.to_csv(save_locations[tf])
+                
+            if not return_data:
+                return (asset, save_locations)
+            
+        return (asset, timeframe_bars)
+    
+    #resample the minute data into the new timeframe
+    #conversion = {'open': 'first', 'high': 'max', 'low' : 'min', 'close': 'last', 'volume' : 'sum', 'spread_open': 'first', 'spread_close': 'last', 'spread_max' : 'max'}        
+    conversion = {'bidopen': 'first', 'bidclose': 'last', 'bidhigh': 'max', 'bidlow' : 'min', 
+                  'open': 'first', 'close': 'last', 'high': 'max', 'low' : 'min',                           
+                  'volume' : 'sum'}        
+    bars = dataset.resample(timeframe).agg(conversion)
+    
+    #get rid of the weekend bars and bars with no data
+    bars = bars.dropna()
+    
+    #get some info about the open of the next bar because it may be
+    #at the other side of the weekend and this is when a trade will
+    #be opened based on info  from the last complete bar    
+    bars["temp"] = bars.index
+    bars["next_bar_open"] = bars["temp"].shift(-1)
+    bars = bars.drop("temp", axis=1)
+    #the actual price a trade will be opened will be the first price of the
+    #next bar so store this for convenience
+    bars["next_askopen"] = bars["open"].shift(-1)
+    bars["next_bidopen"] = bars["bidopen"].shift(-1) #- bars["spread_open"].shift(-1)
+    
+    if save_path is not None:
+        if verbose: print("Saving {0}...".format(asset))
+        save_location = save_path.replace("{ASSET}", asset)
+        bars.to_csv(save_location)
+        
+        if not return_data:
+            return (asset, save_location)
+        
+    return (asset, bars)
+
+def compile_from_minute_data(assets, asset_file = None, timeframe = None, save_path=None, verbose=True, 
+                             workers=None, return_data=True, use_cache=True, chunk_size=None, append=False):
     """ Compiles higher level OHLC bars from minute data
     
     Args:
         assets (str or str[]): a single asset name or array of asset names
-        timeframe (str): the time frame of the bar eg. 1H is 1 hour bars
+        timeframe (str or str[]): the time frame of the bar eg. 1H is 1 hour bars
+            or a list of time frames that are all built from one read of the 
+            minute data
         asset_file (str): Path of the minute data with a placeholder {ASSET} that will
             be substituted with the asset name
         save_path (str): Path to save the bar data with a placeholder {ASSET} that will
-            be substituted with the asset name
+            be substituted with the asset name and a placeholder {TIMEFRAME} 
+            for the time frame if a list of time frames is given
         verbose (bool): True if progress printing to console is desired
+        workers (int): number of processes to compile the assets in parallel, 
+            None or 1 compiles them one after the other in this process and 0 
+            uses every core
+        return_data (bool): False to return the save location of each asset 
+            instead of the bars when save_path is given. Stops the workers 
+            sending large frames back to this process
+        use_cache (bool): True to read the minute data through the columnar 
+            bar cache so the dates are only parsed on the first run
+        chunk_size (int): number of minute rows to read at a time, the 
+            minute data is streamed into the bars so the memory used doesn't 
+            depend on the length of the history. None loads all the minute 
+            data at once
+        append (bool): True to add the minute data onto the bars already in 
+            save_path rather than compiling the whole history again. The 
+            last saved bar is rebuilt so the minute data must start no 
+            later than its open
             
     Returns:
         pd.DataFrame:  a single tuple of (asset name, dataframe) of the 
             bar data if a single asset was passed or an array of (asset name, dataframes)
-            if an array of assets was passed
+            if an array of assets was passed. The dataframe is a dict of time 
+            frame to dataframe if a list of time frames was passed
     
     """
-    import pandas as pd
+    
+    if type(timeframe) == list and save_path is not None and "{TIMEFRAME}" not in save_path:
+        raise ValueError('save_path must have a {TIMEFRAME} placeholder when a list of time frames is passed.')
     
     #if a single asset is passed just put it in a single item list
     if type(assets) == str or type(assets) == tuple:
@@ -56,71 +228,13 @@ def compile_from_minute_data(assets, asset_file = None, timeframe = None, save_p
     elif type(assets) != list:
         raise ValueError('assets must be a string or a list of strings.')
         
-    asset_data_list = []
-        
     #create the bars for every asset in the assets array
-    for asset in assets:   
+    if append and save_path is None:
+        raise ValueError('save_path is required to append to the bars.')
         
-        if type(asset) == str:
-        
-            if verbose: print("Reading {0}...".format(asset))
-            
-            asset = asset.replace("/", "")
-            
-            file_location = asset_file.replace("{ASSET}", asset)
-            print(file_location)
-            #get the minute data
-            dataset = pd.read_csv(file_location, index_col=0, parse_dates=True)
-            
-            #Create the OHLC values based on Ask price - this is inline with Zorro 
-            #Trading Platform that also uses Ask price
-            #the Index time value is the time at the start of the bar so all this 
-            #information is known only after the bar has closed
-
-            dataset['open'] = dataset['askopen']
-            dataset['close'] = dataset['askclose']
-            dataset['high'] = dataset['askhigh']
-            dataset['low'] = dataset['asklow']
-            dataset['spread_close'] = dataset['askclose'] - dataset['bidclose']
-            dataset['spread_open'] = dataset['askopen'] - dataset['bidopen']
-            dataset['spread_max'] = dataset['askhigh'] - dataset['bidlow']
-            dataset['volume'] = dataset['tickqty']
-       
-        #tuple of asset name and dataFrame
-        else:            
-            dataset = asset[1]
-            asset = asset[0]        
-        
-        if timeframe is not None:
-            #resample the minute data into the new timeframe
-            #conversion = {'open': 'first', 'high': 'max', 'low' : 'min', 'close': 'last', 'volume' : 'sum', 'spread_open': 'first', 'spread_close': 'last', 'spread_max' : 'max'}        
-            conversion = {'bidopen': 'first', 'bidclose': 'last', 'bidhigh': 'max', 'bidlow' : 'min', 
-                          'open': 'first', 'close': 'last', 'high': 'max', 'low' : 'min',                           
-                          'volume' : 'sum'}        
-            bars = dataset.resample(timeframe).agg(conversion)
-            
-            #get rid of the weekend bars and bars with no data
-            bars = bars.dropna()
-            
-            #get some info about the open of the next bar because it may be
-            #at the other side of the weekend and this is when a trade will
-            #be opened based on info  from the last complete bar    
-            bars["temp"] = bars.index
-            bars["next_bar_open"] = bars["temp"].shift(-1)
-            bars = bars.drop("temp", axis=1)
-            #the actual price a trade will be opened will be the first price of the
-            #next bar so store this for convenience
-            bars["next_askopen"] = bars["open"].shift(-1)
-            bars["next_bidopen"] = bars["bidopen"].shift(-1) #- bars["spread_open"].shift(-1)
-            
-            if save_path is not None:
-                if verbose: print("Saving {0}...".format(asset))
-                save_location = save_path.replace("{ASSET}", asset)
-                bars.to_csv(save_location)
-                
-            asset_data_list.append((asset, bars))
-        else:
-            asset_data_list.append((asset, dataset))
+    tasks = [(asset, asset_file, timeframe, save_path, verbose, return_data, use_cache, chunk_size, append) 
+             for asset in assets]
+    asset_data_list = _map_assets(_compile_asset, tasks, workers)
         
     #if there was just one asset just return a single dataframe, otherwise 
     #return the list of dataframes, one for each asset
@@ -129,7 +243,7 @@ def compile_from_minute_data(assets, asset_file = None, timeframe = None, save_p
     else:
         return asset_data_list
     
-def bars_from_file(assets, asset_file, verbose=True):    
+def bars_from_file(assets, asset_file, verbose=True, use_cache=True):    
     """ Reads OHLC bars from file
     
     Args:
@@ -137,6 +251,7 @@ def bars_from_file(assets, asset_file, verbose=True):
         asset_file (str): Path of the minute data with a placeholder {ASSET} that will
             be substituted with the asset name   
         verbose (bool): True if progress printing to console is desired
+        use_cache (bool): True to read the bars through the columnar bar cache
             
     Returns:
         pd.DataFrame:  a single tuple of (asset name, dataframe) of the 
@@ -162,7 +277,7 @@ def bars_from_file(assets, asset_file, verbose=True):
         file_location = asset_file.replace("{ASSET}", asset)
         
         #get the bar data
-        dataset = pd.read_csv(file_location, index_col=0, parse_dates=True)
+        dataset = _read_csv(file_location, use_cache)
         
         asset_data_list.append((asset, dataset))
     
@@ -176,7 +291,112 @@ def bars_from_file(assets, asset_file, verbose=True):
 
 
     
-def add_features(asset_data, features = None, save_path=None, verbose=True):
+def _add_asset_features(asset, data, features, save_path, verbose, return_data=True):
+    """ Adds the features to the bars of a single asset, see add_features """
+    
+    #helper function for creating logs
+    def replace_zero_with_min(series):
+        return series.replace(0, series.loc[series > 0].min())  
+
+    import pandas as pd
+    import numpy as np
+    from pyti import bollinger_bands as bbands
+    from pyti import average_true_range as atr
+    
+    
+    if verbose: print("Calculating features for {0}".format(asset))
+    
+    #Lower Bollinger Band, 20 periods, std = 2 
+    if features == None or 'lower_bb' in features: 
+        data['lower_bb'] = bbands.lower_bollinger_band(data["close"], 20, std=2.0)
+        
+    #Upper Bollinger Band, 20 periods, std = 2 
+    if features == None or 'upper_bb' in features: 
+        data['upper_bb'] = bbands.upper_bollinger_band(data["close"], 20, std_mult=2.0)
+        
+    #Average True Range
+    if features == None or 'atr' in features: 
+            data["atr"] = atr.average_true_range(data["close"], 24) / \
+                atr.average_true_range(data["close"], 200)
+    
+    #Volatility is the standard deviation over 12 periods of the difference
+    #between high and low of the bar
+    if features == None or 'volatility_12' in features: 
+        data["volatility_12"] = (data["high"] - data["low"]).rolling(12).std() 
+        
+    #Volatility is the standard deviation over 200 periods of the difference
+    #between high and low of the bar
+    if features == None or 'volatility_200' in features: 
+        data["volatility_200"] = (data["high"] - data["low"]).rolling(200).std() 
+        
+    #Volatility is relative change of the alst 12 bars over the last 200
+    if features == None or 'volatility' in features: 
+        data["volatility"] = data["volatility_12"] / data["volatility_200"]
+        
+    #Relative volume compared to the last 100 bars
+    if features == None or 'volume_change' in features: 
+        data["volume_change"] = data["volume"] / data["volume"].rolling(100).mean()
+        
+    #Distance between the close price and the upper bollinger bad
+    if features == None or 'bb_dist_upper' in features: 
+        data["bb_dist_upper"] = data["upper_bb"] - data["close"]
+        
+    #Distance between the close price and the lower bollinger bad
+    if features == None or 'bb_dist_lower' in features: 
+        data["bb_dist_lower"] = -(data["lower_bb"] - data["close"])
+        
+        
+    #Distance between the upper and lower bollinger bands
+    if features == None or 'bb_range' in features: 
+        data["bb_range"] = (data["upper_bb"] - data["lower_bb"]) / data["close"]
+        
+    #The absolute value of the % return over the last 4 bars
+    if features == None or 'change_4bar' in features: 
+        data["change_4bar"] = np.abs(np.log(data["close"] / data["close"].shift(4)))
+
+    #The Augmented Dicker Fuller test which can show mean reverting or trending markets
+    #from statsmodels.tsa.stattools import adfuller  
+    #if features == None or 'adf' in features: 
+    #    data["adf"] = data['Close'].rolling(200).apply(lambda x: adfuller(x)[0], raw=False)
+    
+    #The log of the % return
+    if features == None or 'log_return' in features: 
+        data["log_return"] = np.log(data["close"] / data["close"].shift(1))
+        
+
+    #TODO add in the if feature statements
+    #add logs - do this by replacing all zeros with the minimum value after zeros are removed
+    if 1 == 0:
+        data["volume_log"] = np.log(replace_zero_with_min(data["volume"])) / np.log(replace_zero_with_min(data["volume"].rolling(200).mean()))
+        data["atr_log"] = np.log(replace_zero_with_min(data["atr"]))
+        data["volatility_log"] = np.log(replace_zero_with_min(data["volatility"]))
+        data["change_4bar_log"] = np.log(replace_zero_with_min(data["change_4bar"]))
+        
+        #add moving averages
+        data["volume_log_ma_12"] = data["volume_log"].rolling(12).mean()
+        data["volume_log_ma_24"] = data["volume_log"].rolling(24).mean()
+        data["volume_log_ma_48"] = data["volume_log"].rolling(48).mean()
+        data["volatility_log_ma_12"] = data["volatility_log"].rolling(12).mean()
+        data["volatility_log_ma_24"] = data["volatility_log"].rolling(24).mean()
+        data["volatility_log_ma_48"] = data["volatility_log"].rolling(48).mean()
+        data["change_4bar_log_ma_12"] = data["change_4bar_log"].rolling(12).mean()
+        data["change_4bar_log_ma_24"] = data["change_4bar_log"].rolling(24).mean()
+        data["change_4bar_log_ma_48"] = data["change_4bar_log"].rolling(48).mean()
+        data["log_return_ma_12"] = data["log_return"].rolling(12).mean()
+        data["log_return_ma_24"] = data["log_return"].rolling(24).mean()
+        data["log_return_ma_48"] = data["log_return"].rolling(48).mean()
+    
+    if save_path is not None:
+        if verbose: print("Saving {0}...".format(asset))
+        save_location = save_path.replace("{ASSET}", asset)
+        data.to_csv(save_location)
+        
+        if not return_data:
+            return (asset, save_location)
+        
+    return (asset, data)
+
+def add_features(asset_data, features = None, save_path=None, verbose=True, workers=None, return_data=True):
     """ Adds features to the bar data. If no features are passed then all features
     are added.
     
@@ -188,6 +408,13 @@ def add_features(asset_data, features = None, save_path=None, verbose=True):
         save_path (str): Path to save the bar data with features. A 
         placeholder {ASSET} that will be substituted with the asset name
         verbose (bool): True if progress printing to console is desired
+        workers (int): number of processes to calculate the assets in parallel, 
+            None or 1 calculates them one after the other in this process and 0 
+            uses every core. The features are added to copies of the bar data 
+            in the worker processes rather than to the passed dataframes
+        return_data (bool): False to return the save location of each asset 
+            instead of the bars when save_path is given. Stops the workers 
+            sending large frames back to this process
         
     Returns:
         (str, pd.DataFrame): a single tuple of (asset name, dataframe) of the 
@@ -196,122 +423,211 @@ def add_features(asset_data, features = None, save_path=None, verbose=True):
     
     """
     
-    #helper function for creating logs
-    def replace_zero_with_min(series):
-        return series.replace(0, series.loc[series > 0].min())  
-
-    import pandas as pd
-    import numpy as np
-    from pyti import bollinger_bands as bbands
-    from pyti import average_true_range as atr
-    
     #if a single dataframe is passed just put it in a single item list
     if type(asset_data) == tuple:
         asset_data = [asset_data]
     elif type(asset_data) != list:
         raise ValueError('asset_data must be a pandas.DataFrame or a list of pandas.Dataframe.')
 
-    feature_bars = []
+    tasks = [(asset, data, features, save_path, verbose, return_data) for asset, data in asset_data]
+    feature_bars = _map_assets(_add_asset_features, tasks, workers)
         
-    for asset, data in asset_data:
+    #if there was just one dataFrame just return a single dataframe, otherwise 
+    #return the list of dataframes, one for each asset
+    if len(feature_bars) == 1:
+        return feature_bars[0]
+    else:
+        return feature_bars
+
+#bars of history before a partition that the add_features windows need, the
+#longest is the 200 bar volatility
+FEATURE_WARMUP = 200
+
+#largest difference allowed between a partitioned feature and the same
+#feature from add_features on the whole history, relative to the largest
+#value of the feature. The pandas rolling sums are carried from the start of
+#the data they are given so they only agree to rounding, about 1e-13
+PARTITION_TOLERANCE = 1e-9
+
+def add_features_partitioned(partitions, features = None, save_path = None, verbose = True, use_cache = True):
+    """ Out of core add_features for bar data split into files by time eg. one
+    file per year. The partitions are read one at a time in date order with
+    the last FEATURE_WARMUP bars of the partition before in front of them and
+    each partition is written as soon as its features are calculated. Only
+    one partition is in memory at a time. 
+    
+    The features have the same nans as add_features on the whole history 
+    and the same values to within PARTITION_TOLERANCE of the largest value 
+    of each feature. They aren't bit for bit the same as pandas carries its 
+    rolling sums from the first bar it is given, which here is the start of 
+    the warm up rather than the start of the history. check_partitioned 
+    compares the two
+    
+    Args:
+        partitions (str or str[]): paths of the bar csv partitions in date 
+            order or a glob pattern whose matches sort in date order eg. 
+            C:\\bars\\EURUSD_H1_*.csv
+        features (str[]): a list of features to include, all features but 
+            atr if this is None. atr is a smoothed average of the whole 
+            history so it can't be calculated a partition at a time
+        save_path (str): path to save each partition with features to. A 
+            placeholder {PARTITION} is substituted with the file name of the
+            partition without its extension
+        verbose (bool): True if progress printing to console is desired
+        use_cache (bool): True to read the partitions through the bar cache
+            
+    Returns:
+        str[]: the save location of each partition
+    
+    """
+    
+    import glob
+    import os
+    import pandas as pd
+    
+    if type(partitions) == str:
+        partitions = sorted(glob.glob(partitions))
+    if save_path is None or "{PARTITION}" not in save_path:
+        raise ValueError("save_path must contain a {PARTITION} placeholder")
+    if features is None:
+        features = ['lower_bb', 'upper_bb', 'volatility_12', 'volatility_200', 'volatility', 'volume_change',
+                    'bb_dist_upper', 'bb_dist_lower', 'bb_range', 'change_4bar', 'log_return']
+    elif 'atr' in features:
+        raise ValueError("atr depends on the whole history so can't be calculated a partition at a time")
+    
+    save_locations = []
+    tail = None
+    for partition in partitions:
+        name = os.path.splitext(os.path.basename(partition))[0]
+        if verbose: print("Calculating features for {0}".format(name))
         
-        if verbose: print("Calculating features for {0}".format(asset))
+        bars = _read_csv(partition, use_cache)
+        if tail is not None and len(bars) > 0 and bars.index[0] <= tail.index[-1]:
+            raise ValueError("{0} starts before the end of the partition before it".format(partition))
         
-        #Lower Bollinger Band, 20 periods, std = 2 
-        if features == None or 'lower_bb' in features: 
-            data['lower_bb'] = bbands.lower_bollinger_band(data["close"], 20, std=2.0)
-            
-        #Upper Bollinger Band, 20 periods, std = 2 
-        if features == None or 'upper_bb' in features: 
-            data['upper_bb'] = bbands.upper_bollinger_band(data["close"], 20, std_mult=2.0)
-            
-        #Average True Range
-        if features == None or 'atr' in features: 
-                data["atr"] = atr.average_true_range(data["close"], 24) / \
-                    atr.average_true_range(data["close"], 200)
-        
-        #Volatility is the standard deviation over 12 periods of the difference
-        #between high and low of the bar
-        if features == None or 'volatility_12' in features: 
-            data["volatility_12"] = (data["high"] - data["low"]).rolling(12).std() 
-            
-        #Volatility is the standard deviation over 200 periods of the difference
-        #between high and low of the bar
-        if features == None or 'volatility_200' in features: 
-            data["volatility_200"] = (data["high"] - data["low"]).rolling(200).std() 
-            
-        #Volatility is relative change of the alst 12 bars over the last 200
-        if features == None or 'volatility' in features: 
-            data["volatility"] = data["volatility_12"] / data["volatility_200"]
-            
-        #Relative volume compared to the last 100 bars
-        if features == None or 'volume_change' in features: 
-            data["volume_change"] = data["volume"] / data["volume"].rolling(100).mean()
-            
-        #Distance between the close price and the upper bollinger bad
-        if features == None or 'bb_dist_upper' in features: 
-            data["bb_dist_upper"] = data["upper_bb"] - data["close"]
-            
-        #Distance between the close price and the lower bollinger bad
-        if features == None or 'bb_dist_lower' in features: 
-            data["bb_dist_lower"] = -(data["lower_bb"] - data["close"])
-            
-            
-        #Distance between the upper and lower bollinger bands
-        if features == None or 'bb_range' in features: 
-            data["bb_range"] = (data["upper_bb"] - data["lower_bb"]) / data["close"]
-            
-        #The absolute value of the % return over the last 4 bars
-        if features == None or 'change_4bar' in features: 
-            data["change_4bar"] = np.abs(np.log(data["close"] / data["close"].shift(4)))
-    
-        #The Augmented Dicker Fuller test which can show mean reverting or trending markets
-        #from statsmodels.tsa.stattools import adfuller  
-        #if features == None or 'adf' in features: 
-        #    data["adf"] = data['Close'].rolling(200).apply(lambda x: adfuller(x)[0], raw=False)
-        
-        #The log of the % return
-        if features == None or 'log_return' in features: 
-            data["log_return"] = np.log(data["close"] / data["close"].shift(1))
-            
+        #the features are calculated on a copy with the warm up bars in front
+        #then just the bars of this partition are kept
+        data = bars if tail is None else pd.concat([tail, bars])
+        _, data = _add_asset_features(name, data.copy(), features, None, False)
+        data = data.iloc[len(data) - len(bars):]
+        
+        save_location = save_path.replace("{PARTITION}", name)
+        data.to_csv(save_location)
+        save_locations.append(save_location)
+        
+        #a partition shorter than the warm up keeps some of the bars before it
+        if tail is None or len(bars) >= FEATURE_WARMUP:
+            tail = bars.iloc[-FEATURE_WARMUP:]
+        else:
+            tail = pd.concat([tail, bars]).iloc[-FEATURE_WARMUP:]
+        
+    return save_locations
 
-        #TODO add in the if feature statements
-        #add logs - do this by replacing all zeros with the minimum value after zeros are removed
-        if 1 == 0:
-            data["volume_log"] = np.log(replace_zero_with_min(data["volume"])) / np.log(replace_zero_with_min(data["volume"].rolling(200).mean()))
-            data["atr_log"] = np.log(replace_zero_with_min(data["atr"]))
-            data["volatility_log"] = np.log(replace_zero_with_min(data["volatility"]))
-            data["change_4bar_log"] = np.log(replace_zero_with_min(data["change_4bar"]))
+def check_partitioned(partitions, save_locations, features = None, use_cache = True, 
+                      tolerance = PARTITION_TOLERANCE):
+    """ Compares the output of add_features_partitioned column by column with
+    the features calculated on the whole history in memory
+    
+    Args:
+        partitions (str or str[]): the partitions given to 
+            add_features_partitioned
+        save_locations (str[]): the files it returned
+        features (str[]): the features it was given
+        use_cache (bool): True to read the partitions through the bar cache
+        tolerance (float): largest difference allowed relative to the 
+            largest value of the feature
             
-            #add moving averages
-            data["volume_log_ma_12"] = data["volume_log"].rolling(12).mean()
-            data["volume_log_ma_24"] = data["volume_log"].rolling(24).mean()
-            data["volume_log_ma_48"] = data["volume_log"].rolling(48).mean()
-            data["volatility_log_ma_12"] = data["volatility_log"].rolling(12).mean()
-            data["volatility_log_ma_24"] = data["volatility_log"].rolling(24).mean()
-            data["volatility_log_ma_48"] = data["volatility_log"].rolling(48).mean()
-            data["change_4bar_log_ma_12"] = data["change_4bar_log"].rolling(12).mean()
-            data["change_4bar_log_ma_24"] = data["change_4bar_log"].rolling(24).mean()
-            data["change_4bar_log_ma_48"] = data["change_4bar_log"].rolling(48).mean()
-            data["log_return_ma_12"] = data["log_return"].rolling(12).mean()
-            data["log_return_ma_24"] = data["log_return"].rolling(24).mean()
-            data["log_return_ma_48"] = data["log_return"].rolling(48).mean()
+    Returns:
+        dict: feature name to its largest relative difference
         
-        feature_bars.append((asset, data))
+    Raises:
+        ValueError: if a feature has different nans or differs by more than 
+            the tolerance
+    
+    """
+    
+    import glob
+    import numpy as np
+    import pandas as pd
+    
+    if type(partitions) == str:
+        partitions = sorted(glob.glob(partitions))
+    
+    whole = pd.concat([_read_csv(partition, use_cache) for partition in partitions])
+    partitioned = pd.concat([pd.read_csv(location, index_col=0, parse_dates=True, float_precision='round_trip') 
+                             for location in save_locations])
+    if len(whole) != len(partitioned) or not (whole.index == partitioned.index).all():
+        raise ValueError("The partitioned bars are not the bars of the partitions")
+    
+    columns = [column for column in partitioned.columns if column not in whole.columns]
+    _, expected = _add_asset_features("check", whole.copy(), columns if features is None else features, None, False)
+    
+    deviations = {}
+    failed = []
+    for column in columns:
+        actual = partitioned[column].to_numpy(dtype=np.float64)
+        wanted = expected[column].to_numpy(dtype=np.float64)
+        same_nans = np.array_equal(np.isnan(actual), np.isnan(wanted))
         
-        if save_path is not None:
-            if verbose: print("Saving {0}...".format(asset))
-            save_location = save_path.replace("{ASSET}", asset)
-            data.to_csv(save_location)
+        finite = np.isfinite(actual) & np.isfinite(wanted)
+        scale = np.abs(wanted[finite]).max() if finite.any() else 0.0
+        difference = np.abs(actual[finite] - wanted[finite]).max() if finite.any() else 0.0
+        deviations[column] = float(difference / scale if scale > 0 else difference)
         
-    #if there was just one dataFrame just return a single dataframe, otherwise 
-    #return the list of dataframes, one for each asset
-    if len(feature_bars) == 1:
-        return feature_bars[0]
-    else:
-        return feature_bars
+        if not same_nans or deviations[column] > tolerance:
+            failed.append("{0} ({1})".format(column, "nans differ" if not same_nans else 
+                                             "{0:.3e}".format(deviations[column])))
+    
+    if len(failed) > 0:
+        raise ValueError("Partitioned features differ from add_features: " + ", ".join(failed))
+    return deviations
+
+def sweep_feature(data, feature, windows, **options):
+    """ Calculates a feature for many window lengths from one pass over the
+    bars, see feature_sweep.py. For feature research where a DataFrame column
+    per window would be too slow and too big
+    
+    Args:
+        data (pd.DataFrame): the bar data of a single asset
+        feature (str): the feature eg. volatility, volume_change or upper_bb
+        windows (int[]): the window lengths eg. range(5, 501, 5)
+        **options: passed to the feature eg. column="open" or std_mult=1.8
+        
+    Returns:
+        np.ndarray: float32 bars x windows, row i is data.index[i] and 
+            column j is windows[j]
+    
+    """
+    
+    import feature_sweep
+    return feature_sweep.sweep(data, feature, windows, **options)
 
 def calc_feature(data, feature, args):
+    """ Calculates a feature registered in feature_registry from the bar data
+    without changing it
+
+    Args:
+        data (pd.DataFrame): the bar data
+        feature (str): name of the feature eg. SMA
+        args (str[]): the feature arguments eg. ['20', 'close']
+
+    Returns:
+        pd.Series: the feature values indexed the same as data
+
+    """
+
+    import pandas as pd
+    import feature_registry
+
+    definition = feature_registry.get(feature)
+    parsed = definition.parse_args(args)
+    columns = {parsed[i]: data[parsed[i]].to_numpy() for i in definition.columns}
+    return pd.Series(definition.calculate(columns, args), index=data.index)
+
+
+def calc_feature_pandas(data, feature, args):
+    """ The original pandas and pyti calc_feature, kept as the reference the
+    feature_kernels are checked and benchmarked against """
     
     #helper function for creating logs
     def replace_zero_with_min(series):
@@ -360,17 +676,17 @@ def calc_feature(data, feature, args):
         #smooths with a moving average
         if len(args) != 3:
             raise ValueError("ATR requires 3 args; period, high column name, low column name")   
-        data["volatility_12"] = (data[args[1]] - data[args[2]]).rolling(12).std() 
-        data["volatility_200"] = (data[args[1]] - data[args[2]]).rolling(200).std() 
-        data["volatility"] = data["volatility_12"] / data["volatility_200"]
-        data["volatility_log"] = np.log(replace_zero_with_min(data["volatility"]))   
-        return data["volatility_log"].rolling(int(args[0])).mean()
+        volatility_12 = (data[args[1]] - data[args[2]]).rolling(12).std() 
+        volatility_200 = (data[args[1]] - data[args[2]]).rolling(200).std() 
+        volatility = volatility_12 / volatility_200
+        volatility_log = np.log(replace_zero_with_min(volatility))   
+        return volatility_log.rolling(int(args[0])).mean()
     
     elif feature == "VOLUME_LOG_MA":
         if len(args) != 2:
             raise ValueError("VOLUME_LOG_MA requires 2 args; period, column name")   
-        data["volume_log"] = np.log(replace_zero_with_min(data[args[1]])) / np.log(replace_zero_with_min(data[args[1]].rolling(200).mean()))
-        return data["volume_log"].rolling(int(args[0])).mean()
+        volume_log = np.log(replace_zero_with_min(data[args[1]])) / np.log(replace_zero_with_min(data[args[1]].rolling(200).mean()))
+        return volume_log.rolling(int(args[0])).mean()
   
     
 def add_additional_features(asset_data, features, save_path=None, verbose=True):
@@ -424,7 +740,27 @@ def add_additional_features(asset_data, features, save_path=None, verbose=True):
         return feature_bars
     
     
-def merge_trades(asset_data, trade_path):
+#columns that are flipped by the trade direction, (new column, bar column, 
+#sign for a short trade, sign for a long trade)
+DIRECTION_COLUMNS = [("bb_dist_upper", "bb_dist_upper", -1, 1),
+                     ("bb_dist_lower", "bb_dist_lower", 1, -1),
+                     ("log_return_direction", "log_return", 1, -1),
+                     ("log_return_direction_12", "log_return_ma_12", 1, -1),
+                     ("log_return_direction_24", "log_return_ma_24", 1, -1),
+                     ("log_return_direction_48", "log_return_ma_48", 1, -1)]
+
+def _bar_length(asset_data):
+    """ The bar length of the bar data, the median spacing of the bar dates.
+    The longest of the assets if they differ """
+    
+    import pandas as pd
+    
+    lengths = [pd.Series(pd.DatetimeIndex(data.index)).diff().median() for asset, data in asset_data if len(data) > 1]
+    if len(lengths) == 0:
+        raise ValueError("The bar length can't be found from less than 2 bars, give a tolerance")
+    return max(lengths)
+
+def merge_trades(asset_data, trade_path, tolerance="0s"):
     """ Loads the trades csv from Zorro and merges the data with bar data 
         that is know at the time of placing the trade
         
@@ -435,83 +771,183 @@ def merge_trades(asset_data, trade_path):
                 placeholder {ASSET} that will be substituted with the asset name. 
                 If no placeholder is in the string then the filename will be loaded
                 as is.
+            tolerance (str or pd.Timedelta): the longest time between the open 
+                of the bar after the merged bar and the trade entry eg. '1h'. 
+                The default 0s only merges a bar whose next bar opened at the
+                entry, the same as an exact join on next_bar_open. "bar" is 
+                one bar length from the spacing of the bar dates. Trades with
+                no bar within the tolerance are kept with nan bar columns, 
+                which makes integer bar columns eg. volume float64. None 
+                matches the last bar closed before the entry however long ago
                 
         Returns:
             pd.DataFrame: all the trades with the known features at the time of
                 placing the trades
     """
+    import re
     import pandas as pd
     import numpy as np
     
-    trade_sets = []
-    
      #if a single dataframe is passed just put it in a single item list
     if type(asset_data) == tuple:
         asset_data = [asset_data]
     elif type(asset_data) != list:
         raise ValueError('asset_data must be a (str, pandas.DataFrame) or a list of (str, pandas.Dataframe).')
 
+    asset_names = [asset for asset, data in asset_data]
+    trade_sets = []
+    
+    #If trades are in separate asset files load from these files
+    if "{ASSET}" in trade_path:
+        for i, asset in enumerate(asset_names):
+            trades = pd.read_csv(trade_path.replace("{ASSET}", asset), parse_dates=True)
+            trade_sets.append(trades.assign(asset_key=i))
     
-    #If no placeholder then load all trades from the one file
-    if "{ASSET}" not in trade_path:
+    #If no placeholder then load all trades from the one file and split them 
+    #by asset using the category codes so each asset only matches the 
+    #distinct asset names rather than every trade
+    else:
         all_trades = pd.read_csv(trade_path, parse_dates=True)
+        trade_assets = all_trades["Asset"].astype("category")
+        codes = trade_assets.cat.codes.to_numpy()
+        for i, asset in enumerate(asset_names):
+            matching = [code for code, name in enumerate(trade_assets.cat.categories) 
+                        if re.search(asset, str(name))]
+            trade_sets.append(all_trades.loc[np.isin(codes, matching)].assign(asset_key=i))
+            
+    trades = pd.concat(trade_sets, ignore_index=True)
+    
+    #Update the Open and Close time of the trade so the column names
+    #don't conflict with the bar columns
+    trades["Entry Time"] = pd.to_datetime(trades["open"])
+    trades["Exit Time"] = pd.to_datetime(trades["close"])
+    trades = trades.drop(["open", "close"], axis=1)
+    
+    #all the bar data with a key for the asset it belongs to, the last bar 
+    #has no next bar so can't be merged
+    bars = pd.concat([data.assign(asset_key=i) for i, (asset, data) in enumerate(asset_data)], ignore_index=True)
+    #the as of join needs both times in the same resolution
+    bars["next_bar_open"] = pd.to_datetime(bars["next_bar_open"]).astype(trades["Entry Time"].dtype)
+    bars = bars.loc[bars["next_bar_open"].notna()].sort_values("next_bar_open", kind="mergesort")
+    
+    #merge the trade data with data that was known at the time the trade was open
+    #bar data will have a next bar open attribute which is the open time of the next bar
+    #this is when a trade is exectuted after knowing all data from the close of the bar
+    #so each trade gets the last bar whose next bar opened at or before the entry
+    if type(tolerance) == str and tolerance == "bar":
+        tolerance = _bar_length(asset_data)
+    elif tolerance is not None:
+        tolerance = pd.Timedelta(tolerance)
+    has_entry = trades["Entry Time"].notna()
+    joined = pd.merge_asof(trades.loc[has_entry].sort_values("Entry Time", kind="mergesort"), bars, 
+                           left_on="Entry Time", right_on="next_bar_open", by="asset_key", 
+                           direction="backward", tolerance=tolerance)
+    joined = pd.concat([joined, trades.loc[~has_entry]], ignore_index=True)
+    joined = joined.sort_values(["asset_key", "next_bar_open"], kind="mergesort", na_position="last")
+    joined = joined.drop("asset_key", axis=1)
+    
+    #the as of join gives nan capable columns, a bar column that every trade
+    #has a value for keeps the type it has in the bar data
+    for column, column_type in bars.dtypes.items():
+        if column in joined and joined[column].dtype != column_type and joined[column].notna().all():
+            joined[column] = joined[column].astype(column_type)
+    
+    #mark a trade as win or lose
+    joined["win"] = np.where(joined["Profit"] > 0, 1, 0)
+    
+    #add some time based features
+    joined["dow"] = joined["Entry Time"].dt.dayofweek
+    joined["hour"] = joined["Entry Time"].dt.hour
+    
+    #add some direction based features
+    short = (joined["Type"] == 'Short').to_numpy()
+    for column, bar_column, short_sign, long_sign in DIRECTION_COLUMNS:
+        if bar_column in joined:
+            joined[column] = np.where(short, short_sign, long_sign) * joined[bar_column]
+    
+    joined.index = pd.to_datetime(joined["Entry Time"])
+    
+    return joined
     
-    for asset, data in asset_data:
-        
-        #If trades are in separate asset files load from these files
-        if "{ASSET}" in trade_path:            
-            trade_location = trade_path.replace("{ASSET}", asset)
-            trades = pd.read_csv(trade_location, parse_dates=True)
-        else:
-            trades = all_trades.loc[all_trades["Asset"].str.contains(asset)]
-        
-        #Update the Open and Close time of the trade so the column names
-        #don't conflict with the bar columns
-        trades["Entry Time"] = pd.to_datetime(trades["open"])
-        trades["Exit Time"] = pd.to_datetime(trades["close"])
-        trades = trades.drop(["open", "close"], axis=1)
-        
-        #make sure the bar data is in datetime format
-        data["next_bar_open"] = pd.to_datetime(data["next_bar_open"])
-        
-        #merge the trade data with data that was known at the time the trade was open
-        #bar data will have a next bar open attribute which is the open time of the next bar
-        #this is when a trade is exectuted after knowing all data from the close of the bar
-        joined = pd.merge(trades, data, how="left", left_on="Entry Time", right_on="next_bar_open")
-        joined = joined.sort_values("next_bar_open", axis=0)
-        
-        #mark a trade as win or lose
-        joined["win"] = np.where(joined["Profit"] > 0, 1, 0)
-        
-        #add some time based features
-        joined["dow"] = joined["Entry Time"].dt.dayofweek
-        joined["hour"] = joined["Entry Time"].dt.hour
-        
-        #add some direction based features
-        joined["bb_dist_upper"] = np.where(joined["Type"] == 'Short', -joined["bb_dist_upper"],  joined["bb_dist_upper"])
-        joined["bb_dist_lower"] = np.where(joined["Type"] == 'Short', joined["bb_dist_lower"],  -joined["bb_dist_lower"])
-        joined["log_return_direction"] = np.where(joined["Type"] == 'Short', joined["log_return"],  -joined["log_return"])
-        joined["log_return_direction_12"] = np.where(joined["Type"] == 'Short', joined["log_return_ma_12"],  -joined["log_return_ma_12"])
-        joined["log_return_direction_24"] = np.where(joined["Type"] == 'Short', joined["log_return_ma_24"],  -joined["log_return_ma_24"])
-        joined["log_return_direction_48"] = np.where(joined["Type"] == 'Short', joined["log_return_ma_48"],  -joined["log_return_ma_48"])
-        
-        
-        trade_sets.append(joined)
-        
-    all_joined = pd.concat(trade_sets)
+
+ZORRO_COLUMNS = ['Open', 'high', 'Low', 'Close', 'Volume', 'Val']
+
+#rows formatted and written to the zorro csv at a time
+ZORRO_WRITE_ROWS = 100000
+
+def _rolling_time_sum(times, values, window):
+    """ Sum of the values in the window of time up to and including each row,
+    the same as a time based rolling(window).sum() but from the difference of
+    one cumulative sum
+    
+    Args:
+        times (np.ndarray): ascending datetime64[ns] of each row
+        values (np.ndarray): the values to sum, NaN are skipped
+        window (pd.Timedelta): length of the window
+    
+    Returns:
+        np.ndarray: float64 sums, NaN where the window has no values
+    
+    """
+    
+    import numpy as np
+    
+    values = np.asarray(values, dtype=np.float64)
+    missing = np.isnan(values)
+    totals = np.concatenate(([0.0], np.cumsum(np.where(missing, 0.0, values))))
+    counts = np.concatenate(([0], np.cumsum(~missing)))
+    
+    #first row inside the window of each row ie. later than the row time less the window
+    first = np.searchsorted(times, times - np.timedelta64(window.value, 'ns'), side='right')
+    last = np.arange(1, len(times) + 1)
+    sums = totals[last] - totals[first]
+    sums[counts[last] == counts[first]] = np.nan
+    return sums
+
+def _format_column(values):
+    """ Formats a column the same way as pandas to_csv, blank for NaN """
     
-    all_joined.index = pd.to_datetime(all_joined["Entry Time"])
+    import numpy as np
     
-    return all_joined
+    if values.dtype == np.float64:
+        text = list(map(repr, values.tolist()))
+    elif values.dtype.kind == 'f':
+        #numpy keeps the shortest repr of a float32 where python would widen it
+        text = values.astype(str).tolist()
+    else:
+        text = list(map(str, values.tolist()))
+    if values.dtype.kind == 'f':
+        for i in np.flatnonzero(np.isnan(values)).tolist():
+            text[i] = ""
+    return text
+
+def _write_zorro_rows(f, dates, columns):
+    """ Writes the rows a block at a time from the preformatted columns """
     
+    for start in range(0, len(dates), ZORRO_WRITE_ROWS):
+        stop = start + ZORRO_WRITE_ROWS
+        block = [dates[start:stop].tolist()] + [_format_column(column[start:stop]) for column in columns]
+        f.write("".join(",".join(row) + "\n" for row in zip(*block)))
+
+def _read_zorro_head(save_path):
+    """ The header line and the newest date of an exported file, the date is
+    None if there are no rows """
+    
+    with open(save_path) as f:
+        header = f.readline()
+        first = f.readline()
+    date = first.split(',', 1)[0].strip()
+    return header, date if len(date) > 0 else None
 
 def prep_zorro_import(asset_data, save_path, 
                       market_vol_val_timeframe = None, 
                       market_vol_field = None,
                       market_val_field = None,
-                      bar_time_min = 1):
+                      bar_time_min = 1,
+                      append = False):
     """ Prepares the data for zorro by sorting in the correct direction and
-    setting the timestamp to the close of the bar 
+    setting the timestamp to the close of the bar. The data passed in isn't
+    changed
     
     Args:
         asset_data (pd.DataFrame): time based bar data for a single asset
@@ -522,66 +958,236 @@ def prep_zorro_import(asset_data, save_path,
             start of the bar
         market_vol_field (str): the dataframe column to get the vol data
         market_val_field (str): the dataframe column to get the val data
+        append (bool): True to only add the bars newer than the newest bar
+            already in save_path to the top of the file. The bars before the
+            newest exported bar within market_vol_val_timeframe must be
+            passed for the aggregated vol and val to be complete
+    
+    Returns:
+        int: the number of bars written
     
     """
     
-    from datetime import timedelta
+    import os
+    import shutil
+    import numpy as np
+    import pandas as pd
+    from date_format import format_dates
     
     #change the time to the end of the bar because this is what Zorro expects
     #NOTE: This is not the case for daily bars
-    asset_data.index = asset_data.index + timedelta(minutes=bar_time_min)
-    
-    #aggregate the marklet vol and val fields based on the passed timeframe
-    #This is because zorro doesn't do this in bar building of historic data
-    if market_vol_val_timeframe is not None:        
-        units  = market_vol_val_timeframe[-1:]
-        val = int(market_vol_val_timeframe[:-1])
-    
-        #This has been painstakingly checked to make sure the bars
-        #built by zorro have teh correct aggregated volume and vals and 
-        #timestamps are correct
+    dates = (asset_data.index + pd.Timedelta(minutes=bar_time_min)).values.astype('<M8[ns]')
+    order = None
+    if len(dates) > 1 and (dates[1:] < dates[:-1]).any():
+        order = np.argsort(dates, kind='stable')
+        dates = dates[order]
+    
+    header = ",".join([asset_data.index.name or ""] + ZORRO_COLUMNS) + "\n"
+    
+    start = 0
+    previous = None
+    if append and os.path.isfile(save_path) and os.path.getsize(save_path) > 0:
+        existing_header, newest = _read_zorro_head(save_path)
+        if existing_header.rstrip("\r\n") != header.rstrip("\n"):
+            raise ValueError("{0} has different columns; {1}".format(save_path, existing_header.strip()))
+        if newest is not None:
+            previous = newest
+            start = np.searchsorted(dates, np.datetime64(pd.Timestamp(newest), 'ns'), side='right')
+            if start == len(dates):
+                #nothing newer than the last export
+                return 0
+    
+    #only the bars in the window before the first new bar are needed for the sums
+    first = start
+    if market_vol_val_timeframe is not None and start > 0:
+        window = np.timedelta64(pd.Timedelta(market_vol_val_timeframe).value, 'ns')
+        first = np.searchsorted(dates, dates[start] - window, side='right')
+    
+    def column(name):
+        values = asset_data[name].values
+        values = values[order] if order is not None else values
+        return values[first:]
+    
+    columns = {name: None for name in ZORRO_COLUMNS}
+    
+    #aggregate the market vol and val fields based on the passed timeframe
+    #This is because zorro doesn't do this in bar building of historic data.
+    #The sum is over the bars closing in the time frame up to and including
+    #each bar, the same as the time based rolling sum this used to be
+    if market_vol_val_timeframe is not None:
+        window = pd.Timedelta(market_vol_val_timeframe)
         if market_vol_field is not None:
-            asset_data["Volume"] = asset_data[market_vol_field].shift(val, freq=units).rolling(market_vol_val_timeframe).sum().shift(-val, freq=units)
+            columns["Volume"] = _rolling_time_sum(dates[first:], column(market_vol_field), window)
         if market_val_field is not None:
-            asset_data["Val"] = asset_data[market_val_field].shift(val, freq=units).rolling(market_vol_val_timeframe).sum().shift(-val, freq=units)
+            columns["Val"] = _rolling_time_sum(dates[first:], column(market_val_field), window)
+    
+    for name in ZORRO_COLUMNS:
+        if columns[name] is None:
+            columns[name] = column(name)
+    
+    #newest first because this is how zorro requires it
+    skip = start - first
+    columns = [columns[name][skip:][::-1] for name in ZORRO_COLUMNS]
+    new_dates = dates[start:][::-1]
+    
+    #keep the date format of the rows already exported
+    if previous is not None and len(previous) == 10:
+        formatted = np.datetime_as_string(new_dates, unit='D')
+    elif previous is not None:
+        formatted = np.char.replace(np.datetime_as_string(new_dates, unit='s'), 'T', ' ')
+    else:
+        formatted = format_dates(new_dates)
+    
+    temp = save_path + ".tmp"
+    with open(temp, 'w', newline='', buffering=1024 * 1024) as f:
+        f.write(header)
+        _write_zorro_rows(f, formatted, columns)
+        if previous is not None:
+            with open(save_path, newline='') as existing:
+                existing.readline()
+                shutil.copyfileobj(existing, f, 1024 * 1024)
+    os.replace(temp, save_path)
+    
+    return len(new_dates)
+    
+    
+def _merge_ranges(ranges):
+    """ Sorts the (low cut, high cut) ranges and joins any that overlap so 
+    they can be searched with np.searchsorted """
+    
+    merged = []
+    for low_cut, high_cut in sorted(ranges):
+        if low_cut > high_cut:
+            continue
+        if merged and low_cut <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], high_cut)
+        else:
+            merged.append([low_cut, high_cut])
+    return merged
+
+def _range_mask(values, ranges):
+    """ True for the values inside any of the (low cut, high cut) ranges, 
+    the cuts are inclusive """
+    
+    import numpy as np
     
-    #reverse the order of the data because this is how zorro requires it
-    asset_data = asset_data.sort_index(ascending=False)
+    merged = _merge_ranges(ranges)
+    if len(merged) == 0:
+        return np.zeros(len(values), dtype=bool)
     
-    #save to csv
-    header = ['Open', 'high', 'Low', 'Close', 'Volume', 'Val']
-    asset_data.to_csv(save_path, columns = header)
+    lows = np.array([low_cut for low_cut, high_cut in merged], dtype=np.float64)
+    highs = np.array([high_cut for low_cut, high_cut in merged], dtype=np.float64)
     
+    #the last range starting at or below each value is the only one it can be in
+    position = np.searchsorted(lows, values, side='right') - 1
+    inside = position >= 0
+    inside[inside] = values[inside] <= highs[position[inside]]
+    return inside
+
+def filter_mask(trades, filter_definitions):
+    """ Compiles the filter definitions into one mask of the trades that fit 
+    any of the filters ie OR not AND
     
+    Args:
+        trades (pd.DataFrame): the trades with a column for each filtered feature
+        filter_definitions ((str, (float, float)[])[]): list of (feature, list 
+            of (low cut, high cut)) with inclusive cuts
+            
+    Returns:
+        np.ndarray: boolean mask of the accepted trades
     
-def filter_trades(trades, filter_definitions):
-    """ Will accept a trade that fits any of the filters ie OR not AND
     """
     
-    import pandas as pd
-    
-    filtered = pd.DataFrame()
+    import numpy as np
     
+    mask = np.zeros(len(trades), dtype=bool)
     for feature, filter_def_list in filter_definitions:
-        for low_cut, high_cut in filter_def_list:                       
-            
-            filtered = filtered.append(trades.loc[(trades[feature] >= low_cut) &
-                                                  (trades[feature] <= high_cut)])
-            
-    return filtered
-    
-    
+        values = trades[feature].to_numpy(dtype=np.float64)
+        mask |= _range_mask(values, filter_def_list)
+    return mask
+
+def filter_trades(trades, filter_definitions):
+    """ Will accept a trade that fits any of the filters ie OR not AND. Each 
+    trade is only included once and the trades stay in their original order
     
+    Args:
+        trades (pd.DataFrame): the trades with a column for each filtered feature
+        filter_definitions ((str, (float, float)[])[]): list of (feature, list 
+            of (low cut, high cut)) with inclusive cuts
+            
+    Returns:
+        pd.DataFrame: the accepted trades
     
+    """
     
+    return trades.loc[filter_mask(trades, filter_definitions)]
+
+def grid_filter_sets(feature, cuts):
+    """ Every single range filter of a feature from a grid of cuts
     
+    Args:
+        feature (str): the feature to filter on
+        cuts (float[]): the cut values, every pair of low cut < high cut is a 
+            filter set
+            
+    Returns:
+        list: filter definitions as passed to filter_trades, one per pair of cuts
     
+    """
     
+    cuts = sorted(cuts)
+    return [[(feature, [(low_cut, high_cut)])] 
+            for i, low_cut in enumerate(cuts) for high_cut in cuts[i + 1:]]
+
+def evaluate_filters(trades, filter_sets, value_column="Profit"):
+    """ Counts the trades and sums their value for many filter sets without 
+    creating the filtered trades for each set. Single range filter sets, eg. 
+    from grid_filter_sets, are looked up from the cumulative sums of the 
+    sorted feature values, other sets are evaluated as masks
     
+    Args:
+        trades (pd.DataFrame): the trades with a column for each filtered feature
+        filter_sets (list): a list of filter definitions as passed to filter_trades
+        value_column (str): the column to sum for each filter set
+        
+    Returns:
+        pd.DataFrame: count and the sum of value_column for each filter set in 
+            the same order as filter_sets
     
+    """
     
+    import numpy as np
+    import pandas as pd
     
+    values = trades[value_column].to_numpy(dtype=np.float64)
+    counts = np.zeros(len(filter_sets), dtype=np.int64)
+    sums = np.zeros(len(filter_sets), dtype=np.float64)
     
+    #the single range sets grouped by feature
+    single = {}
+    for i, filter_definitions in enumerate(filter_sets):
+        if len(filter_definitions) == 1 and len(filter_definitions[0][1]) == 1:
+            feature, ((low_cut, high_cut),) = filter_definitions[0]
+            single.setdefault(feature, []).append((i, low_cut, high_cut))
+        else:
+            mask = filter_mask(trades, filter_definitions)
+            counts[i] = mask.sum()
+            sums[i] = values[mask].sum()
+    
+    for feature, sets in single.items():
+        feature_values = trades[feature].to_numpy(dtype=np.float64)
+        #nan never passes a filter so leave them out of the sorted values
+        finite = ~np.isnan(feature_values)
+        order = np.argsort(feature_values[finite], kind='mergesort')
+        sorted_features = feature_values[finite][order]
+        cumulative = np.concatenate([[0.0], np.cumsum(values[finite][order])])
+        
+        index, lows, highs = (np.array(x) for x in zip(*sets))
+        start = np.searchsorted(sorted_features, lows.astype(np.float64), side='left')
+        end = np.searchsorted(sorted_features, highs.astype(np.float64), side='right')
+        end = np.maximum(end, start)
+        counts[index] = end - start
+        sums[index] = cumulative[end] - cumulative[start]
     
+    return pd.DataFrame({"count": counts, value_column: sums})
     
-    
\ No newline at end of file
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+"""
+Formats bar dates for the csv outputs the same way pandas to_csv does so the
+results of build_features.py, incremental_features.py and the Zorro export in
+data_builder.py match what the pandas versions wrote. Only needs NumPy so it
+can be imported without the rest of the feature scripts.
+"""
+
+import numpy as np
+
+
+def format_dates(dates):
+    """ Formats the dates the same way as pandas to_csv does """
+
+    dates = np.asarray(dates, dtype='<M8[ns]')
+    #pandas leaves off the time if every date is at midnight
+    if len(dates) > 0 and (dates == dates.astype('<M8[D]')).all():
+        return np.datetime_as_string(dates, unit='D')
+    return np.char.replace(np.datetime_as_string(dates, unit='s'), 'T', ' ')
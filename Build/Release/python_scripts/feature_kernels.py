@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+"""
+NumPy versions of the calc_feature indicators that work directly on the
+contiguous arrays loaded from the binary bar files. No DataFrames are built
+so these are used on the hot path of build_features.py.
+
+Each kernel returns a float64 array the same length as its inputs with nan
+for the warm up bars, the same as the pandas/pyti calc_feature path.
+
+The loop kernels are compiled with Numba when it is installed, set
+NITRADE_NUMBA=0 to use the NumPy kernels instead.
+"""
+
+import os
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+NUMBA_ENABLED = numba is not None and os.environ.get("NITRADE_NUMBA", "1") != "0"
+
+
+def jit(function):
+    """ Compiles a loop kernel with Numba, None if Numba isn't available so
+    the caller falls back to the NumPy kernel """
+
+    if not NUMBA_ENABLED:
+        return None
+    return numba.njit(cache=True, nogil=True)(function)
+
+
+def _finite_mask_counts(x):
+    #cumulative count of the non finite values so a window containing any of
+    #them can be marked as nan, the same as pandas rolling
+    bad = ~np.isfinite(x)
+    counts = np.empty(len(x) + 1, dtype=np.int64)
+    counts[0] = 0
+    np.cumsum(bad, out=counts[1:])
+    return bad, counts
+
+
+def _window_sums(values, period):
+    #difference of the cumulative sum gives the sum over each window
+    sums = np.empty(len(values) + 1, dtype=np.float64)
+    sums[0] = 0.0
+    np.cumsum(values, out=sums[1:])
+    return sums[period:] - sums[:-period]
+
+
+def rolling_mean(x, period):
+    """ Rolling mean using the difference of cumulative sums
+
+    Args:
+        x (np.ndarray): input values
+        period (int): window length
+
+    Returns:
+        np.ndarray: float64 rolling mean with nan for incomplete windows
+
+    """
+
+    x = np.asarray(x, dtype=np.float64)
+    out = np.full(len(x), np.nan)
+    if period > len(x) or period < 1:
+        return out
+
+    bad, bad_counts = _finite_mask_counts(x)
+    clean = np.where(bad, 0.0, x)
+
+    #offset by a typical value to keep the cumulative sum small
+    offset = clean[0] if len(clean) > 0 else 0.0
+    sums = _window_sums(clean - offset, period)
+
+    out[period-1:] = sums / period + offset
+    out[period-1:][(bad_counts[period:] - bad_counts[:-period]) > 0] = np.nan
+    return out
+
+
+def rolling_sum_compensated(x, period):
+    """ Rolling sum in float32 with Kahan compensation. The windows are split
+    into blocks of period windows. The first window of each block is summed
+    directly and the rest are updated from it by adding the new value and
+    subtracting the old one. A cumulative sum would grow the error with the
+    length of the data, here it is bounded by the block length. Each step is
+    vectorised over all the blocks at once
+
+    Args:
+        x (np.ndarray): input values
+        period (int): window length
+
+    Returns:
+        np.ndarray: float32 sum of each complete window, len(x) - period + 1 values
+
+    """
+
+    x = np.asarray(x, dtype=np.float32)
+    window_count = len(x) - period + 1
+    if window_count <= 0 or period < 1:
+        return np.empty(0, dtype=np.float32)
+
+    block_count = -(-window_count // period)
+    padded = np.zeros(block_count * period + period - 1, dtype=np.float32)
+    padded[:len(x)] = x
+
+    #first window of each block is summed pairwise so its error is small
+    firsts = sliding_window_view(padded, period)[::period][:block_count]
+    total = firsts.sum(axis=1, dtype=np.float32)
+    compensation = np.zeros(block_count, dtype=np.float32)
+
+    sums = np.empty((block_count, period), dtype=np.float32)
+    sums[:, 0] = total
+    starts = np.arange(block_count) * period
+    for step in range(1, period):
+        #window starting at start + step adds the value at its end and drops the one before it
+        change = padded[starts + step + period - 1] - padded[starts + step - 1]
+        y = change - compensation
+        t = total + y
+        compensation = (t - total) - y
+        total = t
+        sums[:, step] = total
+
+    return sums.ravel()[:window_count]
+
+
+def rolling_mean_float32(x, period):
+    """ Same as rolling_mean but calculated and returned in float32 using the
+    compensated rolling sum
+
+    Args:
+        x (np.ndarray): input values
+        period (int): window length
+
+    Returns:
+        np.ndarray: float32 rolling mean with nan for incomplete windows
+
+    """
+
+    x = np.asarray(x, dtype=np.float32)
+    out = np.full(len(x), np.nan, dtype=np.float32)
+    if period > len(x) or period < 1:
+        return out
+
+    bad, bad_counts = _finite_mask_counts(x)
+    clean = np.where(bad, np.float32(0), x)
+
+    out[period-1:] = rolling_sum_compensated(clean, period) / np.float32(period)
+    out[period-1:][(bad_counts[period:] - bad_counts[:-period]) > 0] = np.nan
+    return out
+
+
+def rolling_std(x, period, ddof=1):
+    """ Rolling standard deviation from cumulative sums of the values and
+    their squares. A window of identical values is exactly zero, the same as
+    pandas rolling().std()
+
+    Args:
+        x (np.ndarray): input values
+        period (int): window length
+        ddof (int): delta degrees of freedom, 1 for pandas and 0 for the
+            population std used by the bollinger bands
+
+    Returns:
+        np.ndarray: float64 rolling standard deviation with nan for incomplete windows
+
+    """
+
+    x = np.asarray(x, dtype=np.float64)
+    out = np.full(len(x), np.nan)
+    if period > len(x) or period <= ddof:
+        return out
+
+    bad, bad_counts = _finite_mask_counts(x)
+    clean = np.where(bad, 0.0, x)
+
+    #centre the data so the sums of squares don't lose precision
+    centred = clean - (clean[~bad].mean() if (~bad).any() else 0.0)
+    sums = _window_sums(centred, period)
+    sums_sq = _window_sums(centred * centred, period)
+
+    variance = (sums_sq - sums * sums / period) / (period - ddof)
+    np.maximum(variance, 0.0, out=variance)
+
+    #windows where every value is the same have no variance at all
+    changes = np.zeros(len(x), dtype=np.int64)
+    np.cumsum(clean[1:] != clean[:-1], out=changes[1:])
+    constant = (changes[period-1:] - changes[:len(x)-period+1]) == 0
+    variance[constant] = 0.0
+
+    out[period-1:] = np.sqrt(variance)
+    out[period-1:][(bad_counts[period:] - bad_counts[:-period]) > 0] = np.nan
+    return out
+
+
+def rolling_std_windows(x, period, ddof=1, chunk_size=65536):
+    """ Two pass rolling standard deviation over strided windows. Slower than
+    rolling_std for long windows but has no cancellation error at all, used
+    to check the cumulative sum version
+
+    Args:
+        x (np.ndarray): input values
+        period (int): window length
+        ddof (int): delta degrees of freedom
+        chunk_size (int): number of windows to evaluate at a time
+
+    Returns:
+        np.ndarray: float64 rolling standard deviation with nan for incomplete windows
+
+    """
+
+    x = np.asarray(x, dtype=np.float64)
+    out = np.full(len(x), np.nan)
+    if period > len(x):
+        return out
+
+    #a view of every window without copying the data
+    windows = sliding_window_view(x, period)
+    for start in range(0, len(windows), chunk_size):
+        chunk = windows[start:start + chunk_size]
+        out[period - 1 + start:period - 1 + start + len(chunk)] = chunk.std(axis=1, ddof=ddof)
+    return out
+
+
+def true_range(close, high, low):
+    """ True range ie. the max of the bar range and the gaps from the
+    previous close. The first bar is just the bar range
+
+    Args:
+        close (np.ndarray): close prices
+        high (np.ndarray): high prices
+        low (np.ndarray): low prices
+
+    Returns:
+        np.ndarray: true range in the precision of the input
+
+    """
+
+    high = np.asarray(high)
+    low = np.asarray(low)
+    close = np.asarray(close)
+
+    bar_range = high - low
+    if len(bar_range) < 2:
+        return bar_range
+
+    result = bar_range.copy()
+    previous_close = close[:-1]
+    result[1:] = np.maximum.reduce([bar_range[1:],
+                                    np.abs(high[1:] - previous_close),
+                                    np.abs(low[1:] - previous_close)])
+    return result
+
+
+def replace_zero_with_min(x):
+    """ Replaces zeros with the smallest positive value so a log can be taken """
+
+    x = np.asarray(x, dtype=np.float64)
+    positive = x[x > 0]
+    minimum = positive.min() if len(positive) > 0 else np.nan
+    return np.where(x == 0, minimum, x)
+
+
+def _log(x):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.log(x)
+
+
+def rolling_mean_windows(x, period):
+    """ Rolling mean summed over strided windows in the precision of the
+    input. For float32 data this gives the same rounding as pandas/pyti which
+    sum each window in float32
+
+    Args:
+        x (np.ndarray): input values
+        period (int): window length
+
+    Returns:
+        np.ndarray: rolling mean in the dtype of the input with nan for incomplete windows
+
+    """
+
+    x = np.asarray(x)
+    dtype = x.dtype if x.dtype.kind == 'f' else np.dtype(np.float64)
+    out = np.full(len(x), np.nan, dtype=dtype)
+    if period > len(x) or period < 1:
+        return out
+
+    windows = sliding_window_view(x.astype(dtype, copy=False), period)
+    out[period-1:] = windows.sum(axis=1, dtype=dtype) / dtype.type(period)
+    return out
+
+
+def _rolling_mean_loop(x, period):
+    #running sum that is summed again from the window every period bars so
+    #the rounding error can't build up. Windows with a non finite value are nan
+    n = len(x)
+    out = np.full(n, np.nan)
+    total = 0.0
+    non_finite = 0
+    for i in range(n):
+        if np.isfinite(x[i]):
+            total += x[i]
+        else:
+            non_finite += 1
+        if i >= period:
+            if np.isfinite(x[i - period]):
+                total -= x[i - period]
+            else:
+                non_finite -= 1
+            if i % period == 0:
+                total = 0.0
+                for j in range(i - period + 1, i + 1):
+                    if np.isfinite(x[j]):
+                        total += x[j]
+        if i >= period - 1 and non_finite == 0:
+            out[i] = total / period
+    return out
+
+
+def _true_range_loop(close, high, low):
+    n = len(high)
+    out = np.empty(n)
+    for i in range(n):
+        value = high[i] - low[i]
+        if i > 0:
+            value = max(value, abs(high[i] - close[i - 1]), abs(low[i] - close[i - 1]))
+        out[i] = value
+    return out
+
+
+_rolling_mean_jit = jit(_rolling_mean_loop)
+_true_range_jit = jit(_true_range_loop)
+
+
+def rolling_mean_jit(x, period):
+    """ rolling_mean compiled with Numba, rolling_mean if Numba isn't available """
+
+    if _rolling_mean_jit is None:
+        return rolling_mean(x, period)
+    if period < 1:
+        return np.full(len(x), np.nan)
+    return _rolling_mean_jit(np.ascontiguousarray(x, dtype=np.float64), period)
+
+
+def atr_jit(close, high, low, period):
+    """ atr compiled with Numba, atr if Numba isn't available. The true range
+    is in the precision of the input the same as true_range """
+
+    if _true_range_jit is None:
+        return atr(close, high, low, period)
+    dtype = np.result_type(np.asarray(high).dtype, np.asarray(low).dtype, np.asarray(close).dtype)
+    ranges = _true_range_jit(np.ascontiguousarray(close, dtype=np.float64),
+                             np.ascontiguousarray(high, dtype=np.float64),
+                             np.ascontiguousarray(low, dtype=np.float64))
+    return rolling_mean_jit(ranges.astype(dtype).astype(np.float64), period)
+
+
+def sma(x, period):
+    return rolling_mean(x, period)
+
+
+def bbands(x, period, std_mult, data_type):
+    """ Bollinger bands with a population standard deviation. Rounded the same
+    way as pyti ie. the mean and std are in the precision of the input data
+    and the band is the mean plus the std multiple in float64
+
+    Args:
+        x (np.ndarray): input values
+        period (int): window length
+        std_mult (float): number of standard deviations
+        data_type (int): 1=upper, 2=lower, 3=middle, 4=range
+
+    Returns:
+        np.ndarray: float64 band values
+
+    """
+
+    if data_type not in (1, 2, 3, 4):
+        raise ValueError("BBANDS data_type must be one of (1=upper, 2=lower, 3=middle, 4=range)")
+
+    x = np.asarray(x)
+    mean = rolling_mean_windows(x, period)
+    dtype = mean.dtype
+
+    if data_type == 3:
+        return mean.astype(np.float64)
+
+    std = rolling_std(x, period, ddof=0).astype(dtype)
+    band = (std * dtype.type(std_mult)).astype(np.float64)
+    upper = mean.astype(np.float64) + band
+    lower = mean.astype(np.float64) - band
+
+    if data_type == 1:
+        return upper
+    elif data_type == 2:
+        return lower
+    return upper - lower
+
+
+def atr(close, high, low, period):
+    return rolling_mean(true_range(close, high, low), period)
+
+
+def volatility_log_ma(high, low, period):
+    """ Relative volatility of 12 periods compared to 200 then smoothed with a
+    moving average """
+
+    high_low = np.asarray(high) - np.asarray(low)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        volatility = rolling_std(high_low, 12) / rolling_std(high_low, 200)
+    return rolling_mean(_log(replace_zero_with_min(volatility)), period)
+
+
+def volume_log_ma(volume, period):
+    """ Log volume relative to the log of the 200 bar mean volume then
+    smoothed with a moving average """
+
+    volume = np.asarray(volume, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        volume_log = _log(replace_zero_with_min(volume)) / \
+            _log(replace_zero_with_min(rolling_mean(volume, 200)))
+    return rolling_mean(volume_log, period)
+
+
+def calc_feature(columns, feature, args):
+    """ Same as data_builder.calc_feature but on a dict of arrays, the
+    features are looked up in feature_registry
+
+    Args:
+        columns (dict): column name to np.ndarray of bar data
+        feature (str): name of the feature
+        args (str[]): the feature arguments
+
+    Returns:
+        np.ndarray: float64 feature values
+
+    """
+
+    import feature_registry
+    return feature_registry.calc_feature(columns, feature, args)
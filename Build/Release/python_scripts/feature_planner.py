@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+"""
+Plans the calculation of a feature command string as a graph of shared
+intermediate values. Features that need the same true range, high-low
+range, rolling mean/std or log transform get the one calculation instead of
+each feature repeating it. How each feature is split into the operations
+here is given by its plan in feature_registry.py.
+
+Nodes whose inputs are ready can be evaluated on a pool of threads. The
+kernels are NumPy calls that release the GIL so independent features of a
+large request run at the same time over the shared read-only columns.
+
+The plan for a feature string can be printed with:
+    python feature_planner.py "ATR(3,close,high,low);ATR(4,close,high,low)"
+"""
+
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+
+import feature_kernels as fk
+import feature_registry as fr
+
+
+def _sub(a, b):
+    return a - b
+
+
+def _add(a, b):
+    return a + b
+
+
+def _div(a, b):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.asarray(a, dtype=np.float64) / np.asarray(b, dtype=np.float64)
+
+
+def _log_zero_min(x):
+    return fk._log(fk.replace_zero_with_min(x))
+
+
+def _to_float64(x):
+    return np.asarray(x, dtype=np.float64)
+
+
+def _scaled_std(std, mean, std_mult):
+    #pyti rounds the std to the precision of the data before scaling it
+    dtype = mean.dtype
+    return (std.astype(dtype) * dtype.type(std_mult)).astype(np.float64)
+
+
+#operation name to the function that calculates it
+OPERATIONS = {
+    "sub": _sub,
+    "add": _add,
+    "div": _div,
+    "true_range": fk.true_range,
+    "rolling_mean": fk.rolling_mean_jit,
+    "rolling_std": fk.rolling_std,
+    "window_mean": fk.rolling_mean_windows,
+    "scaled_std": _scaled_std,
+    "log_zero_min": _log_zero_min,
+    #the value type of the plan, float64 or float32 in OPERATIONS_FLOAT32
+    "value_type": _to_float64,
+}
+
+
+def _to_float32(x):
+    return np.asarray(x, dtype=np.float32)
+
+
+def _scaled_std_float32(std, mean, std_mult):
+    return std.astype(np.float32) * np.float32(std_mult)
+
+
+#the operations that are changed to keep the values in float32. The rolling
+#std, its ratios and logs stay in float64 as the sums of squares cancel too
+#much in float32
+OPERATIONS_FLOAT32 = dict(OPERATIONS, **{
+    "rolling_mean": fk.rolling_mean_float32,
+    "scaled_std": _scaled_std_float32,
+    "value_type": _to_float32,
+})
+
+
+def _feature_kernel(*values):
+    #the input columns followed by the feature name and its parsed args
+    inputs, feature, parsed = values[:-2], values[-2], list(values[-1])
+    definition = fr.get(feature)
+    for i, values in zip(definition.columns, inputs):
+        parsed[i] = values
+    return definition.call(parsed)
+
+
+OPERATIONS["kernel"] = _feature_kernel
+OPERATIONS_FLOAT32["kernel"] = _feature_kernel
+
+
+#thread pools for evaluating nodes in parallel keyed on the number of
+#threads. They are kept between the requests of a server and never shut
+#down as a concurrent request may still be submitting to one
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _thread_pool(threads):
+    with _pools_lock:
+        if threads not in _pools:
+            _pools[threads] = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="feature{0}".format(threads))
+        return _pools[threads]
+
+
+class PlanNode:
+
+    def __init__(self, index, operation, inputs, params):
+        self.index = index
+        self.operation = operation
+        self.inputs = inputs
+        self.params = params
+        #number of nodes and outputs that read this node's value
+        self.users = 0
+
+
+class FeaturePlan:
+    """ A graph of the calculations needed for a list of features. Each
+    distinct calculation is a node that is only evaluated once.
+
+    Args:
+        features ((str, str, str[])[]): parsed features as returned by
+            build_features.parse_features
+
+    """
+
+    def __init__(self, features):
+        self.nodes = []
+        self._keys = {}
+        #feature column name to the node that produces it
+        self.outputs = []
+        #number of calculations there would be without sharing
+        self.unshared_count = 0
+
+        #bars before the first value of the slowest feature
+        self.warmup = 0
+
+        for column_name, feature_name, feature_args in features:
+            node = self._add_feature(feature_name, feature_args)
+            self.nodes[node].users += 1
+            self.outputs.append((column_name, node))
+            self.warmup = max(self.warmup, fr.warmup(feature_name, feature_args))
+
+    @property
+    def lookback(self):
+        """ The number of bars needed to calculate the newest value of every
+        feature. Features that replace zeros with the smallest positive value
+        in the history can differ slightly when given only this many bars """
+
+        return self.warmup + 1
+
+    def node(self, operation, inputs=(), params=()):
+        """ Adds a node to the plan or returns the existing node if the same
+        calculation is already planned """
+
+        if operation != "column":
+            self.unshared_count += 1
+
+        key = (operation, tuple(inputs), tuple(params))
+        if key in self._keys:
+            return self._keys[key]
+
+        index = len(self.nodes)
+        self.nodes.append(PlanNode(index, operation, tuple(inputs), tuple(params)))
+        for i in inputs:
+            self.nodes[i].users += 1
+        self._keys[key] = index
+        return index
+
+    def column(self, name):
+        """ The node of an input column """
+        return self.node("column", params=(name,))
+
+    def _add_feature(self, feature, args):
+
+        definition = fr.get(feature)
+        parsed = definition.parse_args(args)
+
+        if definition.plan is not None:
+            return definition.plan(self, *parsed)
+
+        #features without a plan are a single node that calls their kernel
+        inputs = [self.column(parsed[i]) for i in definition.columns]
+        return self.node("kernel", inputs, [feature, tuple(parsed)])
+
+    def evaluate(self, columns, timings=None, float32=False, threads=1, out=None):
+        """ Evaluates every node once and returns the feature values
+
+        Args:
+            columns (dict): column name to np.ndarray of bar data
+            timings (dict): if given the seconds spent on each node are added
+                to it keyed by the node index
+            float32 (bool): True to keep the values in float32 where it is
+                numerically safe
+            threads (int): the number of threads to evaluate the nodes on,
+                1 evaluates them in order on the calling thread
+            out (np.recarray): if given each feature is written into its
+                field of out as soon as it is calculated
+
+        Returns:
+            dict: feature column name to np.ndarray of float64 values or
+                float32 values if float32 is True, or out if given
+
+        """
+
+        operations = OPERATIONS_FLOAT32 if float32 else OPERATIONS
+        if threads is not None and threads > 1:
+            return self._evaluate_threaded(columns, operations, threads, timings, float32, out)
+
+        names = self._output_names() if out is not None else None
+        values = {}
+        remaining = {node.index: node.users for node in self.nodes}
+
+        for node in self.nodes:
+            if node.operation == "column":
+                values[node.index] = columns[node.params[0]]
+            else:
+                function = operations[node.operation]
+                if timings is None:
+                    values[node.index] = function(*[values[i] for i in node.inputs], *node.params)
+                else:
+                    start = time.perf_counter()
+                    values[node.index] = function(*[values[i] for i in node.inputs], *node.params)
+                    timings[node.index] = time.perf_counter() - start
+
+            #free any intermediate values that nothing else needs
+            for i in node.inputs:
+                remaining[i] -= 1
+                if remaining[i] == 0:
+                    del values[i]
+
+            if out is not None:
+                self._write_outputs(out, node.index, values.get(node.index), float32, names)
+
+        if out is not None:
+            return out
+        if float32:
+            return {column_name: _to_float32(values[node]) for column_name, node in self.outputs}
+        return {column_name: values[node] for column_name, node in self.outputs}
+
+    def _output_names(self):
+        #node index to the feature columns it is written to
+        names = {}
+        for column_name, node in self.outputs:
+            names.setdefault(node, []).append(column_name)
+        return names
+
+    def _write_outputs(self, out, index, value, float32, names):
+        for column_name in names.get(index, ()):
+            out[column_name] = _to_float32(value) if float32 else value
+
+    def _evaluate_threaded(self, columns, operations, threads, timings, float32, out):
+        """ Evaluates the nodes on a thread pool, submitting each node as soon
+        as the nodes it reads are done. The bookkeeping is all on the calling
+        thread, the workers only run the operations and write their outputs """
+
+        names = self._output_names()
+        values = {}
+        remaining = {node.index: node.users for node in self.nodes}
+        waiting = {}
+        readers = {node.index: [] for node in self.nodes}
+        ready = []
+
+        for node in self.nodes:
+            if node.operation == "column":
+                values[node.index] = columns[node.params[0]]
+                continue
+            pending = set(i for i in node.inputs if self.nodes[i].operation != "column")
+            for i in pending:
+                readers[i].append(node.index)
+            waiting[node.index] = len(pending)
+            if len(pending) == 0:
+                ready.append(node.index)
+
+        def run(node, inputs):
+            start = time.perf_counter()
+            value = operations[node.operation](*inputs, *node.params)
+            seconds = time.perf_counter() - start
+            #the outputs are written by the worker so the copies run in parallel too
+            if out is not None:
+                self._write_outputs(out, node.index, value, float32, names)
+            return node.index, value, seconds
+
+        def release(node):
+            #free any intermediate values that nothing else needs
+            for i in node.inputs:
+                remaining[i] -= 1
+                if remaining[i] == 0:
+                    del values[i]
+
+        def submit(node):
+            #the inputs are looked up here so the workers never touch values
+            return pool.submit(run, node, [values[i] for i in node.inputs])
+
+        pool = _thread_pool(threads)
+        running = set(submit(self.nodes[i]) for i in ready)
+        try:
+            while running:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, value, seconds = future.result()
+                    values[index] = value
+                    if timings is not None:
+                        timings[index] = seconds
+
+                    for reader in readers[index]:
+                        waiting[reader] -= 1
+                        if waiting[reader] == 0:
+                            running.add(submit(self.nodes[reader]))
+                    release(self.nodes[index])
+        except BaseException:
+            #don't leave workers writing to out after an error
+            for future in running:
+                future.cancel()
+            wait(running)
+            raise
+
+        if out is not None:
+            return out
+        if float32:
+            return {column_name: _to_float32(values[node]) for column_name, node in self.outputs}
+        return {column_name: values[node] for column_name, node in self.outputs}
+
+    def describe(self):
+        """ A readable dump of the plan showing which intermediates are shared
+
+        Returns:
+            str: one line per node plus the output features
+
+        """
+
+        lines = []
+        for node in self.nodes:
+            if node.operation == "column":
+                text = "column {0}".format(node.params[0])
+            else:
+                args = ["#{0}".format(i) for i in node.inputs] + [str(p) for p in node.params]
+                text = "{0}({1})".format(node.operation, ", ".join(args))
+            shared = "  shared x{0}".format(node.users) if node.users > 1 else ""
+            lines.append("#{0:<3} {1}{2}".format(node.index, text, shared))
+
+        for column_name, node in self.outputs:
+            lines.append("{0} = #{1}".format(column_name, node))
+
+        calculated = len([n for n in self.nodes if n.operation != "column"])
+        lines.append("{0} calculations planned, {1} without sharing".format(calculated, self.unshared_count))
+        lines.append("lookback {0} bars".format(self.lookback))
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+
+    from build_features import parse_features
+
+    line = sys.argv[1] if len(sys.argv) > 1 else input()
+    print(FeaturePlan(parse_features(line)).describe())
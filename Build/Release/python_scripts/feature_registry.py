@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Registry of the features that can be requested in a feature string eg.
+SMA(20,close). Each feature declares its arguments, which of them are input
+columns, how many bars of warm up it needs before the first value and a pure
+kernel that calculates it from arrays. The kernels never change their
+inputs.
+
+A new indicator is added by registering it here:
+
+    register("MOMENTUM", [Arg("period", int), Arg("column", COLUMN)],
+             kernel=momentum, warmup=lambda period, column: period)
+
+Where Numba is installed a compiled kernel is used in place of the NumPy
+kernel if the feature has one.
+
+A feature can also give a plan, a function that splits it into the shared
+operations of feature_planner.py eg. the true range and rolling mean of ATR,
+so features that need the same intermediate values only calculate them once.
+build_features.py runs a feature through its plan if it has one, otherwise
+through its kernel, so registering a feature again replaces both.
+"""
+
+import numpy as np
+
+import feature_kernels as fk
+
+#the kind of an argument that names an input column
+COLUMN = "column"
+
+FEATURES = {}
+
+
+class Arg:
+    """ An argument of a feature
+
+    Args:
+        name (str): the name used in the error messages
+        kind (type or str): int, float or COLUMN, or a function that
+            converts the argument string and raises ValueError if it is invalid
+
+    """
+
+    def __init__(self, name, kind):
+        self.name = name
+        self.kind = kind
+
+    def parse(self, value):
+        if self.kind == COLUMN:
+            return value
+        return self.kind(value)
+
+
+class Feature:
+    """ A registered feature
+
+    Args:
+        name (str): the name used in the feature string
+        args (Arg[]): the arguments in the order they are given
+        kernel (function): calculates the feature from the parsed arguments
+            with each column argument replaced by its np.ndarray
+        warmup (function): number of bars before the first value from the
+            parsed arguments
+        usage (str): description of the arguments for the error messages
+        jit_kernel (function): the same as kernel compiled with Numba or None
+        plan (function): adds the nodes that calculate the feature to a
+            feature_planner.FeaturePlan from the plan and the parsed
+            arguments and returns the node of the feature values, or None
+            to plan the feature as a single call of its kernel
+
+    """
+
+    def __init__(self, name, args, kernel, warmup, usage, jit_kernel=None, plan=None):
+        self.name = name
+        self.args = args
+        self.kernel = kernel
+        self.warmup = warmup
+        self.usage = usage
+        self.jit_kernel = jit_kernel
+        self.plan = plan
+
+    @property
+    def columns(self):
+        """ Indexes of the arguments that name input columns """
+        return [i for i, arg in enumerate(self.args) if arg.kind == COLUMN]
+
+    def parse_args(self, args):
+        """ Checks the number of arguments and converts them to their types
+
+        Returns:
+            list: the parsed arguments
+
+        """
+
+        if len(args) != len(self.args):
+            raise ValueError("{0} requires {1} args; {2}".format(self.name, len(self.args), self.usage))
+        return [arg.parse(value) for arg, value in zip(self.args, args)]
+
+    def call(self, parsed):
+        """ Runs the compiled kernel if there is one, otherwise the NumPy
+        kernel, on the parsed arguments with the columns given as arrays """
+
+        kernel = self.jit_kernel if self.jit_kernel is not None else self.kernel
+        return kernel(*parsed)
+
+    def calculate(self, columns, args):
+        """ Calculates the feature from a dict of column name to values """
+
+        parsed = self.parse_args(args)
+        for i in self.columns:
+            parsed[i] = columns[parsed[i]]
+        return self.call(parsed)
+
+
+def register(name, args, kernel, warmup, usage=None, jit_kernel=None, plan=None):
+    """ Adds a feature to the registry, replacing any with the same name """
+
+    if usage is None:
+        usage = ", ".join(arg.name for arg in args)
+    FEATURES[name] = Feature(name, args, kernel, warmup, usage, jit_kernel, plan)
+    return FEATURES[name]
+
+
+def get(name):
+    """ The registered feature with this name """
+
+    if name not in FEATURES:
+        raise ValueError("Unknown feature " + name)
+    return FEATURES[name]
+
+
+def calc_feature(columns, feature, args):
+    """ Calculates a feature
+
+    Args:
+        columns (dict): column name to np.ndarray of bar data
+        feature (str): name of the feature
+        args (str[]): the feature arguments
+
+    Returns:
+        np.ndarray: float64 feature values
+
+    """
+
+    return get(feature).calculate(columns, args)
+
+
+def warmup(feature, args):
+    """ Number of bars before the first value of a feature """
+
+    definition = get(feature)
+    return definition.warmup(*definition.parse_args(args))
+
+
+def _band_type(value):
+    value = int(value)
+    if value not in (1, 2, 3, 4):
+        raise ValueError("BBANDS data_type must be one of (1=upper, 2=lower, 3=middle, 4=range)")
+    return value
+
+
+def _plan_sma(plan, period, column):
+    return plan.node("rolling_mean", [plan.column(column)], [period])
+
+
+def _plan_bbands(plan, period, std_mult, data_type, column):
+
+    column = plan.column(column)
+    mean = plan.node("window_mean", [column], [period])
+    if data_type == 3:
+        return plan.node("value_type", [mean])
+
+    std = plan.node("rolling_std", [column], [period, 0])
+    band = plan.node("scaled_std", [std, mean], [std_mult])
+    mean_value = plan.node("value_type", [mean])
+    upper = plan.node("add", [mean_value, band])
+    lower = plan.node("sub", [mean_value, band])
+    if data_type == 1:
+        return upper
+    elif data_type == 2:
+        return lower
+    return plan.node("sub", [upper, lower])
+
+
+def _plan_atr(plan, period, close, high, low):
+    true_range = plan.node("true_range", [plan.column(close), plan.column(high), plan.column(low)])
+    return plan.node("rolling_mean", [true_range], [period])
+
+
+def _plan_volatility_log_ma(plan, period, high, low):
+    high_low = plan.node("sub", [plan.column(high), plan.column(low)])
+    volatility = plan.node("div", [plan.node("rolling_std", [high_low], [12, 1]),
+                                   plan.node("rolling_std", [high_low], [200, 1])])
+    volatility_log = plan.node("log_zero_min", [volatility])
+    return plan.node("rolling_mean", [volatility_log], [period])
+
+
+def _plan_volume_log_ma(plan, period, column):
+    volume = plan.column(column)
+    volume_log = plan.node("div", [plan.node("log_zero_min", [volume]),
+                                   plan.node("log_zero_min", [plan.node("rolling_mean", [volume], [200])])])
+    return plan.node("rolling_mean", [volume_log], [period])
+
+
+register("SMA", [Arg("period", int), Arg("column", COLUMN)],
+         kernel=lambda period, x: fk.sma(x, period),
+         jit_kernel=(lambda period, x: fk.rolling_mean_jit(x, period)) if fk.NUMBA_ENABLED else None,
+         warmup=lambda period, column: period - 1,
+         usage="period and column name",
+         plan=_plan_sma)
+
+register("BBANDS", [Arg("period", int), Arg("std_mult", float), Arg("data_type", _band_type), Arg("column", COLUMN)],
+         kernel=lambda period, std_mult, data_type, x: fk.bbands(x, period, std_mult, data_type),
+         warmup=lambda period, std_mult, data_type, column: period - 1,
+         usage="period, std dev, data_type (1=upper, 2=lower, 3=middle, 4=range) and column name",
+         plan=_plan_bbands)
+
+register("ATR", [Arg("period", int), Arg("close", COLUMN), Arg("high", COLUMN), Arg("low", COLUMN)],
+         kernel=lambda period, close, high, low: fk.atr(close, high, low, period),
+         jit_kernel=(lambda period, close, high, low: fk.atr_jit(close, high, low, period)) if fk.NUMBA_ENABLED else None,
+         warmup=lambda period, close, high, low: period - 1,
+         usage="period and close column, high column, low column",
+         plan=_plan_atr)
+
+#the 200 bar std of the high-low range comes before the moving average
+register("VOLATILITY_LOG_MA", [Arg("period", int), Arg("high", COLUMN), Arg("low", COLUMN)],
+         kernel=lambda period, high, low: fk.volatility_log_ma(high, low, period),
+         warmup=lambda period, high, low: 199 + period - 1,
+         usage="period, high column name, low column name",
+         plan=_plan_volatility_log_ma)
+
+#the 200 bar mean volume comes before the moving average
+register("VOLUME_LOG_MA", [Arg("period", int), Arg("column", COLUMN)],
+         kernel=lambda period, volume: fk.volume_log_ma(volume, period),
+         warmup=lambda period, column: 199 + period - 1,
+         usage="period, column name",
+         plan=_plan_volume_log_ma)
@@ -0,0 +1,588 @@
+# -*- coding: utf-8 -*-
+"""
+Local feature service that answers build_features.py requests from many
+clients at once. Each connection can have several requests in flight and the
+feature calculations run on a thread pool while the event loop keeps reading
+requests, so a slow symbol doesn't hold up the others.
+
+The service listens on a Unix socket or, where there are no Unix sockets eg.
+the .NET Framework side on Windows, on a TCP port of the loopback address:
+    unix:/tmp/nitrade_features.sock
+    tcp:127.0.0.1:47800
+The default is NITRADE_FEATURE_SERVICE or a Unix socket in the temp directory.
+
+Protocol: the frames are the build_features.py server frames with a header
+line in front so the responses can come back in the order they finish.
+
+    <id> features [timeout]     followed by the 4 build_features request lines
+    <id> health
+    <id> metrics
+
+The response to each request is the header <id> <status> then the response
+lines then a line containing only END. The status is one of
+    OK        the build_features response eg. Success or the csv
+    ERROR     a single line with the exception
+    TIMEOUT   the request didn't finish within its timeout
+    REJECTED  more than max_queue requests were waiting or running
+health and metrics return a single line json object.
+
+Back-pressure: a request is rejected straight away rather than queued without
+limit. A request that times out keeps its worker until the calculation ends
+as a thread can't be stopped, so it still counts towards max_queue.
+
+Requests for the same input file run one at a time in the order they arrived
+so the incremental state of build_features.py is kept.
+
+Usage:
+    python feature_service.py serve [--address a] [--workers n] [--max-queue n] [--timeout s]
+    python feature_service.py health [--address a]
+    python feature_service.py metrics [--address a]
+    python feature_service.py selftest
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import build_features as bf
+
+ADDRESS_VARIABLE = "NITRADE_FEATURE_SERVICE"
+DEFAULT_PORT = 47800
+
+FEATURES_COMMAND = "features"
+HEALTH_COMMAND = "health"
+METRICS_COMMAND = "metrics"
+
+STATUS_OK = "OK"
+STATUS_ERROR = "ERROR"
+STATUS_TIMEOUT = "TIMEOUT"
+STATUS_REJECTED = "REJECTED"
+STATUSES = [STATUS_OK, STATUS_ERROR, STATUS_TIMEOUT, STATUS_REJECTED]
+
+#seconds a features request may take when it doesn't give a timeout
+DEFAULT_TIMEOUT = 30.0
+
+#requests waiting or running before new ones are rejected
+DEFAULT_MAX_QUEUE = 64
+
+#number of the latest request latencies the percentiles are taken from
+LATENCY_WINDOW = 1000
+
+
+def default_address():
+    address = os.environ.get(ADDRESS_VARIABLE, "").strip()
+    if len(address) > 0:
+        return address
+    if hasattr(socket, "AF_UNIX"):
+        return "unix:" + os.path.join(tempfile.gettempdir(), "nitrade_features.sock")
+    return "tcp:127.0.0.1:{0}".format(DEFAULT_PORT)
+
+
+def parse_address(address):
+    """ Splits an address into its kind and location
+
+    Returns:
+        (str, str or (str, int)): unix and the socket path or tcp and the
+            host and port
+
+    """
+
+    kind, _, location = address.partition(":")
+    if kind == "unix":
+        if not hasattr(socket, "AF_UNIX"):
+            raise ValueError("Unix sockets are not available, use tcp:host:port")
+        return kind, location
+    if kind == "tcp":
+        host, _, port = location.rpartition(":")
+        return kind, (host or "127.0.0.1", int(port))
+    raise ValueError("Address must be unix:path or tcp:host:port; " + address)
+
+
+class FeatureService:
+    """ Answers feature requests concurrently on a thread pool
+
+    Args:
+        workers (int): threads the features are calculated on, the number of
+            cpus if None. NumPy releases the GIL in the kernels so the threads
+            run in parallel for all but the smallest requests
+        max_queue (int): requests waiting or running before new requests are
+            rejected
+        timeout (float): seconds a features request may take if it doesn't
+            give a timeout
+        handler (function): runs the 4 request lines and returns the
+            response, build_features.run_request by default
+
+    """
+
+    def __init__(self, workers=None, max_queue=DEFAULT_MAX_QUEUE, timeout=DEFAULT_TIMEOUT, handler=None):
+        if max_queue < 1:
+            raise ValueError("max_queue must be at least 1")
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.handler = bf.run_request if handler is None else handler
+        self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix="features")
+        self.pending = 0
+        self.connections = 0
+        self.counts = {status: 0 for status in STATUSES}
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.started = time.time()
+        #a lock per input file so its requests run in the order they arrived,
+        #with the number of requests holding or waiting for it. A lock is
+        #removed when that drops to 0 so only the files in use have one
+        self._locks = {}
+
+    async def features(self, lines, timeout=None):
+        """ Runs a request on the thread pool
+
+        Args:
+            lines (str[]): the 4 build_features request lines
+            timeout (float): seconds to wait for the response
+
+        Returns:
+            (str, str): the status and the response
+
+        """
+
+        if self.pending >= self.max_queue:
+            return STATUS_REJECTED, "{0} requests pending".format(self.pending)
+
+        loop = asyncio.get_running_loop()
+        timeout = self.timeout if timeout is None else timeout
+        deadline = loop.time() + timeout
+        self.pending += 1
+
+        lock = self._use_lock(lines[1])
+        try:
+            await asyncio.wait_for(lock.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self._drop_lock(lines[1])
+            self.pending -= 1
+            return STATUS_TIMEOUT, "timed out waiting for {0}".format(lines[1])
+
+        future = loop.run_in_executor(self.executor, self.handler, *lines)
+
+        def finished(_):
+            #the lock is held until the calculation ends even if the request timed out
+            lock.release()
+            self._drop_lock(lines[1])
+            self.pending -= 1
+        future.add_done_callback(finished)
+
+        try:
+            response = await asyncio.wait_for(asyncio.shield(future), max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            return STATUS_TIMEOUT, "timed out after {0}s".format(timeout)
+        except Exception as e:
+            return STATUS_ERROR, repr(e).replace("\n", " ")
+        return STATUS_OK, response.rstrip("\n")
+
+    def _use_lock(self, filename):
+        if filename not in self._locks:
+            self._locks[filename] = [asyncio.Lock(), 0]
+        self._locks[filename][1] += 1
+        return self._locks[filename][0]
+
+    def _drop_lock(self, filename):
+        self._locks[filename][1] -= 1
+        if self._locks[filename][1] == 0:
+            del self._locks[filename]
+
+    def health(self):
+        return {"status": "overloaded" if self.pending >= self.max_queue else "ok",
+                "pid": os.getpid(),
+                "uptime_s": round(time.time() - self.started, 3),
+                "workers": self.workers,
+                "pending": self.pending,
+                "max_queue": self.max_queue,
+                "connections": self.connections}
+
+    def metrics(self):
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            if len(latencies) == 0:
+                return None
+            return round(latencies[min(int(p * len(latencies)), len(latencies) - 1)], 3)
+
+        values = {"requests": sum(self.counts.values()),
+                  "pending": self.pending,
+                  "latency_ms": {"p50": percentile(0.5), "p95": percentile(0.95), "max": percentile(1.0)}}
+        values.update({status.lower(): count for status, count in self.counts.items()})
+        return values
+
+    async def respond(self, request_id, command, args, lines, writer):
+        """ Answers one request and writes its response frame """
+
+        start = time.perf_counter()
+        if command == FEATURES_COMMAND:
+            try:
+                timeout = float(args[0]) if len(args) > 0 else None
+                status, response = await self.features(lines, timeout)
+            except ValueError as e:
+                status, response = STATUS_ERROR, repr(e)
+            self.counts[status] += 1
+            if status != STATUS_REJECTED:
+                self.latencies.append((time.perf_counter() - start) * 1000)
+        elif command == HEALTH_COMMAND:
+            status, response = STATUS_OK, json.dumps(self.health())
+        elif command == METRICS_COMMAND:
+            status, response = STATUS_OK, json.dumps(self.metrics())
+        else:
+            status, response = STATUS_ERROR, "Unknown command " + command
+
+        #the whole frame in one write so frames from different requests never interleave
+        writer.write("{0} {1}\n{2}\n{3}\n".format(request_id, status, response, bf.END_OF_FRAME).encode("utf-8"))
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def handle(self, reader, writer):
+        """ Reads the requests of a connection until it is closed """
+
+        self.connections += 1
+        tasks = set()
+        try:
+            while True:
+                header = await reader.readline()
+                if len(header) == 0:
+                    break
+                header = header.decode("utf-8").split()
+                #ignore any blank lines between frames
+                if len(header) == 0:
+                    continue
+                if len(header) < 2:
+                    writer.write("{0} {1}\nheader must be <id> <command>\n{2}\n".format(
+                        header[0], STATUS_ERROR, bf.END_OF_FRAME).encode("utf-8"))
+                    continue
+
+                request_id, command, args = header[0], header[1], header[2:]
+                lines = []
+                if command == FEATURES_COMMAND:
+                    for _ in range(4):
+                        lines.append((await reader.readline()).decode("utf-8").strip())
+
+                task = asyncio.ensure_future(self.respond(request_id, command, args, lines, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            if len(tasks) > 0:
+                await asyncio.wait(tasks)
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def start(self, address):
+        """ Starts listening on an address
+
+        Returns:
+            asyncio.AbstractServer: the server
+
+        """
+
+        kind, location = parse_address(address)
+        if kind == "unix":
+            #a socket file left by a service that didn't shut down
+            if os.path.exists(location):
+                os.remove(location)
+            return await asyncio.start_unix_server(self.handle, path=location)
+        return await asyncio.start_server(self.handle, host=location[0], port=location[1])
+
+    async def serve(self, address):
+        server = await self.start(address)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class ServiceThread:
+    """ Runs a FeatureService on an event loop in a background thread, used
+    by the self test and to host the service in another python process
+
+    Args:
+        address (str): the address to listen on
+        **kwargs: passed to FeatureService
+
+    """
+
+    def __init__(self, address, **kwargs):
+        self.address = address
+        self.service = FeatureService(**kwargs)
+        self._loop = None
+        self._server = None
+        self._ready = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._server = self._loop.run_until_complete(self.service.start(self.address))
+        except Exception as e:
+            self._error = e
+            self._ready.set()
+            return
+        self._ready.set()
+        self._loop.run_forever()
+        self._server.close()
+        self._loop.run_until_complete(self._server.wait_closed())
+        self._loop.close()
+
+    def start(self):
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+        return self
+
+    def stop(self):
+        if self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self.service.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class FeatureServiceError(Exception):
+    """ A request that didn't return OK """
+
+    def __init__(self, status, message):
+        super().__init__("{0} {1}".format(status, message))
+        self.status = status
+        self.message = message
+
+
+class FeatureClient:
+    """ Blocking client of the feature service. A request can be sent
+    without waiting for its response so several are in flight at once
+
+    Args:
+        address (str): address of the service, the default address if None
+        timeout (float): socket timeout in seconds, None to wait forever
+
+    """
+
+    def __init__(self, address=None, timeout=None):
+        kind, location = parse_address(default_address() if address is None else address)
+        family = socket.AF_UNIX if kind == "unix" else socket.AF_INET
+        self._socket = socket.socket(family, socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        self._socket.connect(location)
+        self._file = self._socket.makefile("rw", encoding="utf-8", newline="\n")
+        self._next_id = 0
+        #responses read while waiting for a different request
+        self._received = {}
+
+    def send(self, command, lines=(), timeout=None):
+        """ Sends a request without waiting for the response
+
+        Returns:
+            str: the id of the request to pass to receive
+
+        """
+
+        self._next_id += 1
+        request_id = str(self._next_id)
+        header = [request_id, command] + ([str(timeout)] if timeout is not None else [])
+        self._file.write(" ".join(header) + "\n" + "".join(line + "\n" for line in lines))
+        self._file.flush()
+        return request_id
+
+    def _read_frame(self):
+        header = self._file.readline()
+        if len(header) == 0:
+            raise ConnectionError("feature service closed the connection")
+        request_id, status = header.split()
+        lines = []
+        for line in self._file:
+            line = line.rstrip("\n")
+            if line == bf.END_OF_FRAME:
+                break
+            lines.append(line)
+        return request_id, status, lines
+
+    def receive(self, request_id):
+        """ Waits for the response to a request
+
+        Returns:
+            (str, str[]): the status and response lines
+
+        """
+
+        while request_id not in self._received:
+            frame_id, status, lines = self._read_frame()
+            self._received[frame_id] = (status, lines)
+        return self._received.pop(request_id)
+
+    def request(self, command, lines=(), timeout=None):
+        return self.receive(self.send(command, lines, timeout))
+
+    def features(self, type_line, filename, output, line, timeout=None):
+        """ Runs a build_features request
+
+        Returns:
+            str: the response eg. Success or the csv
+
+        Raises:
+            FeatureServiceError: if the status isn't OK
+
+        """
+
+        status, lines = self.request(FEATURES_COMMAND, [type_line, filename, output, line], timeout)
+        if status != STATUS_OK:
+            raise FeatureServiceError(status, "\n".join(lines))
+        return "\n".join(lines)
+
+    def health(self):
+        return json.loads(self.request(HEALTH_COMMAND)[1][0])
+
+    def metrics(self):
+        return json.loads(self.request(METRICS_COMMAND)[1][0])
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def selftest():
+    """ Runs the service in this process against synthetic data and checks
+    the concurrent results, rejection and timeouts
+
+    Returns:
+        int: the number of failed checks
+
+    """
+
+    from benchmark_kernels import synthetic_records
+
+    failures = 0
+
+    def check(name, passed, detail=""):
+        nonlocal failures
+        failures += not passed
+        print("{0:<4} {1} {2}".format("ok" if passed else "FAIL", name, detail))
+
+    line = "SMA(20,close);ATR(14,close,high,low);BBANDS(20,2,1,close)"
+    with tempfile.TemporaryDirectory() as folder:
+        inputs = []
+        for i in range(8):
+            path = os.path.join(folder, "asset{0}.bin".format(i))
+            synthetic_records(20000, seed=i).tofile(path)
+            inputs.append(path)
+        expected = [bf.run_request("whole nocache", path, "50", line) for path in inputs]
+
+        if hasattr(socket, "AF_UNIX"):
+            address = "unix:" + os.path.join(folder, "service.sock")
+        else:
+            address = "tcp:127.0.0.1:{0}".format(DEFAULT_PORT)
+
+        with ServiceThread(address, workers=4) as service:
+            with FeatureClient(address) as client:
+                check("health", client.health()["status"] == "ok")
+
+                ids = [client.send(FEATURES_COMMAND, ["whole nocache", path, "50", line]) for path in inputs]
+                responses = [client.receive(request_id) for request_id in ids]
+                check("concurrent results", all(status == STATUS_OK and "\n".join(lines) == result.rstrip("\n")
+                                                for (status, lines), result in zip(responses, expected)))
+
+                status, lines = client.request(FEATURES_COMMAND, ["whole nocache", inputs[0], "50", "NOPE(1,close)"])
+                check("error", status == STATUS_ERROR and "Unknown feature" in lines[0], lines[0])
+
+                #many clients at once, each on its own connection
+                results = [None] * len(inputs)
+
+                def run_client(i):
+                    with FeatureClient(address) as other:
+                        results[i] = other.features("whole nocache", inputs[i], "50", line)
+                threads = [threading.Thread(target=run_client, args=(i,)) for i in range(len(inputs))]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                check("concurrent clients", results == [result.rstrip("\n") for result in expected])
+
+                metrics = client.metrics()
+                check("metrics", metrics["ok"] == 2 * len(inputs) and metrics["error"] == 1, json.dumps(metrics))
+            served = service.service
+        check("file locks released", len(served._locks) == 0, str(len(served._locks)))
+
+        #a slow handler to fill the queue and time out
+        release = threading.Event()
+
+        def slow(type_line, filename, output, line):
+            release.wait(5)
+            return "Success"
+
+        with ServiceThread(address, workers=2, max_queue=2, handler=slow) as service:
+            with FeatureClient(address) as client:
+                status, lines = client.request(FEATURES_COMMAND, ["whole", inputs[0], "50", line], timeout=0.2)
+                check("timeout", status == STATUS_TIMEOUT, lines[0])
+
+                #the timed out request still holds a worker
+                first = client.send(FEATURES_COMMAND, ["whole", inputs[1], "50", line])
+                status, lines = client.request(FEATURES_COMMAND, ["whole", inputs[2], "50", line])
+                check("rejected when full", status == STATUS_REJECTED, lines[0])
+                check("health overloaded", client.health()["status"] == "overloaded")
+
+                release.set()
+                check("accepted after rejecting", client.receive(first)[0] == STATUS_OK)
+
+        print("{0} requests, {1} failed checks".format(served.metrics()["requests"], failures))
+    return failures
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Asyncio service answering build_features requests concurrently")
+    parser.add_argument("command", choices=["serve", HEALTH_COMMAND, METRICS_COMMAND, "selftest"])
+    parser.add_argument("--address", default=None, help="unix:path or tcp:host:port")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--max-queue", type=int, default=DEFAULT_MAX_QUEUE)
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT)
+    args = parser.parse_args()
+
+    address = default_address() if args.address is None else args.address
+
+    if args.command == "serve":
+        service = FeatureService(args.workers, args.max_queue, args.timeout)
+        print("feature service listening on " + address, file=sys.stderr)
+        try:
+            asyncio.run(service.serve(address))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            service.close()
+    elif args.command == "selftest":
+        sys.exit(1 if selftest() > 0 else 0)
+    else:
+        with FeatureClient(address) as client:
+            values = client.health() if args.command == HEALTH_COMMAND else client.metrics()
+        print(json.dumps(values, indent=2))
+
+
+if __name__ == "__main__":
+    main()
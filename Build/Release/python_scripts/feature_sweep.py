@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Calculates a feature for many window lengths at once for feature research eg.
+the volatility for every window from 5 to 500 bars.
+
+The cumulative sums of the input and of its squares are taken once and the
+rolling mean and standard deviation of every window are differences of two
+slices of them, so each extra window costs a subtraction over the bars
+rather than another rolling pass. The result is a single float32 block of
+bars x windows instead of a DataFrame column per window.
+
+Features:
+    mean            rolling mean of a column, close by default
+    std             rolling standard deviation of a column
+    volatility      rolling std of the high-low range ie. add_features volatility_12
+    volume_change   volume over its rolling mean ie. add_features volume_change
+    upper_bb        bollinger bands with a population std and std_mult
+    lower_bb
+    bb_range        the band width over the close ie. add_features bb_range
+    log_return_ma   rolling mean of the log return
+
+Usage:
+    python feature_sweep.py [bars] [first,last,step] [feature]
+prints the time of a sweep against a rolling pass per window.
+"""
+
+import numpy as np
+
+import feature_kernels as fk
+
+
+class PrefixSums:
+    """ Cumulative sums of the values and their squares that the rolling
+    mean and std of any window are taken from. The same as
+    feature_kernels.rolling_mean and rolling_std ie. a window containing a
+    non finite value is nan and a window of identical values has no variance
+
+    Args:
+        x (np.ndarray): input values
+
+    """
+
+    def __init__(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        self.length = len(x)
+
+        bad, self.bad_counts = fk._finite_mask_counts(x)
+        clean = np.where(bad, 0.0, x)
+
+        #centre the data so the sums of squares don't lose precision
+        self.offset = clean[~bad].mean() if (~bad).any() else 0.0
+        centred = clean - self.offset
+
+        self.sums = np.empty(self.length + 1)
+        self.sums[0] = 0.0
+        np.cumsum(centred, out=self.sums[1:])
+        self.sums_sq = np.empty(self.length + 1)
+        self.sums_sq[0] = 0.0
+        np.cumsum(centred * centred, out=self.sums_sq[1:])
+
+        self.changes = np.zeros(self.length, dtype=np.int64)
+        np.cumsum(clean[1:] != clean[:-1], out=self.changes[1:])
+
+    def _invalid(self, window):
+        return (self.bad_counts[window:] - self.bad_counts[:-window]) > 0
+
+    def mean(self, window):
+        """ Rolling mean of the complete windows, len(x) - window + 1 values """
+
+        values = (self.sums[window:] - self.sums[:-window]) / window + self.offset
+        values[self._invalid(window)] = np.nan
+        return values
+
+    def std(self, window, ddof=1):
+        """ Rolling std of the complete windows, len(x) - window + 1 values """
+
+        sums = self.sums[window:] - self.sums[:-window]
+        variance = (self.sums_sq[window:] - self.sums_sq[:-window] - sums * sums / window) / (window - ddof)
+        np.maximum(variance, 0.0, out=variance)
+
+        #windows where every value is the same have no variance at all
+        variance[(self.changes[window-1:] - self.changes[:self.length-window+1]) == 0] = 0.0
+
+        values = np.sqrt(variance, out=variance)
+        values[self._invalid(window)] = np.nan
+        return values
+
+
+def _column(columns, name):
+    return np.asarray(columns[name], dtype=np.float64)
+
+
+def _log_return(close):
+    out = np.full(len(close), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out[1:] = np.log(close[1:] / close[:-1])
+    return out
+
+
+def _sweep_mean(columns, windows, out, column="close"):
+    prefix = PrefixSums(_column(columns, column))
+    for j, window in enumerate(windows):
+        out[window-1:, j] = prefix.mean(window)
+
+
+def _sweep_std(columns, windows, out, column="close", ddof=1):
+    prefix = PrefixSums(_column(columns, column))
+    for j, window in enumerate(windows):
+        if window > ddof:
+            out[window-1:, j] = prefix.std(window, ddof)
+
+
+def _sweep_volatility(columns, windows, out):
+    _sweep_std({"range": _column(columns, "high") - _column(columns, "low")}, windows, out, "range")
+
+
+def _sweep_volume_change(columns, windows, out):
+    volume = _column(columns, "volume")
+    prefix = PrefixSums(volume)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for j, window in enumerate(windows):
+            out[window-1:, j] = volume[window-1:] / prefix.mean(window)
+
+
+def _sweep_bands(columns, windows, out, band, std_mult=2.0, column="close"):
+    x = _column(columns, column)
+    prefix = PrefixSums(x)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for j, window in enumerate(windows):
+            mean = prefix.mean(window)
+            width = std_mult * prefix.std(window, ddof=0)
+            if band == "upper":
+                out[window-1:, j] = mean + width
+            elif band == "lower":
+                out[window-1:, j] = mean - width
+            else:
+                out[window-1:, j] = 2 * width / x[window-1:]
+
+
+def _sweep_log_return_ma(columns, windows, out):
+    _sweep_mean({"log_return": _log_return(_column(columns, "close"))}, windows, out, "log_return")
+
+
+SWEEPS = {
+    "mean": _sweep_mean,
+    "std": _sweep_std,
+    "volatility": _sweep_volatility,
+    "volume_change": _sweep_volume_change,
+    "upper_bb": lambda columns, windows, out, **options: _sweep_bands(columns, windows, out, "upper", **options),
+    "lower_bb": lambda columns, windows, out, **options: _sweep_bands(columns, windows, out, "lower", **options),
+    "bb_range": lambda columns, windows, out, **options: _sweep_bands(columns, windows, out, "range", **options),
+    "log_return_ma": _sweep_log_return_ma,
+}
+
+
+def sweep(columns, feature, windows, **options):
+    """ Calculates a feature for every window length
+
+    Args:
+        columns (dict or pd.DataFrame): column name to the bar values
+        feature (str): one of SWEEPS eg. volatility
+        windows (int[]): the window lengths
+        **options: passed to the feature eg. column="open" or std_mult=1.8
+
+    Returns:
+        np.ndarray: float32 bars x windows, column j is windows[j] with nan
+            for the warm up bars. Stored column by column so each window is
+            contiguous
+
+    """
+
+    if feature not in SWEEPS:
+        raise ValueError("Unknown sweep feature {0}; one of {1}".format(feature, ", ".join(SWEEPS)))
+
+    windows = [int(window) for window in windows]
+    if any(window < 1 for window in windows):
+        raise ValueError("windows must be at least 1")
+
+    length = len(columns[next(iter(columns))]) if isinstance(columns, dict) else len(columns)
+    out = np.full((length, len(windows)), np.nan, dtype=np.float32, order='F')
+
+    #windows longer than the data have no values
+    valid = [j for j, window in enumerate(windows) if window <= length]
+    if len(valid) == len(windows):
+        SWEEPS[feature](columns, windows, out, **options)
+    elif len(valid) > 0:
+        block = np.full((length, len(valid)), np.nan, dtype=np.float32, order='F')
+        SWEEPS[feature](columns, [windows[j] for j in valid], block, **options)
+        out[:, valid] = block
+    return out
+
+
+if __name__ == "__main__":
+
+    import sys
+    import time
+
+    from benchmark_kernels import synthetic_records
+
+    bar_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    first, last, step = [int(x) for x in sys.argv[2].split(',')] if len(sys.argv) > 2 else (5, 500, 5)
+    feature = sys.argv[3] if len(sys.argv) > 3 else "volatility"
+    windows = list(range(first, last + 1, step))
+
+    records = synthetic_records(bar_count)
+    columns = {name: np.ascontiguousarray(records[name]) for name in records.dtype.names if name != 'date'}
+    columns['close'] = columns['open']
+
+    start = time.perf_counter()
+    block = sweep(columns, feature, windows)
+    swept = time.perf_counter() - start
+
+    #a rolling pass per window for comparison, only for the features feature_kernels has
+    high_low = columns['high'].astype(np.float64) - columns['low']
+    passes = {"mean": lambda w: fk.rolling_mean(columns['close'], w),
+              "std": lambda w: fk.rolling_std(columns['close'], w),
+              "volatility": lambda w: fk.rolling_std(high_low, w)}
+    if feature in passes:
+        start = time.perf_counter()
+        expected = np.column_stack([passes[feature](w) for w in windows])
+        separate = time.perf_counter() - start
+        deviation = np.nanmax(np.abs(block - expected))
+        print("{0} bars {1} windows {2}: sweep {3:.1f} ms, rolling per window {4:.1f} ms, {5:.1f}x, max dev {6:.2e}".format(
+            bar_count, len(windows), feature, swept * 1000, separate * 1000, separate / swept, deviation))
+    else:
+        print("{0} bars {1} windows {2}: sweep {3:.1f} ms".format(bar_count, len(windows), feature, swept * 1000))
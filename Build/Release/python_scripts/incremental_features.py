@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental versions of the calc_feature indicators. Each feature keeps its
+own rolling state so appending a new bar costs the same no matter how long
+the lookback is. The values match the batch calc_feature path for the same
+bar history (to floating point rounding).
+
+Only the newest values are produced - this is intended for live trading where
+the server sees the same file grow by a bar at a time.
+"""
+
+import math
+from collections import deque
+
+import numpy as np
+
+from date_format import format_dates
+
+
+class RollingMean:
+    """ Running sum over a fixed window. The sum is rebuilt exactly from the
+    window every period updates so rounding errors can't accumulate. A window
+    with any non finite values is nan, the same as pandas rolling().mean()
+    """
+
+    def __init__(self, period):
+        self.period = period
+        self.window = deque(maxlen=period)
+        self.total = 0.0
+        self.non_finite = 0
+        self.updates = 0
+
+    def update(self, value):
+
+        value = float(value)
+
+        if len(self.window) == self.period:
+            old = self.window[0]
+            if math.isfinite(old):
+                self.total -= old
+            else:
+                self.non_finite -= 1
+
+        self.window.append(value)
+        if math.isfinite(value):
+            self.total += value
+        else:
+            self.non_finite += 1
+
+        #rebuild the sum so the error stays bounded
+        self.updates += 1
+        if self.updates >= self.period:
+            self.updates = 0
+            self.total = math.fsum(x for x in self.window if math.isfinite(x))
+
+        return self.value()
+
+    def value(self):
+
+        if len(self.window) < self.period:
+            return np.nan
+
+        if self.non_finite > 0:
+            return np.nan
+
+        return self.total / self.period
+
+
+class RollingVariance:
+    """ Windowed Welford variance with the same conventions as pandas
+    rolling().std() ie. a window of identical values is exactly zero and a
+    window with any non finite values is nan
+    """
+
+    def __init__(self, period, ddof=1):
+        self.period = period
+        self.ddof = ddof
+        self.window = deque(maxlen=period)
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.non_finite = 0
+        self.same_count = 0
+        self.updates = 0
+
+    def _add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def _remove(self, value):
+        self.count -= 1
+        if self.count == 0:
+            self.mean = 0.0
+            self.m2 = 0.0
+        else:
+            delta = value - self.mean
+            self.mean -= delta / self.count
+            self.m2 -= delta * (value - self.mean)
+
+    def update(self, value):
+
+        value = float(value)
+
+        #count how many of the most recent values are the same
+        if len(self.window) > 0 and self.window[-1] == value:
+            self.same_count += 1
+        else:
+            self.same_count = 1
+
+        if len(self.window) == self.period:
+            old = self.window[0]
+            if math.isfinite(old):
+                self._remove(old)
+            else:
+                self.non_finite -= 1
+
+        self.window.append(value)
+        if math.isfinite(value):
+            self._add(value)
+        else:
+            self.non_finite += 1
+
+        #rebuild from the window so the error stays bounded
+        self.updates += 1
+        if self.updates >= self.period:
+            self.updates = 0
+            values = np.array([x for x in self.window if math.isfinite(x)])
+            self.count = len(values)
+            self.mean = float(values.mean()) if self.count > 0 else 0.0
+            self.m2 = float(((values - self.mean) ** 2).sum())
+
+        return self.value()
+
+    def variance(self):
+
+        n = len(self.window)
+        if n < self.period or n - self.ddof <= 0 or self.non_finite > 0:
+            return np.nan
+        if self.same_count >= n:
+            return 0.0
+        return max(self.m2 / (n - self.ddof), 0.0)
+
+    def value(self):
+        variance = self.variance()
+        return np.nan if math.isnan(variance) else math.sqrt(variance)
+
+
+class SlidingPositiveMin:
+    """ Minimum of the positive values over the most recent bars. This is the
+    value replace_zero_with_min uses to fill in zeros before taking a log
+    """
+
+    def __init__(self):
+        self.values = deque()
+        self.count = 0
+
+    def update(self, value):
+        #a monotonic queue of (index, value) keeps the min at the front
+        if value > 0:
+            while len(self.values) > 0 and self.values[-1][1] >= value:
+                self.values.pop()
+            self.values.append((self.count, value))
+        self.count += 1
+
+    def value(self, lookback):
+        #drop anything outside the lookback
+        while len(self.values) > 0 and self.values[0][0] < self.count - lookback:
+            self.values.popleft()
+        if len(self.values) == 0:
+            return np.nan
+        return self.values[0][1]
+
+
+def _log_replace_zero(value, positive_min):
+    if value == 0:
+        value = positive_min
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return float(np.log(value))
+
+
+class SMAState:
+
+    def __init__(self, args):
+        if len(args) != 2:
+            raise ValueError("SMA requires 2 args; period and column name")
+        self.column = args[1]
+        self.mean = RollingMean(int(args[0]))
+
+    def update(self, bar, history):
+        return self.mean.update(bar[self.column])
+
+
+class BBANDSState:
+
+    def __init__(self, args):
+        if len(args) != 4:
+            raise ValueError("BBANDS requires 4 args; period, std dev, data_type (1=upper, 2=lower, 3=middle, 4=range) and column name")
+        if int(args[2]) not in (1, 2, 3, 4):
+            raise ValueError("BBANDS data_type must be one of (1=upper, 2=lower, 3=middle, 4=range)")
+        self.period = int(args[0])
+        self.std_mult = float(args[1])
+        self.data_type = int(args[2])
+        self.column = args[3]
+        #bollinger bands use the population standard deviation
+        self.moments = RollingVariance(self.period, ddof=0)
+
+    def update(self, bar, history):
+        self.moments.update(bar[self.column])
+        if len(self.moments.window) < self.period:
+            return np.nan
+
+        #pyti sums the window in the precision of the input data so do the
+        #same for the middle band, this is only the window not the lookback
+        dtype = np.asarray(bar[self.column]).dtype
+        if dtype.kind != 'f':
+            dtype = np.dtype(np.float64)
+        mean = float(np.array(self.moments.window, dtype=dtype).sum(dtype=dtype) / dtype.type(self.period))
+        if self.data_type == 3:
+            return mean
+
+        band = float(dtype.type(self.moments.value()) * dtype.type(self.std_mult))
+        if self.data_type == 1:
+            return mean + band
+        elif self.data_type == 2:
+            return mean - band
+        else:
+            return (mean + band) - (mean - band)
+
+
+class ATRState:
+
+    def __init__(self, args):
+        if len(args) != 4:
+            raise ValueError("ATR requires 4 args; period and close column, high column, low column")
+        self.close, self.high, self.low = args[1], args[2], args[3]
+        self.mean = RollingMean(int(args[0]))
+        self.last_close = None
+
+    def update(self, bar, history):
+        high = bar[self.high]
+        low = bar[self.low]
+
+        #true range is the max of the bar range and the gaps from the last close
+        true_range = high - low
+        if self.last_close is not None:
+            true_range = max(true_range, abs(high - self.last_close), abs(low - self.last_close))
+        self.last_close = bar[self.close]
+
+        return self.mean.update(true_range)
+
+
+class VOLATILITY_LOG_MAState:
+
+    def __init__(self, args):
+        if len(args) != 3:
+            raise ValueError("ATR requires 3 args; period, high column name, low column name")
+        self.high, self.low = args[1], args[2]
+        self.period = int(args[0])
+        self.std_12 = RollingVariance(12)
+        self.std_200 = RollingVariance(200)
+        self.positive_min = SlidingPositiveMin()
+        #raw volatility ratios so the log can be retaken if the min changes
+        self.ratios = deque(maxlen=self.period)
+
+    def update(self, bar, history):
+        high_low = bar[self.high] - bar[self.low]
+        self.std_12.update(high_low)
+        self.std_200.update(high_low)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = float(np.float64(self.std_12.value()) / np.float64(self.std_200.value()))
+        self.ratios.append(ratio)
+        self.positive_min.update(ratio)
+
+        if len(self.ratios) < self.period:
+            return np.nan
+
+        #the batch version only has ratios once the 200 bar std is available
+        positive_min = self.positive_min.value(history - 199)
+        logs = [_log_replace_zero(r, positive_min) for r in self.ratios]
+        if any(math.isnan(x) for x in logs):
+            return np.nan
+        return float(np.mean(logs))
+
+
+class VOLUME_LOG_MAState:
+
+    def __init__(self, args):
+        if len(args) != 2:
+            raise ValueError("VOLUME_LOG_MA requires 2 args; period, column name")
+        self.column = args[1]
+        self.period = int(args[0])
+        self.volume_mean = RollingMean(200)
+        self.volume_min = SlidingPositiveMin()
+        self.mean_min = SlidingPositiveMin()
+        self.values = deque(maxlen=self.period)
+
+    def update(self, bar, history):
+        volume = float(bar[self.column])
+        mean = self.volume_mean.update(volume)
+        self.volume_min.update(volume)
+        self.mean_min.update(mean)
+        self.values.append((volume, mean))
+
+        if len(self.values) < self.period:
+            return np.nan
+
+        #zeros are replaced with the smallest positive value in the lookback
+        volume_min = self.volume_min.value(history)
+        mean_min = self.mean_min.value(history - 199)
+        logs = [_log_replace_zero(v, volume_min) / _log_replace_zero(m, mean_min)
+                for v, m in self.values]
+        if any(math.isnan(x) for x in logs):
+            return np.nan
+        return float(np.mean(logs))
+
+
+FEATURE_STATES = {
+    "SMA": SMAState,
+    "BBANDS": BBANDSState,
+    "ATR": ATRState,
+    "VOLATILITY_LOG_MA": VOLATILITY_LOG_MAState,
+    "VOLUME_LOG_MA": VOLUME_LOG_MAState,
+}
+
+
+class IncrementalFeatures:
+    """ Rolling state for every feature in a request for one symbol
+
+    Args:
+        features ((str, str, str[])[]): parsed features as returned by
+            build_features.parse_features
+        max_rows (int): number of the most recent rows of results to keep
+
+    """
+
+    def __init__(self, features, max_rows=1):
+        self.columns = [column for column, _, _ in features]
+        self.states = []
+        for _, feature_name, feature_args in features:
+            if feature_name not in FEATURE_STATES:
+                raise ValueError("No incremental version of feature " + feature_name)
+            self.states.append(FEATURE_STATES[feature_name](feature_args))
+
+        self.rows = deque(maxlen=max(max_rows, 1))
+        self.last_date = None
+        self.bar_count = 0
+        #number of records of the input file that have been read
+        self.input_count = 0
+
+    def update(self, date, bar, history=None):
+        """ Adds a new bar and calculates the features for it
+
+        Args:
+            date (np.datetime64): open time of the bar
+            bar (dict): column name to value of the bar data
+            history (int): number of bars the equivalent batch calculation
+                would see, used for the zero replacement in the log features
+
+        Returns:
+            float[]: the feature values for this bar
+
+        """
+
+        self.bar_count += 1
+        if history is None:
+            history = self.bar_count
+
+        values = [state.update(bar, history) for state in self.states]
+        self.rows.append((date, values))
+        self.last_date = date
+        return values
+
+    def update_records(self, records, history=None):
+        """ Adds each of the records in date order
+
+        Args:
+            records (np.recarray): sorted bar records as loaded from the binary file
+            history (int): number of bars the equivalent batch calculation would see
+
+        """
+
+        names = [name for name in records.dtype.names if name != 'date']
+        columns = {name: records[name] for name in names}
+        dates = records['date']
+
+        for i in range(len(records)):
+            bar = {name: columns[name][i] for name in names}
+            #features are calculated on the open, same as the batch path
+            if "open" in bar:
+                bar["close"] = bar["open"]
+            self.update(dates[i], bar, history)
+
+    def to_records(self, count):
+        """ The newest rows of results as a record array, oldest first, in the
+        same layout as build_features.calc_features
+
+        Args:
+            count (int): number of rows to return
+
+        Returns:
+            np.recarray: the feature values
+
+        """
+
+        rows = list(self.rows)[len(self.rows) - min(count, len(self.rows)):]
+        dt = np.dtype((np.record, [('date', '<M8[ns]')] +
+                                  [(column, '<f8') for column in self.columns]))
+        records = np.empty(len(rows), dtype=dt)
+        for i, (date, values) in enumerate(rows):
+            records[i] = (date, *values)
+        return records
+
+    def to_csv(self, count):
+        """ Formats the newest rows of results the same way as the batch
+        path ie. newest first with no header
+
+        Args:
+            count (int): number of rows to return
+
+        Returns:
+            str: csv lines
+
+        """
+
+        rows = list(self.rows)[::-1][:count]
+        #the dates of the returned rows are formatted together so the time
+        #is left off when every one is at midnight, the same as the batch path
+        dates = format_dates(np.array([date for date, _ in rows], dtype='<M8[ns]'))
+
+        lines = []
+        for date, (_, values) in zip(dates, rows):
+            text_values = ["" if math.isnan(v) else repr(float(v)) for v in values]
+            lines.append(str(date) + "," + ",".join(text_values))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in timing and allocation metrics for build_features.py.
+
+Each request records the wall time and allocations of its stages ie. load,
+sort, calc and output, plus the time spent on each feature. When the request
+finishes these are written as a single line starting with METRICS followed by
+a json object, either to stderr or appended to a metrics file. PythonBridge.cs
+picks out the METRICS lines on stderr so they are never mixed up with the
+results on stdout or reported as errors.
+
+Metrics are turned on by the metrics option on the datafeed type line or the
+NITRADE_METRICS environment variable, which is either stderr or the path of
+the metrics file. A cProfile dump of each request is written when the profile
+option is given or NITRADE_PROFILE is set to the directory to write it to.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_PREFIX = "METRICS "
+
+#the time the interpreter got to this module, the imports before it are part of the startup
+_imported = time.perf_counter()
+
+#the metrics of the request running on each thread, feature_service.py runs
+#several requests at once on a thread pool
+_local = threading.local()
+_requests = 0
+_requests_lock = threading.Lock()
+
+
+class RequestMetrics:
+    """ The stages and features timed for one request
+
+    Args:
+        request (str): the datafeed type line of the request
+        destination (str): stderr or the path of the metrics file
+        allocations (bool): True to trace the peak allocation of each stage
+            with tracemalloc, this slows the request down
+
+    """
+
+    def __init__(self, request, destination, allocations=False):
+        self.request = request
+        self.destination = destination
+        self.allocations = allocations
+        self.stages = []
+        self.features = {}
+        self.values = {}
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+
+        blocks = sys.getallocatedblocks()
+        if self.allocations:
+            import tracemalloc
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stage = {"stage": name,
+                     "ms": round((time.perf_counter() - start) * 1000, 3),
+                     "blocks": sys.getallocatedblocks() - blocks}
+            if self.allocations:
+                import tracemalloc
+                stage["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            self.stages.append(stage)
+
+    def line(self):
+        """ The METRICS line for the request """
+
+        metrics = {"request": self.request,
+                   "pid": os.getpid(),
+                   "total_ms": round((time.perf_counter() - self.start) * 1000, 3),
+                   "stages": self.stages,
+                   "features": {name: round(ms, 3) for name, ms in self.features.items()}}
+        metrics.update(self.values)
+        return METRICS_PREFIX + json.dumps(metrics, separators=(",", ":"))
+
+    def emit(self):
+        line = self.line()
+        if self.destination == "stderr":
+            sys.stderr.write(line + "\n")
+            sys.stderr.flush()
+        else:
+            with open(self.destination, "a") as f:
+                f.write(line + "\n")
+
+
+def destination(options):
+    """ Where the metrics of a request with these options go, None if off """
+
+    if "metrics" in options:
+        return "stderr"
+    value = os.environ.get("NITRADE_METRICS", "").strip()
+    if value in ("", "0"):
+        return None
+    return "stderr" if value in ("1", "stderr") else value
+
+
+def profile_dir(options):
+    """ The directory to write the cProfile dump to, None if off """
+
+    value = os.environ.get("NITRADE_PROFILE", "").strip()
+    if value not in ("", "0"):
+        return value
+    return "." if "profile" in options else None
+
+
+@contextmanager
+def request(type_line):
+    """ Records the metrics and profile of one request if they are turned on
+    and writes them out when the request finishes, even if it fails
+
+    Args:
+        type_line (str): the datafeed type followed by any options
+    """
+
+    global _requests
+
+    options = type_line.split()[1:]
+    target = destination(options)
+    folder = profile_dir(options)
+    with _requests_lock:
+        _requests += 1
+        number = _requests
+
+    if target is None and folder is None:
+        yield
+        return
+
+    if target is not None:
+        allocations = os.environ.get("NITRADE_METRICS_ALLOCATIONS", "") not in ("", "0")
+        current = _local.current = RequestMetrics(type_line, target, allocations)
+        started = _process_start()
+        if number == 1 and started is not None:
+            #only the first request of a process pays for the interpreter and imports
+            current.values["startup_ms"] = round((_imported - started) * 1000, 3)
+        if allocations:
+            import tracemalloc
+            tracemalloc.start()
+
+    profiler = None
+    if folder is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, "build_features_{0}_{1}.prof".format(os.getpid(), number))
+            profiler.dump_stats(path)
+            if _current() is not None:
+                _current().values["profile"] = os.path.abspath(path)
+
+        current = _current()
+        if current is not None:
+            if current.allocations:
+                import tracemalloc
+                tracemalloc.stop()
+            try:
+                current.emit()
+            finally:
+                _local.current = None
+
+
+def _process_start():
+    """ perf_counter time the process started, None if psutil isn't
+    installed to get the process create time """
+
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return time.perf_counter() - (time.time() - psutil.Process().create_time())
+
+
+def _current():
+    """ The metrics of the request running on this thread, None if off """
+    return getattr(_local, "current", None)
+
+
+def enabled():
+    return _current() is not None
+
+
+def stage(name):
+    """ Context manager timing a stage of the current request, does nothing
+    if metrics are off """
+
+    current = _current()
+    if current is None:
+        return _no_stage()
+    return current.stage(name)
+
+
+@contextmanager
+def _no_stage():
+    yield
+
+
+def set_value(name, value):
+    """ Adds an extra value to the metrics of the current request """
+
+    current = _current()
+    if current is not None:
+        current.values[name] = value
+
+
+def record_plan(plan, node_seconds):
+    """ Adds the time of each feature in a plan. A feature's time includes
+    every node it depends on so a shared node counts towards each feature
+    that uses it
+
+    Args:
+        plan (feature_planner.FeaturePlan): the evaluated plan
+        node_seconds (dict): node index to the seconds spent evaluating it
+
+    """
+
+    current = _current()
+    if current is None:
+        return
+
+    for column_name, output in plan.outputs:
+        seen = set()
+        stack = [output]
+        seconds = 0.0
+        while stack:
+            index = stack.pop()
+            if index in seen:
+                continue
+            seen.add(index)
+            seconds += node_seconds.get(index, 0.0)
+            stack.extend(plan.nodes[index].inputs)
+        current.features[column_name] = current.features.get(column_name, 0.0) + seconds * 1000
+
+
+def record_feature(column_name, seconds):
+    """ Adds the time spent calculating one feature """
+
+    current = _current()
+    if current is not None:
+        current.features[column_name] = current.features.get(column_name, 0.0) + seconds * 1000
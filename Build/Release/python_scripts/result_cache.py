@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Content addressed cache of the binary feature files written by
+build_features.py. The key is a hash of the input binary, the normalized
+feature string and the source of the scripts that calculate the features so
+any change to the data, the features or the calculations is a miss.
+
+The cache directory is kept under a size limit by removing the least
+recently used files and keeps running totals of the hits, misses and bytes
+saved in stats.json.
+
+The cache directory defaults to feature_cache next to this script and can be
+changed with the NITRADE_FEATURE_CACHE environment variable.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+CACHE_DIR = os.environ.get("NITRADE_FEATURE_CACHE",
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), "feature_cache"))
+
+#total size the cache directory is trimmed to after a new result is added
+MAX_CACHE_BYTES = 5 * 1024 ** 3
+
+STATS_FILE = "stats.json"
+RESULT_EXTENSION = ".bin"
+
+#scripts whose source is part of the key so a change in the calculations is a miss
+VERSION_SOURCES = ["build_features.py", "feature_planner.py", "feature_kernels.py", "feature_registry.py", "share_file.py"]
+
+_version = None
+
+#guards the read, update and write of the stats file between the threads of
+#the feature service
+_stats_lock = threading.Lock()
+
+
+def file_hash(filename, block_size=1024 * 1024):
+    """ Hash of the contents of a file read a block at a time """
+
+    digest = hashlib.blake2b(digest_size=20)
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def script_version():
+    """ Hash of the source of the scripts that calculate the features """
+
+    global _version
+    if _version is None:
+        digest = hashlib.blake2b(digest_size=20)
+        folder = os.path.dirname(os.path.abspath(__file__))
+        for name in VERSION_SOURCES:
+            path = os.path.join(folder, name)
+            if os.path.isfile(path):
+                digest.update(file_hash(path).encode("ascii"))
+        _version = digest.hexdigest()
+    return _version
+
+
+def cache_key(df_type, filename, column_names, options=()):
+    """ The key of the results of a request
+
+    Args:
+        df_type (str): the datafeed type ie. whole or single
+        filename (str): path of the binary data
+        column_names (str[]): the parsed feature column names, these have
+            the blanks stripped so the feature string is normalized
+        options (str[]): request options that change the results eg. float32
+
+    Returns:
+        str: hex digest of the key
+
+    """
+
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(df_type.encode("utf-8") + b"\n")
+    digest.update(file_hash(filename).encode("ascii") + b"\n")
+    digest.update(";".join(column_names).encode("utf-8") + b"\n")
+    if len(options) > 0:
+        digest.update(" ".join(sorted(options)).encode("utf-8") + b"\n")
+    digest.update(script_version().encode("ascii"))
+    return digest.hexdigest()
+
+
+def _result_path(key, cache_dir):
+    return os.path.join(cache_dir, key + RESULT_EXTENSION)
+
+
+def fetch(key, output, cache_dir=None):
+    """ Copies the cached results to output if there are any
+
+    Returns:
+        int: the size of the results copied or None on a miss
+
+    """
+
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    path = _result_path(key, cache_dir)
+    if not os.path.isfile(path):
+        return None
+
+    shutil.copyfile(path, output)
+    #mark the result as used for the eviction order
+    os.utime(path)
+    return os.path.getsize(path)
+
+
+def store(key, output, cache_dir=None, max_bytes=None):
+    """ Adds the results written to output to the cache """
+
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    os.makedirs(cache_dir, exist_ok=True)
+
+    #copy then rename so a part written result is never fetched
+    path = _result_path(key, cache_dir)
+    temp = path + ".tmp{0}_{1}".format(os.getpid(), threading.get_ident())
+    shutil.copyfile(output, temp)
+    os.replace(temp, path)
+
+    evict(max_bytes, cache_dir)
+
+
+def evict(max_bytes=None, cache_dir=None):
+    """ Removes the least recently used results until the cache is no bigger
+    than max_bytes
+
+    Returns:
+        int: the size of the cache after evicting
+
+    """
+
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    max_bytes = MAX_CACHE_BYTES if max_bytes is None else max_bytes
+    if not os.path.isdir(cache_dir):
+        return 0
+
+    results = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.endswith(RESULT_EXTENSION):
+            results.append((os.path.getmtime(path), os.path.getsize(path), path))
+
+    total = sum(size for _, size, _ in results)
+    for _, size, path in sorted(results):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+    return total
+
+
+def record(hit, size, cache_dir=None):
+    """ Adds a hit or miss to the running totals
+
+    Args:
+        hit (bool): True if the results came from the cache
+        size (int): size of the results
+
+    Returns:
+        dict: the totals of hits, misses and bytes_saved
+
+    """
+
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    path = os.path.join(cache_dir, STATS_FILE)
+
+    with _stats_lock:
+        stats = {"hits": 0, "misses": 0, "bytes_saved": 0}
+        try:
+            with open(path) as f:
+                stats.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+
+        if hit:
+            stats["hits"] += 1
+            stats["bytes_saved"] += size
+        else:
+            stats["misses"] += 1
+
+        #write then rename so a reader in another process never sees part of the file
+        os.makedirs(cache_dir, exist_ok=True)
+        temp = path + ".tmp{0}".format(os.getpid())
+        with open(temp, "w") as f:
+            json.dump(stats, f)
+        os.replace(temp, path)
+    return stats
+
+
+def stats_line(hit, stats):
+    """ The line reported on stdout after a cached request """
+
+    return "CACHE {0} hits={1} misses={2} bytes_saved={3}".format(
+        "hit" if hit else "miss", stats["hits"], stats["misses"], stats["bytes_saved"])
+
+
+def clear(cache_dir=None):
+    """ Removes every cached result and the stats """
+
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+
+    import sys
+
+    #python result_cache.py clear or python result_cache.py evict [max_bytes]
+    if len(sys.argv) > 1 and sys.argv[1] == "clear":
+        clear()
+    elif len(sys.argv) > 1 and sys.argv[1] == "evict":
+        print("{0} bytes cached".format(evict(int(sys.argv[2]) if len(sys.argv) > 2 else None)))
+    else:
+        print(__doc__)
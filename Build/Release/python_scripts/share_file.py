@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+Memory mapped exchange format shared with the C# ShareFile class.
+
+A share file is a 64 byte header followed by fixed size records. Records are
+only ever appended: the writer fills in the new records first and then
+updates the count in the header so a reader never sees a partly written
+record. The capacity is preallocated so appending doesn't resize the file.
+
+A file that has to be made again (full, a different layout or capacity) is
+written under a temporary name and renamed over the old one, it is never
+truncated in place as that fails on Windows while the host has it mapped. The
+old file is flagged as replaced first so a reader that keeps it mapped knows
+to map the path again.
+
+A feature ring (layout 3) holds only the newest capacity records so its size
+never changes. Record i is written to slot i % capacity and count is the total
+number of records ever written. The sequence is odd while the writer is
+changing the records so a reader takes the sequence before and after reading
+and reads again if it was odd or has changed.
+
+Header layout (little endian):
+    magic        8 bytes  NTSHARE1
+    version      int32
+    header_size  int32    64
+    layout       int32    0=whole bars, 1=single value bars, 2=features,
+                          3=feature ring
+    field_count  int32    number of feature values per record (layout 2, 3)
+    value_width  int32    bytes per feature value
+    replaced     int32    1 once a new file has been renamed over this one
+    capacity     int64    number of records allocated
+    count        int64    number of records written
+    sequence     int64    incremented on every write
+    padding      8 bytes
+"""
+
+import os
+
+import numpy as np
+
+MAGIC = b'NTSHARE1'
+VERSION = 1
+HEADER_SIZE = 64
+
+LAYOUT_WHOLE = 0
+LAYOUT_SINGLE = 1
+LAYOUT_FEATURES = 2
+LAYOUT_FEATURE_RING = 3
+
+HEADER_DTYPE = np.dtype([('magic', 'S8'),
+                         ('version', '<i4'),
+                         ('header_size', '<i4'),
+                         ('layout', '<i4'),
+                         ('field_count', '<i4'),
+                         ('value_width', '<i4'),
+                         ('replaced', '<i4'),
+                         ('capacity', '<i8'),
+                         ('count', '<i8'),
+                         ('sequence', '<i8'),
+                         ('padding', 'V8')])
+
+#byte offset of the count so it can be updated on its own
+COUNT_OFFSET = 40
+
+#times read_ring reads again when the writer changes the ring part way through
+RING_READ_RETRIES = 100
+
+WHOLE_DTYPE = np.dtype((np.record, [('date', '<M8[ns]'),
+                                    ('open', '<f4'),
+                                    ('close', '<f4'),
+                                    ('high', '<f4'),
+                                    ('low', '<f4'),
+                                    ('volume', '<i4')]))
+
+SINGLE_DTYPE = np.dtype((np.record, [('date', '<M8[ns]'), ('value', '<f4')]))
+
+
+def is_share_file(filename):
+    """ True if the file starts with the share file magic """
+
+    if not os.path.isfile(filename):
+        return False
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def read_header(filename):
+    """ Reads the header of a share file
+
+    Args:
+        filename (str): path of the share file
+
+    Returns:
+        np.record: the header fields
+
+    """
+
+    header = np.fromfile(filename, HEADER_DTYPE, count=1)
+    if len(header) == 0 or header[0]['magic'] != MAGIC:
+        raise ValueError(filename + " is not a share file")
+    if header[0]['version'] > VERSION:
+        raise ValueError("Unsupported share file version {0}".format(header[0]['version']))
+    return header[0]
+
+
+def record_dtype(header, field_names=None):
+    """ The dtype of the records described by a header """
+
+    if header['layout'] == LAYOUT_WHOLE:
+        return WHOLE_DTYPE
+    elif header['layout'] == LAYOUT_SINGLE:
+        return SINGLE_DTYPE
+
+    if field_names is None:
+        field_names = ["f{0}".format(i) for i in range(header['field_count'])]
+    value_type = '<f{0}'.format(header['value_width'])
+    return np.dtype((np.record, [('date', '<M8[ns]')] +
+                                [(name, value_type) for name in field_names]))
+
+
+def map_records(filename, start=0):
+    """ Maps the written records of a share file without reading them
+
+    Args:
+        filename (str): path of the share file
+        start (int): index of the first record wanted, only the pages from
+            here on are touched
+
+    Returns:
+        (np.record, np.memmap): the header and the mapped records from start
+            to the current count (None if there are no new records)
+
+    """
+
+    header = read_header(filename)
+    dt = record_dtype(header)
+    count = int(header['count'])
+    if start >= count:
+        return header, None
+
+    records = np.memmap(filename, dtype=dt, mode='r',
+                        offset=HEADER_SIZE + start * dt.itemsize,
+                        shape=(count - start,))
+    return header, records
+
+
+def write_records(filename, records, layout=LAYOUT_FEATURES, append=True, capacity=None):
+    """ Writes records into a share file. Appends after the current count if
+    the file is compatible and has room, otherwise creates it again with
+    enough capacity for at least twice the records
+
+    Args:
+        filename (str): path of the share file
+        records (np.recarray): the records to write, the first field must be
+            the date followed by equal width values for layout 2
+        layout (int): the record layout
+        append (bool): False to overwrite all existing records
+        capacity (int): records to preallocate when the file is created
+
+    Returns:
+        int: the record count after writing
+
+    """
+
+    value_names = [name for name in records.dtype.names if name != 'date']
+    field_count = len(value_names) if layout == LAYOUT_FEATURES else 0
+    value_width = records.dtype[value_names[0]].itemsize if field_count > 0 else 0
+
+    start = 0
+    header = None
+    if os.path.isfile(filename) and is_share_file(filename):
+        header = read_header(filename)
+        if header['layout'] != layout or header['field_count'] != field_count or \
+                header['value_width'] != value_width:
+            header = None
+        elif append:
+            start = int(header['count'])
+
+    #make a new file if it isn't there, doesn't match or is full
+    if header is None or start + len(records) > header['capacity']:
+        if capacity is None or capacity < start + len(records):
+            capacity = max(2 * (start + len(records)), 1)
+        existing = None
+        if header is not None and start > 0:
+            _, mapped = map_records(filename)
+            existing = np.array(mapped).astype(records.dtype)
+            del mapped
+        _create(filename, records.dtype, layout, field_count, value_width, capacity, existing)
+        header = read_header(filename)
+
+    _write_at(filename, records, start)
+
+    #update the count last so readers only see complete records
+    count = start + len(records)
+    mapped_header = np.memmap(filename, dtype=HEADER_DTYPE, mode='r+', shape=(1,))
+    mapped_header[0]['count'] = count
+    mapped_header[0]['sequence'] = header['sequence'] + 1
+    mapped_header.flush()
+    del mapped_header
+
+    return count
+
+
+def write_ring(filename, records, capacity, append=True):
+    """ Writes feature records into a ring that keeps the newest capacity
+    records. The file is only created again if it doesn't match the records
+    or capacity, so the host can keep it mapped
+
+    Args:
+        filename (str): path of the share file
+        records (np.recarray): the date followed by equal width values
+        capacity (int): number of records the ring holds
+        append (bool): False to drop the records already in the ring
+
+    Returns:
+        int: the total number of records written to the ring
+
+    """
+
+    if capacity < 1:
+        raise ValueError("capacity must be at least 1")
+
+    value_names = [name for name in records.dtype.names if name != 'date']
+    value_width = records.dtype[value_names[0]].itemsize if len(value_names) > 0 else 0
+
+    header = None
+    if os.path.isfile(filename) and is_share_file(filename):
+        header = read_header(filename)
+        if header['layout'] != LAYOUT_FEATURE_RING or header['field_count'] != len(value_names) or \
+                header['value_width'] != value_width or header['capacity'] != capacity:
+            header = None
+    if header is None:
+        _create(filename, records.dtype, LAYOUT_FEATURE_RING, len(value_names), value_width, capacity)
+
+    mapped = np.memmap(filename, dtype=np.uint8, mode='r+')
+    mapped_header = mapped[:HEADER_SIZE].view(HEADER_DTYPE)
+    ring = mapped[HEADER_SIZE:HEADER_SIZE + capacity * records.dtype.itemsize].view(records.dtype)
+
+    #odd while writing, a writer that died part way through left it odd already
+    sequence = int(mapped_header[0]['sequence'])
+    sequence += 1 - sequence % 2
+    mapped_header[0]['sequence'] = sequence
+
+    start = int(mapped_header[0]['count']) if append else 0
+    count = start + len(records)
+    #records that would be overwritten within this write are skipped
+    kept = records[-capacity:]
+    ring[np.arange(count - len(kept), count) % capacity] = kept
+
+    mapped_header[0]['count'] = count
+    mapped_header[0]['sequence'] = sequence + 1
+    mapped.flush()
+    del ring, mapped_header, mapped
+
+    return count
+
+
+def read_ring(filename, count=None, field_names=None):
+    """ Reads the newest records of a feature ring
+
+    Args:
+        filename (str): path of the share file
+        count (int): number of records wanted, all in the ring if None
+        field_names (str[]): names of the feature values
+
+    Returns:
+        np.recarray: the newest records oldest first
+
+    """
+
+    header = read_header(filename)
+    if header['layout'] != LAYOUT_FEATURE_RING:
+        raise ValueError(filename + " is not a feature ring")
+    dt = record_dtype(header, field_names)
+    capacity = int(header['capacity'])
+
+    mapped = np.memmap(filename, dtype=np.uint8, mode='r')
+    mapped_header = mapped[:HEADER_SIZE].view(HEADER_DTYPE)
+    ring = mapped[HEADER_SIZE:HEADER_SIZE + capacity * dt.itemsize].view(dt)
+
+    for _ in range(RING_READ_RETRIES):
+        sequence = int(mapped_header[0]['sequence'])
+        if sequence % 2 == 1:
+            continue
+        total = int(mapped_header[0]['count'])
+        wanted = min(total, capacity) if count is None else min(count, total, capacity)
+        records = ring[np.arange(total - wanted, total) % capacity]
+        if int(mapped_header[0]['sequence']) == sequence:
+            return records
+    raise RuntimeError("{0} kept changing while it was read".format(filename))
+
+
+def _create(filename, dt, layout, field_count, value_width, capacity, records=None):
+
+    #the new file is complete before it replaces the old one so a reader never
+    #sees it empty or partly written
+    temp = filename + ".tmp"
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header[0]['magic'] = MAGIC
+    header[0]['version'] = VERSION
+    header[0]['header_size'] = HEADER_SIZE
+    header[0]['layout'] = layout
+    header[0]['field_count'] = field_count
+    header[0]['value_width'] = value_width
+    header[0]['capacity'] = capacity
+    if records is not None:
+        header[0]['count'] = len(records)
+        header[0]['sequence'] = 1
+
+    with open(temp, 'wb') as f:
+        header.tofile(f)
+        if records is not None:
+            records.tofile(f)
+        #preallocate the record region
+        f.truncate(HEADER_SIZE + capacity * dt.itemsize)
+
+    if is_share_file(filename):
+        mapped_header = np.memmap(filename, dtype=HEADER_DTYPE, mode='r+', shape=(1,))
+        mapped_header[0]['replaced'] = 1
+        mapped_header.flush()
+        del mapped_header
+    os.replace(temp, filename)
+
+
+def _write_at(filename, records, start):
+
+    if len(records) == 0:
+        return
+    mapped = np.memmap(filename, dtype=records.dtype, mode='r+',
+                       offset=HEADER_SIZE + start * records.dtype.itemsize,
+                       shape=(len(records),))
+    mapped[:] = records
+    mapped.flush()
+    del mapped
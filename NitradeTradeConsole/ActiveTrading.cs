@@ -26,6 +26,27 @@ namespace NitradeTradeConsole
         static string pythonCalcCommands;
         static string[] pythonCalcLabels;
         static int[] pythonCalcTimeframes;
+        //open time of the newest bar written to each share file
+        static Dictionary<string, DateTime> lastSharedBar = new Dictionary<string, DateTime>();
+        //number of bars python reports the features need for their newest value
+        const string LookbackPrefix = "LOOKBACK ";
+        static int pythonLookback = 0;
+
+        //new bars of every symbol close on the same boundary so the python calculations that arrive within the batch
+        //window are sent as one batch request instead of a request each
+        const int PythonBatchWindow = 250;
+        //the same number of workers is asked for on every request so python keeps each symbol on the same worker
+        //along with its incremental and ring state
+        const int PythonBatchWorkers = 4;
+        static List<PythonJob> pendingPythonJobs = new List<PythonJob>();
+        static Timer pythonBatchTimer = null;
+
+        class PythonJob
+        {
+            public string AssetName;
+            public int Timeframe;
+            public Strategy[] Strategies;
+        }
 
         static PythonBridge PythonBridge = null;
 
@@ -65,9 +86,22 @@ namespace NitradeTradeConsole
             {
                 controller.Config = new Config(@"local/");
 
+                //stop any feature server left running from a previous connection
+                if (PythonBridge != null)
+                    PythonBridge.StopServer();
+
                 if (controller.Config.PythonPath != null)
+                {
                     PythonBridge = new PythonBridge(controller.Config.PythonPath);
 
+                    //log the python timings when turned on in the config
+                    if (controller.Config.PythonMetrics != null)
+                    {
+                        PythonBridge.Metrics = controller.Config.PythonMetrics;
+                        PythonBridge.MetricsReceived = (message, type) => DisplayMessage("Python metrics " + message);
+                    }
+                }
+
             }
             catch (Exception ex)
             {
@@ -394,9 +428,13 @@ namespace NitradeTradeConsole
             }
             else
             {
-                //load in the python calculated data if required - only need the most recent bar         
-                if (PythonBridge != null)
-                    CalculatePythonData(PythonBridge, symbolName, data.Key, 1);
+                //load in the python calculated data if required - only need the most recent bar
+                //the strategies are run once the batch with this bar has been calculated
+                if (PythonBridge != null && pythonCalcTimeframes.Contains(data.Key))
+                {
+                    QueuePythonData(symbolName, data.Key, strategiesToRunOnComplete);
+                    return;
+                }
 
                 foreach (Strategy strategy in strategiesToRunOnComplete)
                 {
@@ -463,45 +501,163 @@ namespace NitradeTradeConsole
 
         }
 
+        static void QueuePythonData(string assetName, int timeframe, Strategy[] strategies)
+        {
+            lock (pendingPythonJobs)
+            {
+                pendingPythonJobs.Add(new PythonJob() { AssetName = assetName, Timeframe = timeframe, Strategies = strategies });
+
+                //the first bar of a batch starts the window
+                if (pythonBatchTimer == null)
+                    pythonBatchTimer = new Timer(RunPythonBatch, null, PythonBatchWindow, -1);
+            }
+        }
+
+        static void RunPythonBatch(Object o)
+        {
+            PythonJob[] jobs;
+            lock (pendingPythonJobs)
+            {
+                jobs = pendingPythonJobs.ToArray();
+                pendingPythonJobs.Clear();
+                pythonBatchTimer.Dispose();
+                pythonBatchTimer = null;
+            }
+
+            //write the new bars of every symbol then calculate them all in one request
+            List<PythonJob> sent = new List<PythonJob>();
+            List<string[]> requests = new List<string[]>();
+            foreach (PythonJob job in jobs)
+            {
+                string[] commands = SharePythonData(job.AssetName, job.Timeframe, 1);
+                if (commands != null)
+                {
+                    sent.Add(job);
+                    requests.Add(commands);
+                }
+            }
+
+            try
+            {
+                if (requests.Count > 0)
+                {
+                    string[][] responses = PythonBridge.RunServerBatch(System.IO.Path.Combine("python_scripts", "build_features.py"), requests,
+                        PythonBatchWorkers);
+                    for (int i = 0; i < sent.Count; i++)
+                    {
+                        if (responses[i].Length > 0 && responses[i][0].StartsWith(PythonBridge.ErrorPrefix))
+                            DisplayError(sent[i].AssetName + " " + responses[i][0].Substring(PythonBridge.ErrorPrefix.Length));
+                        else
+                        {
+                            CheckLookback(responses[i], sent[i].AssetName, sent[i].Timeframe);
+                            OpenFeatureRing(sent[i].AssetName, sent[i].Timeframe, requests[i][2]);
+                        }
+                    }
+                }
+            }
+            catch (Exception e)
+            {
+                DisplayError(e.Message);
+            }
+
+            foreach (PythonJob job in jobs)
+            {
+                foreach (Strategy strategy in job.Strategies)
+                    strategy.Run(job.Timeframe, job.AssetName);
+            }
+        }
+
         static void CalculatePythonData(PythonBridge pb, string assetName, int timeframe, int barCount)
         {
-            //do nothing if this timeframe is not listed as required
-            if (!pythonCalcTimeframes.Contains(timeframe))
+            string[] commands = SharePythonData(assetName, timeframe, barCount);
+            if (commands == null)
                 return;
 
-            //get the relevant bars (whole lookback period) but not the zero index bar as this is incomplete
-            Bar[] bars = priceData[assetName][timeframe].Skip(1).ToArray();
+            //Send the calculation commands to the python feature server - this is started on the first request
+            //and kept running so the interpreter and imports aren't loaded again on every bar. It is sent as a batch
+            //of one so it goes to the same worker as the batches of new bars and that worker has the incremental state
+            try
+            {
+                string[] response = pb.RunServerBatch(System.IO.Path.Combine("python_scripts", "build_features.py"),
+                    new List<string[]>() { commands }, PythonBatchWorkers)[0];
+                if (response.Length > 0 && response[0].StartsWith(PythonBridge.ErrorPrefix))
+                    throw new Exception(response[0].Substring(PythonBridge.ErrorPrefix.Length));
+                CheckLookback(response, assetName, timeframe);
+                OpenFeatureRing(assetName, timeframe, commands[2]);
+            }
+            catch (Exception e)
+            {
+                DisplayError(e.Message);
+            }
+        }
 
-            //save a temporary binary file to disk for python to read (faster than sending all the data via the stdout
-            string tempData = @"C:\ForexData\ShareData\" + assetName + "_m" + timeframe + "_Share_live.bin";
-            DataBuilder.DatasetToBinary(tempData, bars, DataFeedType.Ask);
+        static string[] SharePythonData(string assetName, int timeframe, int barCount)
+        {
+            //Writes the bars to the share file and returns the python request for them or null if there is nothing to calculate
 
-            //Create the python bridge and run the calculation commands            
-            string[] commands = new string[] { "whole", tempData, barCount.ToString(), pythonCalcCommands };
-            string[] results = pb.RunScript(System.IO.Path.Combine("python_scripts","build_features.py"), commands);
+            //do nothing if this timeframe is not listed as required
+            if (!pythonCalcTimeframes.Contains(timeframe))
+                return null;
 
-            PreCalculatedFeatures pcFeatures = new PreCalculatedFeatures();
+            //get the relevant bars (whole lookback period) but not the zero index bar as this is incomplete
+            //the share file is ordered oldest to newest
+            Bar[] bars = priceData[assetName][timeframe].Skip(1).Where(x => x != null).OrderBy(x => x.OpenTime).ToArray();
+
+            //share the bars with python through a memory mapped file. The whole lookback is written once and after that
+            //only the new bars are appended so the I/O on each bar is the size of the new data. When the file fills it
+            //is written again with only the lookback so it doesn't grow over a long session, python recalculates the
+            //features from the shorter file once when that happens
+            string shareKey = assetName + "_m" + timeframe;
+            string tempData = @"C:\ForexData\ShareData\" + shareKey + "_Share_live.bin";
+            string featureData = @"C:\ForexData\ShareData\" + shareKey + "_Features_live.bin";
             try
             {
-                pcFeatures.FillFromCsv(results, pythonCalcLabels);
+                if (barCount > 1 || !lastSharedBar.ContainsKey(shareKey))
+                    ShareFile.WriteBars(tempData, bars, DataFeedType.Ask, bars.Length * 2);
+                else
+                    ShareFile.AppendBars(tempData, bars.Where(x => x.OpenTime > lastSharedBar[shareKey]).ToArray(), DataFeedType.Ask, bars.Length);
             }
             catch (Exception e)
             {
                 DisplayError(e.Message);
+                return null;
             }
+            if (bars.Length > 0)
+                lastSharedBar[shareKey] = bars.Last().OpenTime;
+
+            //incremental keeps the feature state in python so only the new bar is calculated and ring has the
+            //results written to a feature ring share file that keeps the same number of bars as the lookback, so
+            //neither side grows over a long session. lookback has python report how many bars the features need
+            int ringCapacity = priceData[assetName][timeframe].Length;
+            return new string[] { "whole incremental ring=" + ringCapacity + " lookback", tempData, featureData, pythonCalcCommands };
+        }
 
-            //add this data to the asset if it doesnt exist
-            if (!assetDetails[assetName].Data.ContainsKey(timeframe))
-                assetDetails[assetName].Data.Add(timeframe, pcFeatures);
-            else
+        static void CheckLookback(string[] response, string assetName, int timeframe)
+        {
+            //warn if the lookback buffer is too short for the python features to have a value
+            foreach (string line in response)
             {
-                //remove the oldest one to save on memory creep
-                assetDetails[assetName].Data[timeframe].RemoveOldest();
-
-                //we just add the data to the current set of data
-                assetDetails[assetName].Data[timeframe].Merge(pcFeatures);
+                if (!line.StartsWith(LookbackPrefix))
+                    continue;
+
+                pythonLookback = Convert.ToInt32(line.Substring(LookbackPrefix.Length));
+                //the zero index bar is incomplete so isn't sent
+                int available = priceData[assetName][timeframe].Length - 1;
+                if (available < pythonLookback)
+                    DisplayError(assetName + " " + timeframe + "min features need " + pythonLookback + " bars but the lookback is " + available + " bars.");
             }
+        }
 
+        static void OpenFeatureRing(string assetName, int timeframe, string path)
+        {
+            //the feature ring is mapped once and python keeps it up to date, the strategies read the features
+            //straight from it so nothing is parsed or copied on each bar
+            Dictionary<int, FeatureRing> rings = assetDetails[assetName].FeatureRings;
+            lock (rings)
+            {
+                if (!rings.ContainsKey(timeframe))
+                    rings.Add(timeframe, new FeatureRing(path, pythonCalcLabels));
+            }
         }
 
         static void DisplayTickRequest(Symbol symbol)
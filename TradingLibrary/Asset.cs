@@ -11,6 +11,8 @@ namespace TradingLibrary
         public string Name { get; set; }
         public byte[] Dataset { get; set; }
         public Dictionary<int, PreCalculatedFeatures> Data { get; set; }
+        //live features read straight from the python feature ring of each timeframe, used before Data
+        public Dictionary<int, FeatureRing> FeatureRings { get; set; }
         public Delegate DisplayMessage { get; set; }
         public int Digits { get; set; }
         public double Pip { get; set; }
@@ -24,6 +26,7 @@ namespace TradingLibrary
             Pip = 0.0001;
             LookbackDownloaded = new Dictionary<int, bool>();
             Data = new Dictionary<int, PreCalculatedFeatures>();
+            FeatureRings = new Dictionary<int, FeatureRing>();
         }
 
         public double Point
@@ -324,7 +324,7 @@ namespace TradingLibrary
         public static void LoadExternalFeatureBinary(Asset asset, ExternalFeatureData externalFeature, MessageDelegate messageDelegate)
         {
             //Read the results into the bars from the binary file that python has written over
-            PreCalculatedFeatures pcFeatures = new PreCalculatedFeatures();
+            PreCalculatedFeatures pcFeatures;
 
             //[ASSET] is used as a placeholder so insert the assetname here
             string path = externalFeature.BinaryFilepath.Replace("[ASSET]", asset.Name);
@@ -332,6 +332,24 @@ namespace TradingLibrary
             //make the path suitable for all operating systems
             path = Path.Combine(path.Split(new char[] { '\\' }));
 
+            //float32 results are written as a share file whose header gives the value width
+            if (ShareFile.IsShareFile(path))
+                pcFeatures = loadFeatureShareFile(path, externalFeature.FieldNames);
+            else
+                pcFeatures = loadFeatureBinary(path, externalFeature.FieldNames);
+
+            //add this data to the asset (or overwrite if exists)
+            if (!asset.Data.ContainsKey(externalFeature.Timeframe))
+                asset.Data.Add(externalFeature.Timeframe, pcFeatures);
+            else
+                asset.Data[externalFeature.Timeframe] = pcFeatures;
+        }
+
+        private static PreCalculatedFeatures loadFeatureBinary(string path, string[] fieldNames)
+        {
+            //the plain binary file is the date followed by a double for each field
+            PreCalculatedFeatures pcFeatures = new PreCalculatedFeatures();
+
             byte[] bytes = File.ReadAllBytes(path);
 
             //Traverse the byte array to add in the values to the Data attribute of the corresponding bar
@@ -348,7 +366,7 @@ namespace TradingLibrary
                 Dictionary<string, double?> barData = new Dictionary<string, double?>();
                 pcFeatures.Data.Add(dt, barData);
 
-                foreach (string field in externalFeature.FieldNames)
+                foreach (string field in fieldNames)
                 {
                     double val = BitConverter.ToDouble(bytes, i);
                     barData.Add(field, val);
@@ -357,11 +375,36 @@ namespace TradingLibrary
 
             }
 
-            //add this data to the asset (or overwrite if exists)
-            if (!asset.Data.ContainsKey(externalFeature.Timeframe))
-                asset.Data.Add(externalFeature.Timeframe, pcFeatures);
-            else
-                asset.Data[externalFeature.Timeframe] = pcFeatures;
+            return pcFeatures;
+        }
+
+        private static PreCalculatedFeatures loadFeatureShareFile(string path, string[] fieldNames)
+        {
+            //the values are 4 or 8 bytes wide as given in the header
+            PreCalculatedFeatures pcFeatures = new PreCalculatedFeatures();
+
+            using (FileStream fs = new FileStream(path, FileMode.Open, FileAccess.Read, FileShare.ReadWrite))
+            using (BinaryReader reader = new BinaryReader(fs))
+            {
+                ShareFile.Header header = ShareFile.ReadHeader(reader);
+                if (header.Layout != ShareFile.LayoutFeatures || header.FieldCount != fieldNames.Length)
+                    throw new Exception("Feature file " + path + " does not have " + fieldNames.Length + " features.");
+
+                fs.Seek(ShareFile.HeaderSize, SeekOrigin.Begin);
+                for (long r = 0; r < header.Count; r++)
+                {
+                    //convert from python to .net date
+                    DateTime dt = DateTime.FromBinary(reader.ReadInt64() / 100).AddYears(1969);
+
+                    Dictionary<string, double?> barData = new Dictionary<string, double?>();
+                    pcFeatures.Data.Add(dt, barData);
+
+                    foreach (string field in fieldNames)
+                        barData.Add(field, header.ValueWidth == 4 ? reader.ReadSingle() : reader.ReadDouble());
+                }
+            }
+
+            return pcFeatures;
         }
             
         public static void PythonFeatureBuilder(PythonBridge pb, Asset asset, ExternalFeatureData externalFeatureData, MessageDelegate messageDelegate = null)
@@ -395,6 +438,12 @@ namespace TradingLibrary
             string transformedFilename = externalFeatureData.BinaryFilepath.Replace("[ASSET]", asset.Name);
 
             //Bridge python to calculate the data            
+            //float32 halves the size of the results, the reader gets the width from the file
+            if (externalFeatureData.Float32)
+                datasetType += " float32";
+            if (externalFeatureData.Threads > 1)
+                datasetType += " threads=" + externalFeatureData.Threads;
+
             string[] commands = new string[] { datasetType, filename, transformedFilename,
                 externalFeatureData.FeatureCommands };
             pb.RunScript(FeatureBuildPath, commands);
@@ -13,6 +13,10 @@ namespace TradingLibrary
         public string FeatureCommands { get; set; }
         public string[] FieldNames { get; set; }
         public DataFeedType CalculateOn { get; set; }
+        //calculate and store the features as float32 instead of double
+        public bool Float32 { get; set; }
+        //threads to evaluate the features on, more than 1 for long feature commands over a full history
+        public int Threads { get; set; }
 
         public ExternalFeatureData(int timeframe, string binaryFilepath, string[] fieldNames)
         {
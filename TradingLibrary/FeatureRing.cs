@@ -0,0 +1,203 @@
+﻿using System;
+using System.Collections.Generic;
+using System.IO;
+using System.IO.MemoryMappedFiles;
+using System.Threading;
+
+namespace TradingLibrary
+{
+    //Reads the newest features straight from a feature ring share file (layout 3) that python keeps up to date, see
+    //python_scripts/share_file.py. The file is mapped once and each value is read from the mapped memory so there is
+    //no parsing, no allocation and the memory used stays the same however long the session runs
+    //Python renames a new ring over the file when the capacity changes and flags the old one as replaced, the path is
+    //mapped again the next time it is read
+    public class FeatureRing : IDisposable
+    {
+        //byte offset of the count, the sequence follows straight after it
+        const int CountOffset = 40;
+        const int SequenceOffset = 48;
+        //times a read is tried again when python changes the ring part way through it
+        const int ReadRetries = 100;
+
+        public string Path { get; private set; }
+        public long Capacity { get; private set; }
+        public int ValueWidth { get; private set; }
+
+        private MemoryMappedFile file;
+        private MemoryMappedViewAccessor view;
+        private Dictionary<string, int> fieldIndexes = new Dictionary<string, int>();
+        private int recordSize;
+        //held while the file is mapped again so no read uses a view that is being disposed
+        private object mapLock = new object();
+
+        public FeatureRing(string path, string[] labels)
+        {
+            Path = path;
+            for (int i = 0; i < labels.Length; i++)
+                fieldIndexes[labels[i]] = i;
+
+            if (!map())
+                throw new Exception("Share file " + path + " is being replaced.");
+        }
+
+        private bool map()
+        {
+            //Maps the file at the path. Returns false if it is still the old file python is about to rename over
+            ShareFile.Header header;
+            using (FileStream fs = new FileStream(Path, FileMode.Open, FileAccess.Read, FileShare.ReadWrite | FileShare.Delete))
+            using (BinaryReader reader = new BinaryReader(fs))
+                header = ShareFile.ReadHeader(reader);
+
+            if (header.Replaced)
+                return false;
+            if (header.Layout != ShareFile.LayoutFeatureRing)
+                throw new Exception("Share file " + Path + " is not a feature ring.");
+            if (header.FieldCount != fieldIndexes.Count)
+                throw new Exception("Share file " + Path + " has " + header.FieldCount + " features but " + fieldIndexes.Count + " labels were given.");
+
+            //the share mode lets python rename a new ring over the file while it is mapped
+            FileStream stream = new FileStream(Path, FileMode.Open, FileAccess.Read, FileShare.ReadWrite | FileShare.Delete);
+            MemoryMappedFile newFile = MemoryMappedFile.CreateFromFile(stream, null, 0, MemoryMappedFileAccess.Read, HandleInheritability.None, false);
+            MemoryMappedViewAccessor newView = newFile.CreateViewAccessor(0, ShareFile.HeaderSize + header.Capacity * header.RecordSize, MemoryMappedFileAccess.Read);
+
+            Dispose();
+            file = newFile;
+            view = newView;
+            Capacity = header.Capacity;
+            ValueWidth = header.ValueWidth;
+            recordSize = header.RecordSize;
+            return true;
+        }
+
+        private void remapIfReplaced()
+        {
+            //the old mapping keeps working until the new file is there so it is read until then
+            if (view.ReadInt32(ShareFile.ReplacedOffset) != 0)
+                map();
+        }
+
+        public long Count
+        {
+            //total number of rows python has written, the ring holds the newest Capacity of them
+            get { return view.ReadInt64(CountOffset); }
+        }
+
+        private long offset(long row)
+        {
+            return ShareFile.HeaderSize + (row % Capacity) * recordSize;
+        }
+
+        private DateTime readDate(long row)
+        {
+            //convert from python to .net date
+            return DateTime.FromBinary(view.ReadInt64(offset(row)) / 100).AddYears(1969);
+        }
+
+        private double readValue(long row, int field)
+        {
+            long position = offset(row) + 8 + field * ValueWidth;
+            return ValueWidth == 4 ? view.ReadSingle(position) : view.ReadDouble(position);
+        }
+
+        public bool TryGetValue(DateTime openTime, string label, out double? value)
+        {
+            //Finds the row for the bar searching back from the newest, the newest bar is usually the one wanted.
+            //Returns false if the bar isn't in the ring
+            value = null;
+            int field;
+            if (!fieldIndexes.TryGetValue(label, out field))
+                throw new Exception("Feature ring " + Path + " has no feature " + label);
+
+            lock (mapLock)
+            {
+                remapIfReplaced();
+                for (int attempt = 0; attempt < ReadRetries; attempt++)
+                {
+                    //python makes the sequence odd while it writes and even again after
+                    long sequence = view.ReadInt64(SequenceOffset);
+                    if (sequence % 2 == 1)
+                    {
+                        Thread.Yield();
+                        continue;
+                    }
+                    Thread.MemoryBarrier();
+
+                    long count = view.ReadInt64(CountOffset);
+                    long oldest = Math.Max(count - Capacity, 0);
+                    bool found = false;
+                    double raw = double.NaN;
+                    for (long row = count - 1; row >= oldest; row--)
+                    {
+                        DateTime date = readDate(row);
+                        if (date == openTime)
+                        {
+                            raw = readValue(row, field);
+                            found = true;
+                            break;
+                        }
+                        //rows are oldest to newest so an older date means the bar isn't there
+                        if (date < openTime)
+                            break;
+                    }
+
+                    Thread.MemoryBarrier();
+                    if (view.ReadInt64(SequenceOffset) != sequence)
+                        continue;
+
+                    if (found && !double.IsNaN(raw))
+                        value = raw;
+                    return found;
+                }
+            }
+            throw new Exception("Feature ring " + Path + " kept changing while it was read.");
+        }
+
+        public int ReadLatest(DateTime[] dates, double[,] values)
+        {
+            //Copies the newest rows into buffers the caller keeps between reads, newest first the same as the csv results.
+            //values is rows x features. Returns the number of rows copied
+            lock (mapLock)
+            {
+                remapIfReplaced();
+                for (int attempt = 0; attempt < ReadRetries; attempt++)
+                {
+                    long sequence = view.ReadInt64(SequenceOffset);
+                    if (sequence % 2 == 1)
+                    {
+                        Thread.Yield();
+                        continue;
+                    }
+                    Thread.MemoryBarrier();
+
+                    long count = view.ReadInt64(CountOffset);
+                    int rows = (int)Math.Min(Math.Min(dates.Length, values.GetLength(0)), Math.Min(count, Capacity));
+                    for (int i = 0; i < rows; i++)
+                    {
+                        long row = count - 1 - i;
+                        dates[i] = readDate(row);
+                        for (int field = 0; field < values.GetLength(1); field++)
+                            values[i, field] = readValue(row, field);
+                    }
+
+                    Thread.MemoryBarrier();
+                    if (view.ReadInt64(SequenceOffset) == sequence)
+                        return rows;
+                }
+            }
+            throw new Exception("Feature ring " + Path + " kept changing while it was read.");
+        }
+
+        public void Dispose()
+        {
+            lock (mapLock)
+            {
+                if (view != null)
+                    view.Dispose();
+                if (file != null)
+                    file.Dispose();
+                view = null;
+                file = null;
+            }
+        }
+    }
+}
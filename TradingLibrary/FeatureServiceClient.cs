@@ -0,0 +1,170 @@
+﻿using System;
+using System.Collections.Generic;
+using System.IO;
+using System.Net.Sockets;
+using System.Text;
+using System.Threading;
+using System.Threading.Tasks;
+
+namespace TradingLibrary
+{
+    public class FeatureServiceResponse
+    {
+        public string Id;
+        //OK, ERROR, TIMEOUT or REJECTED
+        public string Status;
+        public string[] Lines;
+
+        public bool Ok
+        {
+            get { return Status == FeatureServiceClient.StatusOk; }
+        }
+    }
+
+    public class FeatureServiceClient : IDisposable
+    {
+        //Client of python_scripts/feature_service.py. Many requests can be in flight on the one connection and each
+        //completes when its response arrives so a slow symbol doesn't hold up the others. The service is reached over
+        //tcp on the loopback address as .NET Framework has no Unix sockets
+        public const string StatusOk = "OK";
+        public const string StatusError = "ERROR";
+        public const string StatusTimeout = "TIMEOUT";
+        public const string StatusRejected = "REJECTED";
+
+        public const int DefaultPort = 47800;
+
+        private TcpClient client;
+        private StreamReader reader;
+        private StreamWriter writer;
+        private object writeLock = new object();
+        private long nextId = 0;
+        private Dictionary<string, TaskCompletionSource<FeatureServiceResponse>> pending = new Dictionary<string, TaskCompletionSource<FeatureServiceResponse>>();
+        private Thread readThread;
+
+        public FeatureServiceClient(string host = "127.0.0.1", int port = DefaultPort)
+        {
+            client = new TcpClient(host, port);
+            client.NoDelay = true;
+            NetworkStream stream = client.GetStream();
+            reader = new StreamReader(stream, new UTF8Encoding(false));
+            writer = new StreamWriter(stream, new UTF8Encoding(false)) { NewLine = "\n" };
+
+            readThread = new Thread(readResponses) { IsBackground = true };
+            readThread.Start();
+        }
+
+        public bool Connected
+        {
+            get { return client != null && client.Connected; }
+        }
+
+        public Task<FeatureServiceResponse> SendAsync(string command, string[] lines = null, double timeout = 0)
+        {
+            //Sends a request and returns straight away, the task completes when the service responds
+            string id = Interlocked.Increment(ref nextId).ToString();
+            TaskCompletionSource<FeatureServiceResponse> response = new TaskCompletionSource<FeatureServiceResponse>(TaskCreationOptions.RunContinuationsAsynchronously);
+            lock (pending)
+                pending[id] = response;
+
+            StringBuilder frame = new StringBuilder(id + " " + command);
+            if (timeout > 0)
+                frame.Append(" " + timeout.ToString(System.Globalization.CultureInfo.InvariantCulture));
+            frame.Append("\n");
+            if (lines != null)
+            {
+                foreach (string line in lines)
+                    frame.Append(line + "\n");
+            }
+
+            try
+            {
+                lock (writeLock)
+                {
+                    writer.Write(frame.ToString());
+                    writer.Flush();
+                }
+            }
+            catch (Exception e)
+            {
+                lock (pending)
+                    pending.Remove(id);
+                response.TrySetException(e);
+            }
+            return response.Task;
+        }
+
+        public async Task<string[]> RequestFeaturesAsync(string[] commands, double timeout = 0)
+        {
+            //Runs the same 4 request lines as PythonBridge.RunServerRequest, anything but OK is thrown
+            FeatureServiceResponse response = await SendAsync("features", commands, timeout).ConfigureAwait(false);
+            if (!response.Ok)
+                throw new Exception(response.Status + " " + string.Join(" ", response.Lines));
+            return response.Lines;
+        }
+
+        public async Task<string> HealthAsync()
+        {
+            //json of the service health
+            FeatureServiceResponse response = await SendAsync("health").ConfigureAwait(false);
+            return response.Lines.Length > 0 ? response.Lines[0] : null;
+        }
+
+        public async Task<string> MetricsAsync()
+        {
+            //json of the request counts and latencies
+            FeatureServiceResponse response = await SendAsync("metrics").ConfigureAwait(false);
+            return response.Lines.Length > 0 ? response.Lines[0] : null;
+        }
+
+        private void readResponses()
+        {
+            //reads the response frames as they arrive and completes the request with the same id
+            Exception error = null;
+            try
+            {
+                string header;
+                while ((header = reader.ReadLine()) != null)
+                {
+                    string[] parts = header.Split(' ');
+                    List<string> lines = new List<string>();
+                    string line;
+                    while ((line = reader.ReadLine()) != null && line != PythonBridge.EndOfFrame)
+                        lines.Add(line);
+                    if (line == null || parts.Length < 2)
+                        break;
+
+                    FeatureServiceResponse response = new FeatureServiceResponse() { Id = parts[0], Status = parts[1], Lines = lines.ToArray() };
+                    TaskCompletionSource<FeatureServiceResponse> request;
+                    lock (pending)
+                    {
+                        if (pending.TryGetValue(response.Id, out request))
+                            pending.Remove(response.Id);
+                    }
+                    if (request != null)
+                        request.TrySetResult(response);
+                }
+            }
+            catch (Exception e)
+            {
+                error = e;
+            }
+
+            //fail anything still waiting once the connection has gone
+            lock (pending)
+            {
+                foreach (TaskCompletionSource<FeatureServiceResponse> request in pending.Values)
+                    request.TrySetException(error ?? new Exception("Feature service closed the connection"));
+                pending.Clear();
+            }
+        }
+
+        public void Dispose()
+        {
+            if (client == null)
+                return;
+            client.Close();
+            readThread.Join(5000);
+            client = null;
+        }
+    }
+}
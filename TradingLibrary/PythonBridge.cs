@@ -8,12 +8,37 @@ namespace TradingLibrary
     {
         public string PythonPath = null;
 
+        //marks the end of each response when a script is running in server mode
+        public const string EndOfFrame = "END";
+        public const string ErrorPrefix = "ERROR ";
+        //the server couldn't read a request and exits after this one frame
+        public const string FatalPrefix = "ERROR FATAL ";
+        //stderr lines with the timings of a request, see python_scripts/metrics.py
+        public const string MetricsPrefix = "METRICS ";
+
+        //turns on the metrics of every request by setting NITRADE_METRICS for the python process
+        //to stderr or the path of a metrics file. Needs a restart of the server to take effect
+        public string Metrics = null;
+        //called with the json of each METRICS line python writes to stderr
+        public MessageDelegate MetricsReceived = null;
+        public string LastMetrics = null;
+
         private string processError;
 
+        //long running python process used by the server mode
+        private Process serverProcess = null;
+        private string serverPath = null;
+        private object serverLock = new object();
+
         public PythonBridge(string pythonPath) {
             PythonPath = pythonPath;
         }
 
+        public bool ServerRunning
+        {
+            get { return serverProcess != null && !serverProcess.HasExited; }
+        }
+
         private Process getPythonProcess(string executeName)
         {
             //Start a process to launch Python to read bar data and build other timeframes
@@ -31,11 +56,21 @@ namespace TradingLibrary
                 CreateNoWindow = false,
 
             };
+            if (Metrics != null)
+                p.StartInfo.EnvironmentVariables["NITRADE_METRICS"] = Metrics;
 
             //read errors async
             processError = "";
             p.ErrorDataReceived += new DataReceivedEventHandler((sender, e) =>
             {
+                //metrics aren't errors so they are passed on instead of failing the script
+                if (e.Data != null && e.Data.StartsWith(MetricsPrefix))
+                {
+                    LastMetrics = e.Data.Substring(MetricsPrefix.Length);
+                    if (MetricsReceived != null)
+                        MetricsReceived(LastMetrics, MessageType.Log);
+                    return;
+                }
                 processError += e.Data;
             });
 
@@ -67,5 +102,126 @@ namespace TradingLibrary
             return output.ToArray();
 
         }
+
+        public void StartServer(string path)
+        {
+            //Start the script once in server mode so the interpreter and imports are only loaded once
+            lock (serverLock)
+            {
+                if (ServerRunning)
+                {
+                    if (serverPath == path)
+                        return;
+                    StopServer();
+                }
+
+                serverProcess = getPythonProcess(path);
+                serverPath = path;
+                serverProcess.StandardInput.WriteLine("server");
+                serverProcess.StandardInput.Flush();
+            }
+        }
+
+        public string[] RunServerRequest(string path, string[] commands)
+        {
+            //Sends a request frame to the running server and reads the response up to the end of frame marker
+            //the server is started on first use and restarted if it has died
+            lock (serverLock)
+            {
+                if (!ServerRunning || serverPath != path)
+                    StartServer(path);
+
+                foreach (string command in commands)
+                    serverProcess.StandardInput.WriteLine(command);
+                serverProcess.StandardInput.Flush();
+
+                string[] output = readFrame();
+                if (output.Length > 0 && output[0].StartsWith(ErrorPrefix))
+                    throw new Exception(output[0].Substring(ErrorPrefix.Length));
+
+                return output;
+            }
+        }
+
+        public string[][] RunServerBatch(string path, List<string[]> jobs, int workers = 0)
+        {
+            //Sends many request frames as one batch so they are answered in a single round trip. The server can spread
+            //the jobs over workers processes. One response is returned per job in the same order as the jobs, a job that
+            //failed has a response starting with the error prefix rather than throwing so the other jobs are kept
+            lock (serverLock)
+            {
+                if (!ServerRunning || serverPath != path)
+                    StartServer(path);
+
+                serverProcess.StandardInput.WriteLine("batch");
+                serverProcess.StandardInput.WriteLine(jobs.Count + " " + workers);
+                foreach (string[] commands in jobs)
+                {
+                    foreach (string command in commands)
+                        serverProcess.StandardInput.WriteLine(command);
+                }
+                serverProcess.StandardInput.Flush();
+
+                string[][] responses = new string[jobs.Count][];
+                for (int i = 0; i < jobs.Count; i++)
+                {
+                    responses[i] = readFrame();
+
+                    //no more frames follow, the server is started again on the next request
+                    if (responses[i].Length > 0 && responses[i][0].StartsWith(FatalPrefix))
+                    {
+                        StopServer();
+                        throw new Exception(responses[i][0].Substring(ErrorPrefix.Length));
+                    }
+                }
+
+                return responses;
+            }
+        }
+
+        private string[] readFrame()
+        {
+            //reads the server response up to the end of frame marker
+            List<string> output = new List<string>();
+            string line;
+            while ((line = serverProcess.StandardOutput.ReadLine()) != null && line != EndOfFrame)
+                output.Add(line);
+
+            //process exited before completing the frame
+            if (line == null)
+            {
+                string error = processError;
+                StopServer();
+                throw new Exception("Python server exited unexpectedly. " + error);
+            }
+
+            return output.ToArray();
+        }
+
+        public void StopServer()
+        {
+            lock (serverLock)
+            {
+                if (serverProcess == null)
+                    return;
+
+                try
+                {
+                    if (!serverProcess.HasExited)
+                    {
+                        serverProcess.StandardInput.WriteLine("stop");
+                        serverProcess.StandardInput.Flush();
+                        if (!serverProcess.WaitForExit(5000))
+                            serverProcess.Kill();
+                    }
+                }
+                finally
+                {
+                    serverProcess.Dispose();
+                    serverProcess = null;
+                    serverPath = null;
+                }
+            }
+        }
     }
 }
@@ -0,0 +1,325 @@
+﻿using System;
+using System.Collections.Generic;
+using System.IO;
+using System.Text;
+
+namespace TradingLibrary
+{
+    //Memory mapped exchange format shared with python_scripts/share_file.py
+    //A 64 byte header followed by fixed size records that are only ever appended. The count in the header is updated
+    //after the records are written so a reader never sees a partly written record
+    //A file that has to be made again is written under a temporary name and renamed over the old one, never truncated
+    //in place, and the old file is flagged as replaced so a reader that keeps it mapped maps the path again
+    //A feature ring (layout 3) keeps only the newest records and is read with FeatureRing
+    public static class ShareFile
+    {
+        public const string Magic = "NTSHARE1";
+        public const int Version = 1;
+        public const int HeaderSize = 64;
+
+        public const int LayoutWhole = 0;
+        public const int LayoutSingle = 1;
+        public const int LayoutFeatures = 2;
+        public const int LayoutFeatureRing = 3;
+
+        //byte offset of the count, the sequence follows straight after it
+        const int CountOffset = 40;
+        //byte offset of the flag set on a file once a new one has been renamed over it
+        public const int ReplacedOffset = 28;
+        const string TempExtension = ".tmp";
+
+        public class Header
+        {
+            public int Version { get; set; }
+            public int Layout { get; set; }
+            public int FieldCount { get; set; }
+            public int ValueWidth { get; set; }
+            public bool Replaced { get; set; }
+            public long Capacity { get; set; }
+            public long Count { get; set; }
+            public long Sequence { get; set; }
+
+            public int RecordSize
+            {
+                get
+                {
+                    if (Layout == LayoutWhole)
+                        return 28;
+                    else if (Layout == LayoutSingle)
+                        return 12;
+                    return 8 + FieldCount * ValueWidth;
+                }
+            }
+        }
+
+        public static bool IsShareFile(string path)
+        {
+            if (!File.Exists(path))
+                return false;
+
+            using (FileStream fs = new FileStream(path, FileMode.Open, FileAccess.Read, FileShare.ReadWrite))
+            {
+                byte[] magic = new byte[Magic.Length];
+                if (fs.Read(magic, 0, magic.Length) != magic.Length)
+                    return false;
+                return Encoding.ASCII.GetString(magic) == Magic;
+            }
+        }
+
+        public static Header ReadHeader(BinaryReader reader)
+        {
+            reader.BaseStream.Seek(0, SeekOrigin.Begin);
+            string magic = Encoding.ASCII.GetString(reader.ReadBytes(Magic.Length));
+            if (magic != Magic)
+                throw new Exception("Not a share file.");
+
+            Header header = new Header();
+            header.Version = reader.ReadInt32();
+            if (header.Version > Version)
+                throw new Exception("Unsupported share file version " + header.Version);
+
+            reader.ReadInt32(); //header size
+            header.Layout = reader.ReadInt32();
+            header.FieldCount = reader.ReadInt32();
+            header.ValueWidth = reader.ReadInt32();
+            header.Replaced = reader.ReadInt32() != 0;
+            header.Capacity = reader.ReadInt64();
+            header.Count = reader.ReadInt64();
+            header.Sequence = reader.ReadInt64();
+            return header;
+        }
+
+        private static int layoutFromType(DataFeedType type)
+        {
+            if (type == DataFeedType.Ask || type == DataFeedType.Bid)
+                return LayoutWhole;
+            if (type == DataFeedType.Both)
+                throw new Exception("Share files only hold the bid or ask OHLC, not both.");
+            return LayoutSingle;
+        }
+
+        private static void writeHeader(BinaryWriter writer, int layout, long capacity, long count, long sequence)
+        {
+            writer.Seek(0, SeekOrigin.Begin);
+            writer.Write(Encoding.ASCII.GetBytes(Magic));
+            writer.Write(Version);
+            writer.Write(HeaderSize);
+            writer.Write(layout);
+            writer.Write(0); //field count
+            writer.Write(0); //value width
+            writer.Write(0); //replaced
+            writer.Write(capacity);
+            writer.Write(count);
+            writer.Write(sequence);
+            writer.Write((long)0); //padding
+        }
+
+        private static void replaceFile(string tempPath, string path)
+        {
+            //moves the finished temporary file over the share file so the old file is never truncated in place
+            if (!File.Exists(path))
+            {
+                File.Move(tempPath, path);
+                return;
+            }
+
+            //flag the old file so anything that has it mapped knows to map the new one
+            if (IsShareFile(path))
+            {
+                using (FileStream fs = new FileStream(path, FileMode.Open, FileAccess.Write, FileShare.ReadWrite))
+                using (BinaryWriter writer = new BinaryWriter(fs))
+                {
+                    writer.Seek(ReplacedOffset, SeekOrigin.Begin);
+                    writer.Write(1);
+                }
+            }
+            File.Replace(tempPath, path, null);
+        }
+
+        private static void writeBar(BinaryWriter writer, Bar bar, DataFeedType type)
+        {
+            //convert from python to .net date
+            writer.Write(bar.OpenTime.AddYears(-1969).ToBinary() * 100);
+            switch (type)
+            {
+                case DataFeedType.Ask:
+                    writer.Write(bar.AskOpen);
+                    writer.Write(bar.AskClose);
+                    writer.Write(bar.AskHigh);
+                    writer.Write(bar.AskLow);
+                    writer.Write(bar.Volume);
+                    break;
+                case DataFeedType.Bid:
+                    writer.Write(bar.BidOpen);
+                    writer.Write(bar.BidClose);
+                    writer.Write(bar.BidHigh);
+                    writer.Write(bar.BidLow);
+                    writer.Write(bar.Volume);
+                    break;
+                case DataFeedType.BidOpen:
+                    writer.Write(bar.BidOpen);
+                    break;
+                case DataFeedType.BidClose:
+                    writer.Write(bar.BidClose);
+                    break;
+                case DataFeedType.BidHigh:
+                    writer.Write(bar.BidHigh);
+                    break;
+                case DataFeedType.BidLow:
+                    writer.Write(bar.BidLow);
+                    break;
+                case DataFeedType.AskOpen:
+                    writer.Write(bar.AskOpen);
+                    break;
+                case DataFeedType.AskClose:
+                    writer.Write(bar.AskClose);
+                    break;
+                case DataFeedType.AskHigh:
+                    writer.Write(bar.AskHigh);
+                    break;
+                case DataFeedType.AskLow:
+                    writer.Write(bar.AskLow);
+                    break;
+                case DataFeedType.Volume:
+                    writer.Write((float)bar.Volume);
+                    break;
+            }
+        }
+
+        public static void WriteBars(string path, Bar[] bars, DataFeedType type, long capacity = 0)
+        {
+            //Creates the share file with room for capacity bars. Bars must be ordered oldest to newest.
+            int layout = layoutFromType(type);
+            capacity = Math.Max(capacity, bars.Length);
+
+            string tempPath = path + TempExtension;
+            using (FileStream fs = new FileStream(tempPath, FileMode.Create, FileAccess.Write, FileShare.None))
+            using (BinaryWriter writer = new BinaryWriter(fs))
+            {
+                writeHeader(writer, layout, capacity, 0, 0);
+                foreach (Bar bar in bars)
+                    writeBar(writer, bar, type);
+
+                //preallocate the rest of the records
+                writer.Flush();
+                Header header = new Header() { Layout = layout };
+                fs.SetLength(HeaderSize + capacity * header.RecordSize);
+
+                writer.Seek(CountOffset, SeekOrigin.Begin);
+                writer.Write((long)bars.Length);
+                writer.Write((long)1);
+            }
+            replaceFile(tempPath, path);
+        }
+
+        public static void AppendBars(string path, Bar[] bars, DataFeedType type, long maxCount = 0)
+        {
+            //Adds bars after the last written bar. Only the new bars are written so the I/O is the size of the new data.
+            //When the file is full it is created again with the newest maxCount bars (all of them if maxCount is 0)
+            //and room for as many again, so with a maxCount the file never grows past twice that over a long session.
+            if (!IsShareFile(path))
+            {
+                WriteBars(path, bars, type, Math.Max(bars.Length, maxCount) * 2);
+                return;
+            }
+
+            Header header;
+            using (FileStream fs = new FileStream(path, FileMode.Open, FileAccess.ReadWrite, FileShare.ReadWrite))
+            using (BinaryReader reader = new BinaryReader(fs))
+            using (BinaryWriter writer = new BinaryWriter(fs))
+            {
+                header = ReadHeader(reader);
+                if (header.Layout != layoutFromType(type))
+                    throw new Exception("Share file " + path + " has a different layout.");
+
+                if (header.Count + bars.Length <= header.Capacity)
+                {
+                    fs.Seek(HeaderSize + header.Count * header.RecordSize, SeekOrigin.Begin);
+                    foreach (Bar bar in bars)
+                        writeBar(writer, bar, type);
+                    writer.Flush();
+
+                    //update the count last
+                    writer.Seek(CountOffset, SeekOrigin.Begin);
+                    writer.Write(header.Count + bars.Length);
+                    writer.Write(header.Sequence + 1);
+                    return;
+                }
+            }
+
+            //full so copy the newest records into a new file, dropping the oldest if there are more than maxCount
+            long total = header.Count + bars.Length;
+            long kept = maxCount > 0 ? Math.Min(total, Math.Max(maxCount, bars.Length)) : total;
+            long keptExisting = kept - bars.Length;
+            byte[] existing;
+            using (FileStream fs = new FileStream(path, FileMode.Open, FileAccess.Read, FileShare.ReadWrite))
+            {
+                existing = new byte[keptExisting * header.RecordSize];
+                fs.Seek(HeaderSize + (header.Count - keptExisting) * header.RecordSize, SeekOrigin.Begin);
+                fs.Read(existing, 0, existing.Length);
+            }
+
+            long capacity = kept * 2;
+            string tempPath = path + TempExtension;
+            using (FileStream fs = new FileStream(tempPath, FileMode.Create, FileAccess.Write, FileShare.None))
+            using (BinaryWriter writer = new BinaryWriter(fs))
+            {
+                writeHeader(writer, header.Layout, capacity, 0, header.Sequence);
+                writer.Write(existing);
+                foreach (Bar bar in bars)
+                    writeBar(writer, bar, type);
+                writer.Flush();
+                fs.SetLength(HeaderSize + capacity * header.RecordSize);
+
+                writer.Seek(CountOffset, SeekOrigin.Begin);
+                writer.Write(kept);
+                writer.Write(header.Sequence + 1);
+            }
+            replaceFile(tempPath, path);
+        }
+
+        public static PreCalculatedFeatures ReadFeatures(string path, string[] labels, int count)
+        {
+            //Reads the newest count rows of features that python has written to the share file
+            PreCalculatedFeatures pcFeatures = new PreCalculatedFeatures();
+
+            using (FileStream fs = new FileStream(path, FileMode.Open, FileAccess.Read, FileShare.ReadWrite))
+            using (BinaryReader reader = new BinaryReader(fs))
+            {
+                Header header = ReadHeader(reader);
+                if (header.Layout != LayoutFeatures)
+                    throw new Exception("Share file " + path + " does not contain features.");
+                if (header.FieldCount != labels.Length)
+                    throw new Exception("Share file " + path + " has " + header.FieldCount + " features but " + labels.Length + " labels were given.");
+
+                long start = Math.Max(header.Count - count, 0);
+                fs.Seek(HeaderSize + start * header.RecordSize, SeekOrigin.Begin);
+
+                List<KeyValuePair<DateTime, Dictionary<string, double?>>> rows = new List<KeyValuePair<DateTime, Dictionary<string, double?>>>();
+                for (long i = start; i < header.Count; i++)
+                {
+                    //convert from python to .net date
+                    DateTime dt = DateTime.FromBinary(reader.ReadInt64() / 100).AddYears(1969);
+
+                    Dictionary<string, double?> featureData = new Dictionary<string, double?>();
+                    foreach (string field in labels)
+                    {
+                        double val = header.ValueWidth == 4 ? reader.ReadSingle() : reader.ReadDouble();
+                        if (double.IsNaN(val))
+                            featureData.Add(field, null);
+                        else
+                            featureData.Add(field, val);
+                    }
+
+                    rows.Add(new KeyValuePair<DateTime, Dictionary<string, double?>>(dt, featureData));
+                }
+
+                //newest first the same as the csv results
+                for (int i = rows.Count - 1; i >= 0; i--)
+                    pcFeatures.Data[rows[i].Key] = rows[i].Value;
+            }
+
+            return pcFeatures;
+        }
+    }
+}
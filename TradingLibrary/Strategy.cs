@@ -261,12 +261,26 @@ namespace TradingLibrary
 
         public double? GetData(string assetName, int timeframe, string dataName, int offset = 1)
         {
-            if (!Datasets.ContainsKey(timeframe) || !Assets.ContainsKey(assetName) || !Assets[assetName].Data.ContainsKey(timeframe))                
+            if (!Datasets.ContainsKey(timeframe) || !Assets.ContainsKey(assetName))
                 return null;
 
             //get the open time of the bar with the passed offset
             Bar bar = Datasets[timeframe][offset];
 
+            //live features are read from the python feature ring without copying them
+            FeatureRing ring;
+            bool live;
+            lock (Assets[assetName].FeatureRings)
+                live = Assets[assetName].FeatureRings.TryGetValue(timeframe, out ring);
+            if (live)
+            {
+                double? value;
+                return ring.TryGetValue(bar.OpenTime, dataName, out value) ? value : null;
+            }
+
+            if (!Assets[assetName].Data.ContainsKey(timeframe))
+                return null;
+
             if (!Assets[assetName].Data[timeframe].Data.ContainsKey(bar.OpenTime))
                 return null;
 
@@ -0,0 +1,77 @@
+﻿using System;
+using System.Diagnostics;
+using System.Threading;
+using System.Threading.Tasks;
+using Microsoft.VisualStudio.TestTools.UnitTesting;
+using TradingLibrary;
+
+namespace UnitTests
+{
+    [TestClass]
+    public class FeatureServiceTests
+    {
+        const string PythonPath = @"C:\Users\matth\Anaconda3\python";
+        const string ServicePath = "\"G:\\My Drive\\C Sharp Apps\\LinuxLiveTrader\\LinuxLiveTrader\\bin\\Debug\\feature_service.py\"";
+        const string TestData = @"C:\ForexData\TestData\EURUSD_m60_Share_live_test.bin";
+        const int Port = 47810;
+
+        static Process service;
+
+        [ClassInitialize]
+        public static void StartService(TestContext context)
+        {
+            //the service runs locally without any broker, give it a moment to start listening
+            service = Process.Start(new ProcessStartInfo(PythonPath, ServicePath + " serve --address tcp:127.0.0.1:" + Port + " --max-queue 16")
+            {
+                UseShellExecute = false,
+                CreateNoWindow = true
+            });
+            Thread.Sleep(3000);
+        }
+
+        [ClassCleanup]
+        public static void StopService()
+        {
+            if (service != null && !service.HasExited)
+                service.Kill();
+        }
+
+        [TestMethod]
+        public void HealthIsOk()
+        {
+            using (FeatureServiceClient client = new FeatureServiceClient("127.0.0.1", Port))
+            {
+                string health = client.HealthAsync().Result;
+                Assert.IsTrue(health.Contains("\"status\": \"ok\""), "Feature service is not healthy " + health);
+            }
+        }
+
+        [TestMethod]
+        public void ConcurrentRequestsAllReturn()
+        {
+            //the same request as PythonBridgeTests sent many times at once on the one connection
+            string[] commands = new string[] { "whole nocache", TestData, "200", "SMA(20,close);ATR(3,close,high,low);VOLATILITY_LOG_MA(12,high,low);VOLUME_LOG_MA(12,volume);BBANDS(20,1.8,1,close);" };
+            using (FeatureServiceClient client = new FeatureServiceClient("127.0.0.1", Port))
+            {
+                Task<string[]>[] requests = new Task<string[]>[8];
+                for (int i = 0; i < requests.Length; i++)
+                    requests[i] = client.RequestFeaturesAsync(commands);
+                Task.WaitAll(requests);
+
+                foreach (Task<string[]> request in requests)
+                    Assert.AreEqual(string.Join("\n", requests[0].Result), string.Join("\n", request.Result), "Concurrent requests returned different results");
+                Assert.AreEqual(200, requests[0].Result.Length);
+            }
+        }
+
+        [TestMethod]
+        public void UnknownFeatureIsAnError()
+        {
+            using (FeatureServiceClient client = new FeatureServiceClient("127.0.0.1", Port))
+            {
+                FeatureServiceResponse response = client.SendAsync("features", new string[] { "whole", TestData, "10", "NOPE(1,close)" }).Result;
+                Assert.AreEqual(FeatureServiceClient.StatusError, response.Status);
+            }
+        }
+    }
+}
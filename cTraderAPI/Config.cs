@@ -10,6 +10,8 @@ namespace cTraderAPI
         public string ApiHost { get; set; }
         public int ApiPort { get; set; }
         public string PythonPath { get; set; }
+        //optional, stderr or a file path to record the timings of the python feature requests
+        public string PythonMetrics { get; set; }
 
         private void Init()
         {
@@ -49,6 +51,8 @@ namespace cTraderAPI
                     ApiPort = Convert.ToInt32(parts[1]);
                 else if (parts[0] == "PythonPath")
                     PythonPath = parts[1];
+                else if (parts[0] == "PythonMetrics")
+                    PythonMetrics = parts[1];
 
             }
 